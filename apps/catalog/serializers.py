@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from django.db import models as django_models
+from django.db.models.manager import BaseManager
 from .models import Category, Product, ProductVariant
 
 
@@ -27,6 +27,62 @@ class CategorySerializer(serializers.ModelSerializer):
         return obj.products.filter(is_active=True).count()
 
 
+class PrefetchedVariantField(serializers.PrimaryKeyRelatedField):
+    """
+    Variant lookup that reads from the batch loaded by prefetch_variants()
+    in the parent serializer instead of one query per line
+    """
+    
+    def to_internal_value(self, data):
+        prefetched = self.context.get('prefetched_variants')
+        if prefetched is not None:
+            try:
+                return prefetched[int(data)]
+            except (KeyError, TypeError, ValueError):
+                pass
+        return super().to_internal_value(data)
+
+
+def prefetch_variants(serializer, data, items_field='items'):
+    """
+    Load every variant referenced by data[items_field] with one query and
+    stash them in the serializer context for PrefetchedVariantField
+    """
+    items = data.get(items_field) if hasattr(data, 'get') else None
+    if isinstance(items, list):
+        variant_ids = set()
+        for item in items:
+            try:
+                variant_ids.add(int(item['variant']))
+            except (KeyError, TypeError, ValueError):
+                continue
+        serializer.context['prefetched_variants'] = ProductVariant.objects.in_bulk(variant_ids)
+
+
+def prefetch_availability(serializer, variant_ids):
+    """
+    Look up the total available quantity of many variants in the inventory
+    availability cache with one batch and keep it in the serializer context
+    (variant_availability) for stock_available. Returns that mapping.
+    """
+    from apps.inventory.cache import availability_cache
+    
+    known = serializer.context.setdefault('variant_availability', {})
+    missing = [variant_id for variant_id in variant_ids if variant_id not in known]
+    if missing:
+        known.update(availability_cache.get_many(missing))
+    return known
+
+
+class ProductVariantListSerializer(serializers.ListSerializer):
+    """Fetches the availability of the whole page of variants in one cache batch"""
+    
+    def to_representation(self, data):
+        variants = list(data.all() if isinstance(data, BaseManager) else data)
+        prefetch_availability(self, [variant.id for variant in variants])
+        return super().to_representation(variants)
+
+
 class ProductVariantSerializer(serializers.ModelSerializer):
     """Serializer for product variants"""
     
@@ -41,18 +97,16 @@ class ProductVariantSerializer(serializers.ModelSerializer):
             'weight', 'stock_available', 'is_active', 'created_at'
         ]
         read_only_fields = ['created_at']
+        list_serializer_class = ProductVariantListSerializer
     
     def get_stock_available(self, obj):
         """Check if variant has available stock across all locations"""
-        try:
-            from apps.inventory.models import StockRecord
-            total_stock = StockRecord.objects.filter(variant=obj).aggregate(
-                total=django_models.Sum('quantity')
-            )['total'] or 0
-            return total_stock > 0
-        except:
-            # Return None if inventory app not yet set up
-            return None
+        # Lists prefetch their page from the availability cache; a variant
+        # nested one per row elsewhere reads its select_related('stock_summary')
+        if obj.id not in self.context.get('variant_availability', {}) and ProductVariant.stock_summary.is_cached(obj):
+            summary = getattr(obj, 'stock_summary', None)
+            return summary is not None and summary.total_available > 0
+        return prefetch_availability(self, [obj.id])[obj.id] > 0
     
     def validate(self, data):
         """Validate pricing and wholesale quantity"""
@@ -139,10 +193,17 @@ class ProductListSerializer(serializers.ModelSerializer):
         return None
     
     def get_variant_count(self, obj):
+        if hasattr(obj, 'active_variant_count'):
+            return obj.active_variant_count
         return obj.variants.filter(is_active=True).count()
     
     def get_price_range(self, obj):
         """Get min and max retail prices from variants"""
+        if hasattr(obj, 'min_retail_price'):
+            # Annotated by ProductViewSet for the list
+            if not obj.active_variant_count:
+                return None
+            return {'min': obj.min_retail_price, 'max': obj.max_retail_price}
         variants = obj.variants.filter(is_active=True)
         if not variants.exists():
             return None
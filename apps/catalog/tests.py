@@ -1,3 +1,61 @@
+from unittest.mock import patch
+
 from django.test import TestCase
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.test import APIClient
+
+from apps.inventory.cache import availability_cache
+from apps.inventory.models import StockRecord
+from apps.inventory.services import refresh_variant_summaries
+from apps.users.models import CustomUser, Store
+from .models import Category, Product, ProductVariant
+
+
+class CatalogListingQueryCountTests(TestCase):
+    """Product and variant listings run the same queries whatever the page size"""
+
+    @classmethod
+    def setUpTestData(cls):
+        store = Store.objects.create(name='Main Store', code='MS-001', address='Mumbai')
+        cls.user = CustomUser.objects.create(username='manager', role='STORE_MANAGER', store=store)
+        category = Category.objects.create(name='Fabric')
+        variants = []
+        for i in range(30):
+            product = Product.objects.create(name=f'Roll {i:02d}', category=category, base_price=100)
+            for color in ('red', 'blue'):
+                variant = ProductVariant.objects.create(
+                    product=product,
+                    sku=f'CR-{i:02d}-{color}',
+                    color=color,
+                    retail_price=150,
+                    wholesale_price=100,
+                    min_wholesale_qty=1
+                )
+                StockRecord.objects.create(variant=variant, location=store, quantity=10)
+                variants.append(variant)
+        refresh_variant_summaries(variants)
+
+    def setUp(self):
+        availability_cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _list(self, url, page_size, queries):
+        with patch.object(PageNumberPagination, 'page_size', page_size), self.assertNumQueries(queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), page_size)
+        return response.data['results']
+
+    def test_product_list(self):
+        # Request savepoint, COUNT(*), the annotated page, release
+        for page_size in (5, 25):
+            products = self._list('/api/catalog/products/', page_size, 4)
+        self.assertEqual(products[0]['variant_count'], 2)
+        self.assertEqual(products[0]['price_range'], {'min': 150, 'max': 150})
 
-# Create your tests here.
+    def test_variant_list(self):
+        # ...plus one batch of availability for the page
+        for page_size in (5, 50):
+            variants = self._list('/api/catalog/variants/', page_size, 5)
+        self.assertTrue(all(variant['stock_available'] for variant in variants))
@@ -1,3 +1,4 @@
+from django.db.models import Count, Max, Min, Q
 from rest_framework import viewsets, filters
 from django_filters.rest_framework import DjangoFilterBackend
 from .models import Category, Product, ProductVariant
@@ -31,13 +32,25 @@ class ProductViewSet(StoreManagerModificationMixin, viewsets.ModelViewSet):
     List/Retrieve: All authenticated users
     Create/Update/Delete: Store managers and admins only
     """
-    queryset = Product.objects.filter(is_active=True).select_related('category')
+    queryset = Product.objects.filter(is_active=True).select_related('category').prefetch_related('variants')
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['category', 'brand', 'is_active']
     search_fields = ['name', 'description', 'brand']
     ordering_fields = ['name', 'base_price', 'created_at']
     ordering = ['name']
     
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            # ProductListSerializer reads these instead of querying each product's variants
+            active = Q(variants__is_active=True)
+            queryset = queryset.prefetch_related(None).annotate(
+                active_variant_count=Count('variants', filter=active),
+                min_retail_price=Min('variants__retail_price', filter=active),
+                max_retail_price=Max('variants__retail_price', filter=active)
+            )
+        return queryset
+    
     def get_serializer_class(self):
         # Use lightweight serializer for list view
         if self.action == 'list':
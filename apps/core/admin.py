@@ -0,0 +1,24 @@
+from django.contrib import admin
+from .models import DocumentSequence, IdempotencyKey, Job
+
+
+@admin.register(DocumentSequence)
+class DocumentSequenceAdmin(admin.ModelAdmin):
+    list_display = ('prefix', 'date', 'last_value')
+    list_filter = ('prefix',)
+    date_hierarchy = 'date'
+
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ('key', 'user', 'status_code', 'created_at', 'expires_at')
+    search_fields = ('key', 'user__username')
+    readonly_fields = ('request_hash', 'response')
+    raw_id_fields = ('user',)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'run_at', 'created_at', 'finished_at')
+    list_filter = ('status', 'name')
+    readonly_fields = ('payload', 'last_error', 'created_at', 'started_at', 'finished_at')
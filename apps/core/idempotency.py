@@ -0,0 +1,127 @@
+"""
+Idempotent create requests
+
+A client that may retry a POST (mobile POS on a flaky connection) sends an
+Idempotency-Key header, unique per logical request. The first request with
+a key inserts an IdempotencyKey row for (user, key) holding a hash of the
+request, runs the view, and stores the response on that row if it
+succeeded. A retry finds the row with one read of the (user, key) unique
+index and gets the stored response back - with an Idempotent-Replayed
+header - without running the view again:
+
+- same key, different method/path/body: 422, the key was reused by mistake
+- same key while the first request is still running: 409 (with
+  ATOMIC_REQUESTS the retry's insert instead waits on the unique index
+  until the first request commits, then replays its response)
+- the first request failed (error response or exception): nothing is
+  stored, so the retry runs the view again
+
+Rows live for IDEMPOTENCY_KEY_TTL_HOURS; an expired row is replaced by the
+next request with its key, and purge_idempotency_keys deletes the rest.
+"""
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def _ttl():
+    return timedelta(hours=getattr(settings, 'IDEMPOTENCY_KEY_TTL_HOURS', 24))
+
+
+def request_hash(request):
+    """SHA-256 of the request's method, path and (canonically encoded) body"""
+    body = json.dumps(request.data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode()).hexdigest()
+
+
+def _replay(record, digest):
+    from rest_framework import status
+    from rest_framework.response import Response
+
+    if record.request_hash != digest:
+        return Response(
+            {'error': f'{HEADER} was already used for a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    if record.status_code is None:
+        return Response(
+            {'error': f'A request with this {HEADER} is still in progress; retry later'},
+            status=status.HTTP_409_CONFLICT
+        )
+    return Response(record.response, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def _claim(user, key, digest):
+    """
+    Insert the in-progress row for (user, key). Returns None if this request
+    owns the key, else the response to send (a replay or an error).
+    """
+    now = timezone.now()
+    lookup = IdempotencyKey.objects.filter(user=user, key=key)
+    record = lookup.first()
+    if record is not None:
+        if record.expires_at > now:
+            return _replay(record, digest)
+        lookup.filter(expires_at__lte=now).delete()
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.create(user=user, key=key, request_hash=digest, expires_at=now + _ttl())
+    except IntegrityError:
+        # A concurrent request with the same key got there first
+        return _replay(lookup.get(), digest)
+    return None
+
+
+def run(request, view):
+    """
+    Run view() - a zero-argument callable returning a Response - once per
+    Idempotency-Key. Requests without the header (or an anonymous user)
+    just run view().
+    """
+    from rest_framework import status
+    from rest_framework.response import Response
+
+    key = request.headers.get(HEADER)
+    if not key or not request.user.is_authenticated:
+        return view()
+    if len(key) > MAX_KEY_LENGTH:
+        return Response(
+            {'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    digest = request_hash(request)
+    replay = _claim(request.user, key, digest)
+    if replay is not None:
+        return replay
+
+    owned = IdempotencyKey.objects.filter(user=request.user, key=key)
+    try:
+        response = view()
+    except BaseException:
+        try:
+            owned.delete()
+        except (DatabaseError, transaction.TransactionManagementError):
+            # The request's transaction is already broken; its rollback removes the row
+            pass
+        raise
+    if status.is_success(response.status_code):
+        owned.update(status_code=response.status_code, response=response.data)
+    else:
+        owned.delete()
+    return response
+
+
+def purge_expired(now=None):
+    """Delete expired keys; returns how many"""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=now or timezone.now()).delete()
+    return deleted
@@ -0,0 +1,191 @@
+"""
+Database-backed job queue
+
+Slow side effects (creating an invoice, sending a notification) are queued
+as Job rows and run by `python manage.py run_workers` instead of inside the
+request that caused them.
+
+Handlers are plain functions registered by name in a `jobs` module of any
+installed app, and take the job's payload as keyword arguments:
+
+    @register('sales.create_invoice')
+    def create_invoice(order_id):
+        ...
+
+    enqueue_on_commit('sales.create_invoice', order_id=order.id)
+
+A worker claims the oldest due job with SELECT ... FOR UPDATE SKIP LOCKED,
+so any number of workers (threads or hosts) share the queue without
+waiting on each other's rows, marks it RUNNING and commits; the handler
+then runs in its own transaction. A handler that raises is retried with
+exponential backoff (JOB_RETRY_BACKOFF_SECONDS x 2^(attempt-1), capped at
+JOB_RETRY_BACKOFF_MAX_SECONDS) until max_attempts, then left FAILED with
+its last error. Jobs RUNNING for longer than JOB_TIMEOUT_SECONDS (the
+worker died) are claimed again. Delivery is at least once, so handlers
+must be safe to run twice.
+
+stats() reports queue depth, the oldest due job's wait and recent latency
+(time from enqueue to start) and run time; `run_workers --stats` prints it.
+"""
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, F, Min
+from django.utils import timezone
+
+from .models import Job
+
+_handlers = {}
+_discovered = False
+
+
+def register(name):
+    """Decorator registering a function as the handler for jobs called name"""
+    def decorator(func):
+        _handlers[name] = func
+        return func
+    return decorator
+
+
+def _handler(name):
+    global _discovered
+    if name not in _handlers and not _discovered:
+        from django.utils.module_loading import autodiscover_modules
+        autodiscover_modules('jobs')
+        _discovered = True
+    return _handlers.get(name)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def enqueue(name, run_at=None, max_attempts=5, **payload):
+    """Queue one job now (in the caller's transaction); returns it"""
+    return Job.objects.create(
+        name=name,
+        payload=payload,
+        run_at=run_at or timezone.now(),
+        max_attempts=max_attempts
+    )
+
+
+def enqueue_many(name, payloads, max_attempts=5):
+    """Queue one job per payload dict with a single INSERT"""
+    now = timezone.now()
+    return Job.objects.bulk_create([
+        Job(name=name, payload=payload, run_at=now, max_attempts=max_attempts)
+        for payload in payloads
+    ])
+
+
+def enqueue_on_commit(name, **payload):
+    """Queue the job once the current transaction commits (never, if it rolls back)"""
+    transaction.on_commit(lambda: enqueue(name, **payload))
+
+
+def enqueue_many_on_commit(name, payloads):
+    payloads = list(payloads)
+    if payloads:
+        transaction.on_commit(lambda: enqueue_many(name, payloads))
+
+
+@transaction.atomic
+def claim(limit=1, now=None):
+    """
+    Lock up to limit due jobs (skipping rows other workers hold), mark them
+    RUNNING and return them. Falls back to jobs whose worker timed out.
+    """
+    now = now or timezone.now()
+    jobs = list(
+        Job.objects.select_for_update(skip_locked=True).filter(
+            status='QUEUED', run_at__lte=now
+        ).order_by('run_at', 'id')[:limit]
+    )
+    if not jobs:
+        stale = now - timedelta(seconds=_setting('JOB_TIMEOUT_SECONDS', 600))
+        jobs = list(
+            Job.objects.select_for_update(skip_locked=True).filter(
+                status='RUNNING', started_at__lt=stale
+            ).order_by('started_at', 'id')[:limit]
+        )
+    for job in jobs:
+        if job.status == 'RUNNING' and job.attempts >= job.max_attempts:
+            # Out of attempts and its last worker never reported back
+            job.status, job.finished_at = 'FAILED', now
+            job.last_error = f'Timed out after {job.attempts} attempts'
+            continue
+        job.status = 'RUNNING'
+        job.attempts += 1
+        job.started_at = now
+    Job.objects.bulk_update(jobs, ['status', 'attempts', 'started_at', 'finished_at', 'last_error'])
+    return [job for job in jobs if job.status == 'RUNNING']
+
+
+def _backoff(attempts):
+    base = _setting('JOB_RETRY_BACKOFF_SECONDS', 10)
+    delay = min(base * 2 ** (attempts - 1), _setting('JOB_RETRY_BACKOFF_MAX_SECONDS', 3600))
+    # Jitter spreads out retries of jobs that failed together
+    return timedelta(seconds=delay * random.uniform(1, 1.1))
+
+
+def execute(job):
+    """Run a claimed job's handler and record the outcome; returns True on success"""
+    handler = _handler(job.name)
+    try:
+        if handler is None:
+            raise LookupError(f'No handler registered for job {job.name!r}')
+        with transaction.atomic():
+            handler(**job.payload)
+    except Exception:
+        now = timezone.now()
+        fields = {'last_error': traceback.format_exc(limit=20), 'finished_at': now}
+        if job.attempts < job.max_attempts:
+            fields.update(status='QUEUED', run_at=now + _backoff(job.attempts))
+        else:
+            fields.update(status='FAILED')
+        Job.objects.filter(pk=job.pk).update(**fields)
+        for attname, value in fields.items():
+            setattr(job, attname, value)
+        return False
+    job.status, job.finished_at = 'DONE', timezone.now()
+    Job.objects.filter(pk=job.pk).update(status=job.status, finished_at=job.finished_at, last_error='')
+    return True
+
+
+def run_next(now=None):
+    """Claim and run one job; returns it, or None if nothing was due"""
+    jobs = claim(1, now)
+    if not jobs:
+        return None
+    execute(jobs[0])
+    return jobs[0]
+
+
+def stats(window=timedelta(hours=1), now=None):
+    """
+    Queue depth per status and name, the oldest due job's wait, and mean
+    latency (enqueue to start) and run time of jobs finished in window
+    """
+    now = now or timezone.now()
+    depth = {}
+    for row in Job.objects.filter(status__in=['QUEUED', 'RUNNING', 'FAILED']).values(
+        'status', 'name'
+    ).annotate(jobs=Count('id')).order_by('status', 'name'):
+        depth.setdefault(row['status'], {})[row['name']] = row['jobs']
+    oldest = Job.objects.filter(status='QUEUED', run_at__lte=now).aggregate(oldest=Min('run_at'))['oldest']
+    recent = Job.objects.filter(status='DONE', finished_at__gte=now - window).aggregate(
+        done=Count('id'),
+        latency=Avg(F('started_at') - F('created_at')),
+        run_time=Avg(F('finished_at') - F('started_at'))
+    )
+    return {
+        'depth': depth,
+        'oldest_wait_seconds': (now - oldest).total_seconds() if oldest else 0,
+        'done_in_window': recent['done'],
+        'mean_latency_seconds': recent['latency'].total_seconds() if recent['latency'] else None,
+        'mean_run_seconds': recent['run_time'].total_seconds() if recent['run_time'] else None,
+    }
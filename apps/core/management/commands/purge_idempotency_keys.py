@@ -0,0 +1,18 @@
+"""
+Management command to delete expired idempotency keys
+Usage: python manage.py purge_idempotency_keys
+
+Expired keys are already ignored (and replaced on reuse); run this from
+cron to keep the table small.
+"""
+from django.core.management.base import BaseCommand
+
+from apps.core.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Deletes IdempotencyKey rows past IDEMPOTENCY_KEY_TTL_HOURS'
+
+    def handle(self, *args, **options):
+        deleted = purge_expired()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired idempotency keys'))
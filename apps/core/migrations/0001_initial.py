@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="DocumentSequence",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("prefix", models.CharField(max_length=20)),
+                ("date", models.DateField()),
+                (
+                    "last_value",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="Highest number handed out for this prefix and day",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-date", "prefix"],
+                "unique_together": {("prefix", "date")},
+            },
+        ),
+    ]
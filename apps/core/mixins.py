@@ -50,3 +50,15 @@ class QuickAddValidationMixin:
                     "You must either provide a list of 'items' (JSON) OR select an item in 'Select Item' (HTML Form)."
                 )
         return attrs
+
+
+class IdempotentCreateMixin:
+    """
+    Mixin for ViewSets whose create may be retried by clients.
+    A create sent with an Idempotency-Key header runs once per key; retries
+    get the stored response back (see apps.core.idempotency).
+    """
+    def create(self, request, *args, **kwargs):
+        from apps.core.idempotency import run
+
+        return run(request, lambda: super(IdempotentCreateMixin, self).create(request, *args, **kwargs))
@@ -0,0 +1,97 @@
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+
+
+class DocumentSequence(models.Model):
+    """Per-day counter behind document numbers (SO/INV/PO/GRN-YYYYMMDD-NNNN)"""
+    
+    prefix = models.CharField(max_length=20)
+    date = models.DateField()
+    last_value = models.PositiveIntegerField(
+        default=0,
+        help_text="Highest number handed out for this prefix and day"
+    )
+    
+    class Meta:
+        unique_together = ('prefix', 'date')
+        ordering = ['-date', 'prefix']
+    
+    def __str__(self):
+        return f"{self.prefix}-{self.date:%Y%m%d}: {self.last_value}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Stored outcome of a create request sent with an Idempotency-Key header,
+    replayed to retries of the same request (see apps.core.idempotency)
+    """
+    
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='idempotency_keys'
+    )
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(
+        max_length=64,
+        help_text="SHA-256 of method, path and body of the first request"
+    )
+    status_code = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True,
+        help_text="Empty while the first request is still running"
+    )
+    response = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    class Meta:
+        # The unique index is the lookup: a replay is one indexed read
+        unique_together = ('user', 'key')
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.user_id}:{self.key} ({self.status_code or 'in progress'})"
+
+
+class Job(models.Model):
+    """A background task run by run_workers (see apps.core.jobs)"""
+    
+    STATUS_CHOICES = [
+        ('QUEUED', 'Queued'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    ]
+    
+    name = models.CharField(max_length=100, help_text="Registered handler, e.g. sales.create_invoice")
+    payload = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='QUEUED')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(help_text="Not claimed before this time (retries back off)")
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Workers claim the oldest due job; only QUEUED rows are in the index
+            models.Index(
+                fields=['run_at', 'id'],
+                name='job_queued_run_at_idx',
+                condition=models.Q(status='QUEUED')
+            ),
+            # Jobs left RUNNING by a worker that died are reclaimed by started_at
+            models.Index(
+                fields=['started_at'],
+                name='job_running_started_idx',
+                condition=models.Q(status='RUNNING')
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
@@ -0,0 +1,190 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class SinceIdPagination(BasePagination):
+    """
+    Forward-only feed pagination for append-only tables.
+    ?since=<cursor from previous response>&limit=N returns rows after the
+    cursor in ascending id order - an index range scan with no COUNT(*).
+    
+    Ids are assigned at INSERT but only become visible at COMMIT, so a row
+    can show up after rows with higher ids were already served. Besides
+    the highest id served, the cursor therefore lists the ids below it
+    that did not exist yet (still uncommitted, or rolled back). They are
+    looked for again on every poll, and served once when they appear,
+    until overlap newer ids exist - by then the insert is taken to have
+    rolled back.
+    """
+    page_size = 100
+    max_page_size = 1000
+    overlap = 1000
+    max_gaps = 100
+    
+    def _int_param(self, request, name, default):
+        value = request.query_params.get(name)
+        if value in (None, ''):
+            return default
+        try:
+            return max(0, int(value))
+        except ValueError:
+            raise ValidationError({name: 'Must be an integer'})
+    
+    def _decode_cursor(self, request):
+        value = request.query_params.get('since')
+        if value in (None, ''):
+            return 0, []
+        try:
+            since, *gaps = (int(part) for part in value.split('.'))
+        except ValueError:
+            raise ValidationError({'since': 'Invalid cursor'})
+        return max(0, since), [pk for pk in gaps if 0 < pk < since]
+    
+    def paginate_queryset(self, queryset, request, view=None):
+        since, gaps = self._decode_cursor(request)
+        limit = min(self._int_param(request, 'limit', self.page_size) or self.page_size, self.max_page_size)
+        
+        rows = list(queryset.filter(Q(pk__gt=since) | Q(pk__in=gaps)).order_by('pk')[:limit + 1])
+        self.has_more = len(rows) > limit
+        self.rows = rows[:limit]
+        
+        served = {row.pk for row in self.rows}
+        self.head = max(served | {since})
+        low = max(since, self.head - self.overlap)
+        gaps = [pk for pk in gaps if pk not in served and pk > self.head - self.overlap]
+        if gaps or len([pk for pk in served if pk > low]) < self.head - low:
+            # Ids the whole table (not just this filtered feed) doesn't have yet
+            existing = set(
+                queryset.model._default_manager.filter(
+                    Q(pk__in=gaps) | Q(pk__gt=low, pk__lt=self.head)
+                ).values_list('pk', flat=True)
+            )
+            gaps = sorted(
+                {pk for pk in gaps if pk not in existing}
+                | {pk for pk in range(low + 1, self.head) if pk not in existing}
+            )
+        self.gaps = gaps[-self.max_gaps:]
+        return self.rows
+    
+    def get_paginated_response(self, data):
+        return Response({
+            'cursor': '.'.join(str(pk) for pk in [self.head] + self.gaps),
+            'has_more': self.has_more,
+            'results': data,
+        })
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on (view.keyset_field, id), newest first by default.
+    Each page is an index range scan from the cursor, so deep pages cost the
+    same as page one and rows inserted while paging don't shift later pages.
+    
+    Query params:
+      cursor       opaque value from the previous response's next/previous link
+      page_size    rows per page (max max_page_size)
+      count=false  skip the COUNT(*) for the total
+      ordering     keyset_field or -keyset_field; any other ordering falls
+                   back to page-number pagination
+    """
+    page_size = 50
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    fallback_class = PageNumberPagination
+    
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.field = getattr(view, 'keyset_field', 'created_at')
+        self.fallback = None
+        
+        ordering = request.query_params.get('ordering')
+        if ordering and ordering.lstrip('-') != self.field:
+            self.fallback = self.fallback_class()
+            return self.fallback.paginate_queryset(queryset, request, view)
+        self.descending = not ordering or ordering.startswith('-')
+        
+        self.count = None
+        if request.query_params.get('count', '').lower() not in ('false', '0', 'no'):
+            self.count = queryset.count()
+        
+        self.page_size = self._page_size(request)
+        position, backwards = self._decode_cursor(request)
+        
+        # Walking backwards = walking forwards in the opposite direction
+        forward = self.descending != backwards
+        prefix = '-' if forward else ''
+        queryset = queryset.order_by(f'{prefix}{self.field}', f'{prefix}id')
+        if position is not None:
+            value, pk = position
+            lookup = 'lt' if forward else 'gt'
+            # The plain range condition lets the (field, id) index bound the scan
+            queryset = queryset.filter(**{f'{self.field}__{lookup}e': value}).filter(
+                Q(**{f'{self.field}__{lookup}': value}) | Q(**{self.field: value, f'id__{lookup}': pk})
+            )
+        
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if backwards:
+            rows.reverse()
+        
+        self.has_next = has_more if not backwards else True
+        self.has_previous = (position is not None) if not backwards else has_more
+        self.rows = rows
+        return rows
+    
+    def _page_size(self, request):
+        try:
+            size = int(request.query_params.get('page_size', self.page_size))
+        except ValueError:
+            raise ValidationError({'page_size': 'Must be an integer'})
+        return max(1, min(size, self.max_page_size))
+    
+    def _decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            value, pk, backwards = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            parsed = parse_datetime(value)
+            return (parsed if parsed is not None else value, int(pk)), bool(backwards)
+        except (ValueError, TypeError):
+            raise ValidationError({self.cursor_query_param: 'Invalid cursor'})
+    
+    def _encode_cursor(self, row, backwards):
+        value = getattr(row, self.field)
+        value = value.isoformat() if hasattr(value, 'isoformat') else value
+        payload = json.dumps([value, row.pk, backwards])
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, base64.urlsafe_b64encode(payload.encode()).decode())
+    
+    def get_next_link(self):
+        if not self.has_next or not self.rows:
+            return None
+        return self._encode_cursor(self.rows[-1], backwards=False)
+    
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.rows:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self._encode_cursor(self.rows[0], backwards=True)
+    
+    def get_paginated_response(self, data):
+        if self.fallback is not None:
+            return self.fallback.get_paginated_response(data)
+        response = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.count is not None:
+            response = {'count': self.count, **response}
+        return Response(response)
@@ -0,0 +1,103 @@
+"""
+Minimal PDF writer
+
+Just enough PDF for printable documents made of lines of text and rules,
+in pure Python with no dependency. Output is deterministic - no creation
+date or random ids - so the same input always gives the same bytes.
+
+Text is set in the built-in Courier fonts, which every viewer has without
+embedding and whose fixed 0.6 em advance makes column alignment a matter
+of padding strings (see TextPDF.columns()). Characters outside
+Windows-1252 print as '?'.
+"""
+PAGE_SIZES = {
+    'A4': (595, 842),
+    'LETTER': (612, 792),
+}
+CHAR_WIDTH = 0.6
+FONTS = {False: b'F1', True: b'F2'}
+
+
+def _num(value):
+    return (b'%.2f' % value).rstrip(b'0').rstrip(b'.')
+
+
+def _text(value):
+    data = str(value).encode('cp1252', 'replace')
+    return data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+class TextPDF:
+    """Lines of text flowing down pages; render() returns the PDF bytes"""
+
+    def __init__(self, page_size='A4', margin=48):
+        self.width, self.height = PAGE_SIZES[page_size]
+        self.margin = margin
+        self.pages = []
+        self._new_page()
+
+    def _new_page(self):
+        self.pages.append([])
+        self.y = self.height - self.margin
+
+    def _advance(self, height):
+        if self.y - height < self.margin:
+            self._new_page()
+        self.y -= height
+
+    def columns(self, size=10):
+        """Characters per line at size"""
+        return int((self.width - 2 * self.margin) / (size * CHAR_WIDTH))
+
+    def line(self, text='', size=10, bold=False):
+        """Write one line (blank if text is empty) below the previous one"""
+        self._advance(size * 1.4)
+        if text:
+            self.pages[-1].append(
+                b'BT /%s %s Tf %s %s Td (%s) Tj ET' % (
+                    FONTS[bold], _num(size), _num(self.margin), _num(self.y), _text(text)
+                )
+            )
+
+    def rule(self):
+        """Horizontal line across the text width"""
+        self._advance(6)
+        self.pages[-1].append(
+            b'0.5 w %s %s m %s %s l S' % (
+                _num(self.margin), _num(self.y + 3), _num(self.width - self.margin), _num(self.y + 3)
+            )
+        )
+
+    def render(self):
+        # Objects: 1 catalog, 2 page tree, 3-4 fonts, then a page and its content stream per page
+        objects = [
+            b'<< /Type /Catalog /Pages 2 0 R >>',
+            None,
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>',
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier-Bold /Encoding /WinAnsiEncoding >>',
+        ]
+        kids = []
+        for operations in self.pages:
+            stream = b'\n'.join(operations)
+            page_number = len(objects) + 1
+            kids.append(b'%d 0 R' % page_number)
+            objects.append(
+                b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] '
+                b'/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>' % (
+                    self.width, self.height, page_number + 1
+                )
+            )
+            objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+        objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(kids), len(kids))
+
+        output = bytearray(b'%PDF-1.4\n')
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(len(output))
+            output += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+        xref = len(output)
+        output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+        for offset in offsets:
+            output += b'%010d 00000 n \n' % offset
+        output += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+        return bytes(output)
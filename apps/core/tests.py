@@ -0,0 +1,134 @@
+import threading
+from datetime import date
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.db import connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from apps.sales.models import Order
+from apps.users.models import CustomUser, Store
+from . import sequences
+from .models import DocumentSequence
+from .sequences import allocate_document_numbers, next_document_number
+
+TODAY = date(2026, 3, 14)
+
+
+def _numbers(prefix, count):
+    return [next_document_number(prefix, Order, 'order_number') for _ in range(count)]
+
+
+@patch('apps.core.sequences.timezone.localdate', lambda: TODAY)
+@override_settings(DOCUMENT_SEQUENCE_BLOCK_SIZE=0)
+class GapFreeSequenceTests(TestCase):
+    """DOCUMENT_SEQUENCE_BLOCK_SIZE = 0: numbers are allocated in the caller's transaction"""
+
+    def test_numbers_are_consecutive_per_prefix_and_day(self):
+        self.assertEqual(_numbers('SO', 3), ['SO-20260314-0001', 'SO-20260314-0002', 'SO-20260314-0003'])
+        self.assertEqual(_numbers('INV', 1), ['INV-20260314-0001'])
+        with patch('apps.core.sequences.timezone.localdate', lambda: date(2026, 3, 15)):
+            self.assertEqual(_numbers('SO', 1), ['SO-20260315-0001'])
+        self.assertEqual(_numbers('SO', 1), ['SO-20260314-0004'])
+
+    def test_rolled_back_number_is_issued_again(self):
+        try:
+            with transaction.atomic():
+                self.assertEqual(_numbers('SO', 1), ['SO-20260314-0001'])
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(_numbers('SO', 1), ['SO-20260314-0001'])
+
+    def test_counter_continues_after_prefix_scan_numbers(self):
+        store = Store.objects.create(name='Main Store', code='MS-001', address='Mumbai')
+        customer = CustomUser.objects.create(username='buyer', role='CUSTOMER')
+        for number in ('SO-20260314-0041', 'SO-20260313-0090'):
+            Order.objects.create(order_number=number, customer=customer, store=store)
+        self.assertEqual(_numbers('SO', 1), ['SO-20260314-0042'])
+        self.assertEqual(DocumentSequence.objects.get(prefix='SO').last_value, 42)
+        # Only the first number of the day scans the documents
+        with self.assertNumQueries(4):
+            _numbers('SO', 1)
+
+    def test_bulk_allocation_takes_one_counter_update(self):
+        _numbers('PO', 1)
+        self.assertEqual(
+            allocate_document_numbers('PO', Order, 'order_number', 3),
+            ['PO-20260314-0002', 'PO-20260314-0003', 'PO-20260314-0004']
+        )
+        self.assertEqual(DocumentSequence.objects.get(prefix='PO').last_value, 4)
+
+
+@patch('apps.core.sequences.timezone.localdate', lambda: TODAY)
+@override_settings(DOCUMENT_SEQUENCE_BLOCK_SIZE=1)
+class CommittedSequenceTests(TransactionTestCase):
+    """Default mode: numbers are committed on the allocator thread's own connection"""
+
+    def setUp(self):
+        sequences._pool.clear()
+
+    def test_number_outlives_the_callers_rollback(self):
+        try:
+            with transaction.atomic():
+                self.assertEqual(_numbers('SO', 1), ['SO-20260314-0001'])
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(DocumentSequence.objects.get(prefix='SO').last_value, 1)
+        self.assertEqual(_numbers('SO', 1), ['SO-20260314-0002'])
+
+    @override_settings(DOCUMENT_SEQUENCE_BLOCK_SIZE=5)
+    def test_block_is_reserved_per_counter_update(self):
+        self.assertEqual(_numbers('SO', 1), ['SO-20260314-0001'])
+        self.assertEqual(DocumentSequence.objects.get(prefix='SO').last_value, 5)
+        self.assertEqual(_numbers('SO', 4)[-1], 'SO-20260314-0005')
+        self.assertEqual(_numbers('SO', 1), ['SO-20260314-0006'])
+        self.assertEqual(DocumentSequence.objects.get(prefix='SO').last_value, 10)
+        # Another day starts its own block
+        with patch('apps.core.sequences.timezone.localdate', lambda: date(2026, 3, 15)):
+            self.assertEqual(_numbers('SO', 1), ['SO-20260315-0001'])
+        self.assertEqual(list(sequences._pool), [('SO', date(2026, 3, 15))])
+
+
+@skipUnless(connection.features.has_select_for_update, 'needs row locks')
+@patch('apps.core.sequences.timezone.localdate', lambda: TODAY)
+class ConcurrentSequenceTests(TransactionTestCase):
+    """Callers racing on one counter never get the same number"""
+
+    def setUp(self):
+        sequences._pool.clear()
+
+    def _race(self, threads=8, per_thread=5):
+        issued, errors = [], []
+
+        def worker():
+            try:
+                for _ in range(per_thread):
+                    with transaction.atomic():
+                        issued.extend(_numbers('SO', 1))
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join(30)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(set(issued)), threads * per_thread)
+        return sorted(int(number.rsplit('-', 1)[1]) for number in issued)
+
+    @override_settings(DOCUMENT_SEQUENCE_BLOCK_SIZE=0)
+    def test_gap_free_callers(self):
+        self.assertEqual(self._race(), list(range(1, 41)))
+
+    @override_settings(DOCUMENT_SEQUENCE_BLOCK_SIZE=1)
+    def test_committed_callers(self):
+        self.assertEqual(self._race(), list(range(1, 41)))
+
+    @override_settings(DOCUMENT_SEQUENCE_BLOCK_SIZE=3)
+    def test_block_callers(self):
+        self.assertEqual(self._race(), list(range(1, 41)))
@@ -0,0 +1,106 @@
+"""
+Compare-and-set status transitions
+
+A model declares its transitions once:
+
+    states = StateMachine(ship=(['CONFIRMED'], 'SHIPPED'), ...)
+
+and every transition is a single
+
+    UPDATE ... SET status = 'SHIPPED', updated_at = now
+    WHERE id = ? AND status IN ('CONFIRMED')
+
+instead of reading the row, checking status in Python and save()-ing every
+column. Two requests racing on the same object can't both win (the loser
+updates 0 rows), and a transition never writes back stale values of
+unrelated columns. A 0-row update raises TransitionConflict, which views
+turn into 409 Conflict.
+
+Callers that act on the status they moved from (cancelling a PENDING order
+releases its reservation, a CONFIRMED one restocks) use apply_from(): one
+conditional UPDATE per source status, so the winning UPDATE itself says
+which status the row was in - no locking read first.
+"""
+from django.utils import timezone
+
+
+class TransitionConflict(Exception):
+    """The object was not in a status the transition starts from (or no longer exists)"""
+
+    def __init__(self, instance, name, sources, current):
+        self.instance = instance
+        self.name = name
+        self.sources = sources
+        self.current = current
+        label = instance._meta.verbose_name
+        if current is None:
+            message = f"{label.capitalize()} {instance.pk} no longer exists"
+        else:
+            message = f"Cannot {name} {label} in status {current}; only {' or '.join(sources)} allowed"
+        super().__init__(message)
+
+
+class StateMachine:
+
+    def __init__(self, field='status', **transitions):
+        self.field = field
+        self.transitions = {
+            name: (tuple(sources), target) for name, (sources, target) in transitions.items()
+        }
+
+    def sources(self, name):
+        return self.transitions[name][0]
+
+    def _values(self, model, name, fields):
+        """Column values written by the transition: status, auto_now timestamps, extra fields"""
+        values = {self.field: self.transitions[name][1]}
+        now = timezone.now()
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False):
+                values[field.attname] = now
+        values.update(fields)
+        return values
+
+    def _conflict(self, instance, name):
+        current = type(instance)._default_manager.filter(pk=instance.pk).values_list(
+            self.field, flat=True
+        ).first()
+        return TransitionConflict(instance, name, self.sources(name), current)
+
+    def apply(self, instance, name, **fields):
+        """
+        Move instance through transition name, also setting fields, with one
+        conditional UPDATE. Updates instance in place and returns it; raises
+        TransitionConflict if it wasn't in a source status.
+        """
+        model = type(instance)
+        values = self._values(model, name, fields)
+        updated = model._default_manager.filter(
+            pk=instance.pk, **{f'{self.field}__in': self.sources(name)}
+        ).update(**values)
+        if not updated:
+            raise self._conflict(instance, name)
+        for attname, value in values.items():
+            setattr(instance, attname, value)
+        return instance
+
+    def apply_from(self, instance, name, **fields):
+        """
+        apply() that returns the source status instance was moved from.
+        Each source gets its own conditional UPDATE, so the one that matched
+        is the status the row was in when this transition won.
+        """
+        model = type(instance)
+        values = self._values(model, name, fields)
+        for source in self.sources(name):
+            if model._default_manager.filter(pk=instance.pk, **{self.field: source}).update(**values):
+                for attname, value in values.items():
+                    setattr(instance, attname, value)
+                return source
+        raise self._conflict(instance, name)
+
+    def apply_many(self, queryset, name, **fields):
+        """Apply transition name to every row of queryset in a source status; returns the row count"""
+        return queryset.filter(**{f'{self.field}__in': self.sources(name)}).update(
+            **self._values(queryset.model, name, fields)
+        )
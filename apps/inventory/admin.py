@@ -1,13 +1,35 @@
 from django.contrib import admin
-from .models import StockRecord, StockTransaction, StockAlert
+from .models import (
+    StockRecord, StockTransaction, StockAlert, StockAlertEvent, VariantStockSummary, StockSnapshot,
+    StockTransfer, StockTransferItem, StockShard, CostLayer, StockValuation, ValuationEntry
+)
+
+
+class StockShardInline(admin.TabularInline):
+    model = StockShard
+    extra = 0
+    can_delete = False
+    readonly_fields = ('shard', 'capacity', 'reserved')
+    
+    def has_add_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(StockRecord)
 class StockRecordAdmin(admin.ModelAdmin):
-    list_display = ('variant', 'location', 'quantity', 'reserved_quantity', 'available_quantity', 'last_updated')
+    list_display = ('variant', 'location', 'quantity', 'reserved_quantity', 'available_quantity', 'shard_count', 'last_updated')
     list_filter = ('location',)
     search_fields = ('variant__sku', 'variant__product__name', 'location__name')
-    readonly_fields = ('last_updated',)
+    # Sharding is switched with the stock_shards command, which also moves the stock
+    readonly_fields = ('shard_count', 'last_updated')
+    inlines = [StockShardInline]
+
+
+@admin.register(VariantStockSummary)
+class VariantStockSummaryAdmin(admin.ModelAdmin):
+    list_display = ('variant', 'total_quantity', 'total_reserved', 'total_available', 'locations_stocked', 'updated_at')
+    search_fields = ('variant__sku', 'variant__product__name')
+    readonly_fields = ('total_quantity', 'total_reserved', 'total_available', 'locations_stocked', 'updated_at')
 
 
 @admin.register(StockTransaction)
@@ -21,12 +43,70 @@ class StockTransactionAdmin(admin.ModelAdmin):
 
 @admin.register(StockAlert)
 class StockAlertAdmin(admin.ModelAdmin):
-    list_display = ('variant', 'location', 'threshold', 'is_active', 'current_stock_status')
+    list_display = ('variant', 'location', 'threshold', 'suggested_threshold', 'is_active', 'current_stock_status')
     list_filter = ('is_active', 'location')
     search_fields = ('variant__sku', 'variant__product__name')
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_stock_status().select_related('variant', 'location')
+    
     def current_stock_status(self, obj):
-        if obj.check_alert():
+        if obj.is_below_threshold:
             return "⚠️ Below threshold"
         return "✓ OK"
     current_stock_status.short_description = "Status"
+    current_stock_status.admin_order_field = 'current_stock'
+
+
+@admin.register(StockAlertEvent)
+class StockAlertEventAdmin(admin.ModelAdmin):
+    list_display = ('alert', 'event_type', 'available_quantity', 'threshold', 'created_at')
+    list_filter = ('event_type', 'alert__location')
+    readonly_fields = ('created_at',)
+
+
+@admin.register(StockSnapshot)
+class StockSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('date', 'line_count', 'created_at')
+    readonly_fields = ('date', 'line_count', 'created_at')
+    date_hierarchy = 'date'
+
+
+class StockTransferItemInline(admin.TabularInline):
+    model = StockTransferItem
+    extra = 0
+    raw_id_fields = ('variant',)
+
+
+@admin.register(StockTransfer)
+class StockTransferAdmin(admin.ModelAdmin):
+    list_display = ('transfer_number', 'from_location', 'to_location', 'status', 'dispatched_at', 'received_at')
+    list_filter = ('status', 'from_location', 'to_location')
+    search_fields = ('transfer_number',)
+    readonly_fields = ('transfer_number', 'status', 'dispatched_at', 'received_at', 'created_at', 'updated_at')
+    inlines = [StockTransferItemInline]
+
+
+@admin.register(StockValuation)
+class StockValuationAdmin(admin.ModelAdmin):
+    list_display = ('variant', 'location', 'quantity', 'fifo_value', 'average_value', 'updated_at')
+    list_filter = ('location',)
+    search_fields = ('variant__sku',)
+    readonly_fields = ('quantity', 'fifo_value', 'average_value', 'updated_at')
+
+
+@admin.register(CostLayer)
+class CostLayerAdmin(admin.ModelAdmin):
+    list_display = ('variant', 'location', 'quantity', 'remaining', 'unit_cost', 'reference_type', 'reference_id', 'created_at')
+    list_filter = ('location', 'reference_type')
+    search_fields = ('variant__sku',)
+    readonly_fields = ('quantity', 'remaining', 'unit_cost', 'reference_type', 'reference_id', 'created_at')
+
+
+@admin.register(ValuationEntry)
+class ValuationEntryAdmin(admin.ModelAdmin):
+    list_display = ('variant', 'location', 'entry_type', 'quantity', 'fifo_value', 'average_value', 'reference_type', 'reference_id', 'timestamp')
+    list_filter = ('entry_type', 'location')
+    search_fields = ('variant__sku',)
+    readonly_fields = ('timestamp',)
+    date_hierarchy = 'timestamp'
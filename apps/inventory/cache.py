@@ -0,0 +1,201 @@
+"""
+Availability cache
+
+Caches available quantity per (variant_id, location_id) - location None
+meaning the total across all locations - in a per-process LRU with a size
+bound. Lookups are batched: get_many() loads every missing key for a page
+of variants with one query. Besides /api/inventory/availability/, the
+stock_available of every variant list (variants, product detail, stock
+records) is read through it (catalog.serializers.prefetch_availability).
+
+Entries are tagged with a version. services.stock_changed() calls
+invalidate(), which bumps the version of every touched key once the
+surrounding transaction commits, so a reader that loaded the old value
+just before the commit can't store it as current. Only the 2 x
+AVAILABILITY_CACHE_SIZE most recently bumped local versions are kept;
+forgetting older ones raises a floor version for every other key, which
+turns the entries cached under them into misses.
+
+With AVAILABILITY_CACHE_ALIAS set to a Django cache alias, versions (and
+a second copy of each value) live in that shared cache so invalidations
+reach every process. Without it, other processes only see a change once
+their copy is AVAILABILITY_CACHE_TIMEOUT seconds old.
+"""
+import itertools
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+
+from .models import StockRecord, VariantStockSummary
+
+
+class AvailabilityCache:
+
+    def __init__(self, max_entries=None, timeout=None, alias=None):
+        self.max_entries = max_entries if max_entries is not None else getattr(
+            settings, 'AVAILABILITY_CACHE_SIZE', 10000
+        )
+        self.timeout = timeout if timeout is not None else getattr(
+            settings, 'AVAILABILITY_CACHE_TIMEOUT', 60
+        )
+        self.alias = alias if alias is not None else getattr(settings, 'AVAILABILITY_CACHE_ALIAS', '')
+        self._entries = OrderedDict()  # key -> (value, version, stored_at)
+        # Local versions of recently invalidated keys, least recently bumped first
+        self._versions = OrderedDict()
+        self.max_versions = 2 * self.max_entries
+        # Version of every key not in _versions
+        self._floor = 0
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    @property
+    def shared(self):
+        return caches[self.alias] if self.alias else None
+
+    @staticmethod
+    def _version_key(key):
+        return f'inventory:availability:version:{key[0]}:{key[1]}'
+
+    @staticmethod
+    def _value_key(key):
+        return f'inventory:availability:value:{key[0]}:{key[1]}'
+
+    def _current_versions(self, keys):
+        """Version of each key; in shared mode missing versions are created"""
+        shared = self.shared
+        if shared is None:
+            with self._lock:
+                return {key: self._versions.get(key, self._floor) for key in keys}
+
+        found = shared.get_many([self._version_key(key) for key in keys])
+        versions = {}
+        for key in keys:
+            version_key = self._version_key(key)
+            version = found.get(version_key)
+            if version is None:
+                # add() so a concurrent invalidation is never overwritten
+                shared.add(version_key, uuid.uuid4().hex, timeout=None)
+                version = shared.get(version_key)
+            versions[key] = version
+        return versions
+
+    def get_many(self, variant_ids, location_id=None):
+        """Available quantity for each variant at location_id (None = all locations)"""
+        keys = [(variant_id, location_id) for variant_id in variant_ids]
+        versions = self._current_versions(keys)
+        now = time.monotonic()
+        result, missing = {}, []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry and entry[1] == versions[key] and now - entry[2] < self.timeout:
+                    self._entries.move_to_end(key)
+                    result[key[0]] = entry[0]
+                    self.hits += 1
+                else:
+                    missing.append(key)
+            self.misses += len(missing)
+
+        shared = self.shared
+        if missing and shared is not None:
+            stored = shared.get_many([self._value_key(key) for key in missing])
+            still_missing = []
+            for key in missing:
+                value = stored.get(self._value_key(key))
+                if value is not None and value[0] == versions[key]:
+                    result[key[0]] = value[1]
+                    self._store(key, value[1], versions[key])
+                else:
+                    still_missing.append(key)
+            missing = still_missing
+
+        if missing:
+            loaded = self._load([key[0] for key in missing], location_id)
+            for key in missing:
+                result[key[0]] = loaded.get(key[0], 0)
+                self._store(key, result[key[0]], versions[key])
+            if shared is not None:
+                shared.set_many(
+                    {self._value_key(key): (versions[key], result[key[0]]) for key in missing},
+                    timeout=self.timeout
+                )
+        return result
+
+    def _load(self, variant_ids, location_id):
+        if location_id is None:
+            rows = VariantStockSummary.objects.filter(
+                variant_id__in=variant_ids
+            ).values_list('variant_id', 'total_available')
+        else:
+            rows = StockRecord.objects.with_shard_stock().filter(
+                location_id=location_id,
+                variant_id__in=variant_ids
+            ).annotate(
+                total=F('available_quantity') + F('shard_free')
+            ).values_list('variant_id', 'total')
+        return dict(rows)
+
+    def _store(self, key, value, version):
+        with self._lock:
+            self._entries[key] = (value, version, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, location_id, variant_ids):
+        """Bump the versions of the touched keys once the current transaction commits"""
+        keys = [
+            key
+            for variant_id in variant_ids
+            for key in ((variant_id, location_id), (variant_id, None))
+        ]
+        transaction.on_commit(lambda: self._bump(keys))
+
+    def _bump(self, keys):
+        with self._lock:
+            for key in keys:
+                self._versions[key] = next(self._counter)
+                self._versions.move_to_end(key)
+                self._entries.pop(key, None)
+            self.invalidations += len(keys)
+            if len(self._versions) > self.max_versions:
+                # Forget the least recently bumped half and raise the floor
+                # past every version handed out, so nothing cached or being
+                # loaded under a forgotten version can match again
+                for _ in range(len(self._versions) - self.max_versions // 2):
+                    self._versions.popitem(last=False)
+                self._floor = next(self._counter)
+        shared = self.shared
+        if shared is not None:
+            shared.set_many({self._version_key(key): uuid.uuid4().hex for key in keys}, timeout=None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': f'shared:{self.alias}' if self.alias else 'local',
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'timeout': self.timeout,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'versions': len(self._versions),
+            }
+
+
+availability_cache = AvailabilityCache()
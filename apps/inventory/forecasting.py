@@ -0,0 +1,136 @@
+"""
+Demand forecasting and reorder points
+
+Daily sales per (variant, location) are read from the ledger - SO rows of
+type OUT (confirmed sales) net of RETURN - already summed per local day by
+one ORM query, and streamed in chunks into NumPy. Each chunk is folded into
+weighted first and second moments per pair (np.bincount) before the next
+is read, so memory grows with the number of pairs, not pairs x days, and
+days without sales are implicit zeros.
+
+For each pair:
+- mean daily demand: exponentially weighted (bias-corrected, like
+  pandas' ewm(adjust=True)) or a simple moving average over the last
+  window days
+- demand standard deviation over the same weights
+- safety stock = z(service level) * std * sqrt(lead time)
+- reorder point = mean * lead time + safety stock
+"""
+import itertools
+import math
+from datetime import datetime, time, timedelta
+from statistics import NormalDist
+
+import numpy as np
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import StockTransaction
+
+CHUNK_SIZE = 100000
+
+
+def day_weights(age, method='ewma', alpha=0.1, window=28):
+    """Unnormalised weight of a day age days before the newest day of the window"""
+    if method == 'ewma':
+        # Newest day has weight 1, each older day (1 - alpha) times less
+        return (1 - alpha) ** age.astype(np.float64)
+    return (age < window).astype(np.float64)
+
+
+def daily_sales(start, end, locations=None):
+    """
+    (variant_id, location_id, day, units) rows: net units per local day in
+    [start, end), ordered by variant and location
+    """
+    rows = StockTransaction.objects.filter(
+        reference_type='SO',
+        transaction_type__in=['OUT', 'RETURN'],
+        timestamp__gte=timezone.make_aware(datetime.combine(start, time.min)),
+        timestamp__lt=timezone.make_aware(datetime.combine(end, time.min))
+    )
+    if locations:
+        rows = rows.filter(location_id__in=locations)
+    return rows.values(
+        'variant', 'location', day=TruncDate('timestamp')
+    ).annotate(units=Sum('quantity')).values_list('variant', 'location', 'day', 'units').order_by(
+        'variant', 'location'
+    )
+
+
+def _moments(pairs, first, second):
+    """Sum first and second per unique row of pairs"""
+    pair_keys, index = np.unique(pairs, axis=0, return_inverse=True)
+    index = index.reshape(-1)
+    return (
+        pair_keys,
+        np.bincount(index, weights=first, minlength=len(pair_keys)),
+        np.bincount(index, weights=second, minlength=len(pair_keys)),
+    )
+
+
+def demand_statistics(start, end, locations=None, method='ewma', alpha=0.1, window=28):
+    """
+    Weighted mean and standard deviation of daily demand for every
+    (variant, location) that sold in [start, end).
+    Returns (pair_keys, mean, std): an (n, 2) array of (variant_id,
+    location_id) and two float arrays of length n.
+    """
+    newest = np.datetime64(end - timedelta(days=1), 'D')
+    folded = []
+    iterator = daily_sales(start, end, locations).iterator(chunk_size=CHUNK_SIZE)
+    while True:
+        chunk = list(itertools.islice(iterator, CHUNK_SIZE))
+        if not chunk:
+            break
+        variant_ids, location_ids, days, units = zip(*chunk)
+        # OUT rows are negative and RETURN rows positive; demand is the negation
+        demand = -np.array(units, dtype=np.float64)
+        age = (newest - np.array(days, dtype='datetime64[D]')).astype(np.int64)
+        weights = day_weights(age, method, alpha, window)
+        folded.append(_moments(
+            np.stack([np.array(variant_ids, dtype=np.int64), np.array(location_ids, dtype=np.int64)], axis=1),
+            weights * demand,
+            weights * demand * demand
+        ))
+    if not folded:
+        return np.empty((0, 2), dtype=np.int64), np.array([]), np.array([])
+
+    # A pair split across two chunks is folded once more here
+    pair_keys, first, second = _moments(*(np.concatenate(parts) for parts in zip(*folded)))
+    total = day_weights(np.arange((end - start).days), method, alpha, window).sum()
+    mean = first / total
+    std = np.sqrt(np.maximum(second / total - mean * mean, 0.0))
+    return pair_keys, mean, std
+
+
+def reorder_points(mean, std, lead_time_days=7, service_level=0.95):
+    """(safety_stock, reorder_point) as integer arrays, rounded up"""
+    z = NormalDist().inv_cdf(service_level)
+    safety_stock = np.ceil(z * std * math.sqrt(lead_time_days))
+    # Returns can outweigh sales in the window - never suggest negative stock
+    reorder_point = np.ceil(np.maximum(mean, 0.0) * lead_time_days + safety_stock)
+    return safety_stock.astype(np.int64), reorder_point.astype(np.int64)
+
+
+def compute_forecasts(days=730, method='ewma', alpha=0.1, window=28,
+                      lead_time_days=7, service_level=0.95, locations=None, today=None):
+    """
+    Forecast every (variant, location) with sales in the last days days
+    (today excluded, as it is incomplete).
+    Returns {(variant_id, location_id): (mean, safety_stock, reorder_point)}
+    """
+    today = today or timezone.localdate()
+    start = today - timedelta(days=days)
+    pair_keys, mean, std = demand_statistics(start, today, locations, method, alpha, window)
+    if not len(pair_keys):
+        return {}
+
+    safety_stock, reorder_point = reorder_points(mean, std, lead_time_days, service_level)
+    return {
+        (variant_id, location_id): (avg, safety, threshold)
+        for (variant_id, location_id), avg, safety, threshold in zip(
+            pair_keys.tolist(), mean.tolist(), safety_stock.tolist(), reorder_point.tolist()
+        )
+    }
@@ -0,0 +1,150 @@
+"""
+Management command to measure checkout throughput on a single hot SKU
+Usage: python manage.py benchmark_checkout --threads 16 --seconds 10 [--shards 8]
+
+Runs concurrent reservations against one StockRecord and reports
+reservations per second. --mode locked replays the old read-modify-write
+pattern (select_for_update held for the whole "serializer run") so the two
+can be compared on the same database.
+
+--shards N runs the atomic single-row benchmark, then the same load with
+the record split into N StockShards, and reports both.
+"""
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F
+
+from apps.catalog.models import Category, Product, ProductVariant
+from apps.inventory import services
+from apps.inventory.models import StockRecord
+from apps.users.models import Store
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks concurrent stock reservations on a single hot SKU'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument(
+            '--mode', choices=['atomic', 'locked'], default='atomic',
+            help="atomic: conditional UPDATE (current). locked: select_for_update read-modify-write"
+        )
+        parser.add_argument(
+            '--work-ms', type=float, default=2.0,
+            help="Simulated per-checkout work inside the transaction (order/item inserts)"
+        )
+        parser.add_argument(
+            '--shards', type=int, default=0,
+            help="Also benchmark the record split into this many shards"
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite':
+            self.stdout.write(self.style.WARNING(
+                'SQLite serialises all writers - numbers will not reflect PostgreSQL behaviour.'
+            ))
+
+        if options['shards'] and options['mode'] != 'atomic':
+            self.stderr.write('--shards compares against --mode atomic')
+            return
+
+        stock = self._setup()
+        work = options['work_ms'] / 1000.0
+
+        def atomic_checkout():
+            with transaction.atomic():
+                # Order/item inserts happen before the reservation touches the hot row
+                time.sleep(work)
+                services.reserve(stock.variant, stock.location, 1)
+
+        def sharded_checkout():
+            with transaction.atomic():
+                time.sleep(work)
+                services.reserve_sharded(stock.variant, stock.location, 1)
+
+        def locked_checkout():
+            with transaction.atomic():
+                record = StockRecord.objects.select_for_update().get(pk=stock.pk)
+                time.sleep(work)
+                record.reserved_quantity += 1
+                record.save()
+
+        checkout = atomic_checkout if options['mode'] == 'atomic' else locked_checkout
+        baseline = self._run(checkout, stock, options['mode'], options)
+        if options['shards']:
+            StockRecord.objects.filter(pk=stock.pk).update(shard_count=options['shards'])
+            self._reset(stock)
+            sharded = self._run(sharded_checkout, stock, f"{options['shards']} shards", options)
+            StockRecord.objects.filter(pk=stock.pk).update(shard_count=0)
+            self._reset(stock)
+            self.stdout.write(self.style.SUCCESS(
+                f"sharded/single-row: {sharded / baseline if baseline else 0:.2f}x"
+            ))
+
+    def _run(self, checkout, stock, label, options):
+        """Run checkout from options['threads'] threads for options['seconds']; returns reservations/s"""
+        deadline = time.monotonic() + options['seconds']
+        counts = []
+        lock = threading.Lock()
+
+        def worker():
+            done = 0
+            try:
+                while time.monotonic() < deadline:
+                    checkout()
+                    done += 1
+            finally:
+                connection.close()
+            with lock:
+                counts.append(done)
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        started = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.monotonic() - started
+
+        total = sum(counts)
+        self._reset(stock)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{label}: {total} reservations in {elapsed:.2f}s "
+            f"= {total / elapsed:.1f}/s across {options['threads']} threads"
+        ))
+        return total / elapsed
+
+    def _reset(self, stock):
+        """Drop the benchmark's reservations, re-splitting the stock if the record is sharded"""
+        with transaction.atomic():
+            StockRecord.objects.filter(pk=stock.pk).update(reserved_quantity=0, available_quantity=F('quantity'))
+            stock.shards.all().delete()
+            services.rebalance_shards(stock)
+
+    def _setup(self):
+        """Create (or reset) a dedicated benchmark store/variant with plenty of stock"""
+        store, _ = Store.objects.get_or_create(
+            code='BENCH',
+            defaults={'name': 'Benchmark Store', 'address': 'n/a'}
+        )
+        category, _ = Category.objects.get_or_create(name='Benchmark')
+        product, _ = Product.objects.get_or_create(
+            name='Benchmark Product',
+            defaults={'category': category, 'base_price': 100}
+        )
+        variant, _ = ProductVariant.objects.get_or_create(
+            sku='BENCH-HOT-SKU',
+            defaults={'product': product, 'retail_price': 100, 'wholesale_price': 80}
+        )
+        stock, _ = StockRecord.objects.update_or_create(
+            variant=variant,
+            location=store,
+            defaults={'quantity': 10_000_000, 'reserved_quantity': 0, 'shard_count': 0}
+        )
+        stock.shards.all().delete()
+        return stock
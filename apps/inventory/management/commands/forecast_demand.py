@@ -0,0 +1,113 @@
+"""
+Management command to forecast daily demand and suggest StockAlert thresholds
+Usage: python manage.py forecast_demand [--days 730] [--method ewma|sma] [--lead-time 7]
+                                        [--service-level 0.95] [--apply] [--create-missing]
+
+Writes avg_daily_demand, safety_stock and suggested_threshold to every
+active StockAlert. --apply also copies the suggestion into threshold
+(alerts without sales in the window keep theirs);
+--create-missing adds alerts for variants/locations that sell but have none.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from apps.inventory import services
+from apps.inventory.forecasting import compute_forecasts
+from apps.inventory.models import StockAlert
+
+
+class Command(BaseCommand):
+    help = 'Forecasts demand from sales history and writes reorder points to stock alerts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=730, help='Days of sales history to read')
+        parser.add_argument('--method', choices=['ewma', 'sma'], default='ewma')
+        parser.add_argument('--alpha', type=float, default=0.1, help='EWMA smoothing factor')
+        parser.add_argument('--window', type=int, default=28, help='Moving average window in days (sma)')
+        parser.add_argument('--lead-time', type=float, default=7.0, help='Replenishment lead time in days')
+        parser.add_argument('--service-level', type=float, default=0.95)
+        parser.add_argument('--location', type=int, action='append', dest='locations')
+        parser.add_argument('--apply', action='store_true', help='Set threshold to the suggestion')
+        parser.add_argument('--create-missing', action='store_true', help='Create alerts for unalerted pairs')
+
+    def handle(self, *args, **options):
+        if not 0 < options['alpha'] <= 1:
+            raise CommandError('--alpha must be in (0, 1]')
+        if not 0.5 <= options['service_level'] < 1:
+            raise CommandError('--service-level must be in [0.5, 1)')
+        if options['days'] < 1 or options['window'] < 1:
+            raise CommandError('--days and --window must be positive')
+
+        started = time.monotonic()
+        forecasts = compute_forecasts(
+            days=options['days'],
+            method=options['method'],
+            alpha=options['alpha'],
+            window=options['window'],
+            lead_time_days=options['lead_time'],
+            service_level=options['service_level'],
+            locations=options['locations']
+        )
+        computed = time.monotonic()
+        self.stdout.write(f'Forecast {len(forecasts)} variant/locations in {computed - started:.1f}s')
+
+        updated, created = self._write(forecasts, options)
+        self.stdout.write(self.style.SUCCESS(
+            f'{updated} alerts updated, {created} created in {time.monotonic() - computed:.1f}s'
+        ))
+
+    @transaction.atomic
+    def _write(self, forecasts, options):
+        now = timezone.now()
+        alerts = StockAlert.objects.filter(is_active=True).only(
+            'id', 'variant_id', 'location_id', 'threshold'
+        )
+        if options['locations']:
+            alerts = alerts.filter(location_id__in=options['locations'])
+
+        fields = ['avg_daily_demand', 'safety_stock', 'suggested_threshold', 'forecast_updated_at']
+        if options['apply']:
+            fields.append('threshold')
+
+        changed = {}
+        alerts = list(alerts)
+        existing = set()
+        for alert in alerts:
+            key = (alert.variant_id, alert.location_id)
+            existing.add(key)
+            # No sales in the window means no demand
+            avg, safety, threshold = forecasts.get(key, (0.0, 0, 0))
+            alert.avg_daily_demand = avg
+            alert.safety_stock = safety
+            alert.suggested_threshold = threshold
+            alert.forecast_updated_at = now
+            # Without sales history keep the manual threshold rather than dropping it to 0
+            if options['apply'] and key in forecasts and alert.threshold != threshold:
+                alert.threshold = threshold
+                changed.setdefault(alert.location_id, []).append(alert.variant_id)
+        StockAlert.objects.bulk_update(alerts, fields, batch_size=5000)
+
+        new_alerts = []
+        if options['create_missing']:
+            for (variant_id, location_id), (avg, safety, threshold) in forecasts.items():
+                if (variant_id, location_id) in existing or not threshold:
+                    continue
+                new_alerts.append(StockAlert(
+                    variant_id=variant_id,
+                    location_id=location_id,
+                    threshold=threshold,
+                    avg_daily_demand=avg,
+                    safety_stock=safety,
+                    suggested_threshold=threshold,
+                    forecast_updated_at=now
+                ))
+                changed.setdefault(location_id, []).append(variant_id)
+            StockAlert.objects.bulk_create(new_alerts, batch_size=5000)
+
+        # Thresholds moved - record any alert that crossed as a result
+        for location_id, variant_ids in changed.items():
+            services.record_alert_crossings(location_id, variant_ids)
+        return len(alerts), len(new_alerts)
@@ -0,0 +1,71 @@
+"""
+Management command to give stock on hand an opening cost layer
+Usage: python manage.py open_stock_valuation [--location 3] [--dry-run]
+
+Valuation only sees units that arrived through a GRN, return or transfer
+after it was introduced. Run this once to value every StockRecord's
+on-hand units not covered by cost layers at the variant's latest purchase
+order price (variants never purchased are valued at 0 and listed).
+"""
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from apps.inventory import valuation
+from apps.inventory.models import StockRecord, StockValuation
+
+
+class Command(BaseCommand):
+    help = 'Creates opening cost layers for stock on hand without a cost'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--location', type=int, action='append', dest='locations')
+        parser.add_argument('--dry-run', action='store_true', help='Report without writing')
+
+    def handle(self, *args, **options):
+        from apps.purchasing.models import PurchaseOrderItem
+
+        valued = StockValuation.objects.filter(
+            variant=OuterRef('variant'), location=OuterRef('location')
+        ).values('quantity')
+        latest_price = PurchaseOrderItem.objects.filter(variant=OuterRef('variant')).exclude(
+            purchase_order__status='CANCELLED'
+        ).order_by('-purchase_order__created_at', '-id').values('unit_price')[:1]
+        records = StockRecord.objects.annotate(
+            uncosted=F('quantity') - Coalesce(Subquery(valued, output_field=IntegerField()), Value(0)),
+            unit_cost=Subquery(latest_price)
+        ).filter(uncosted__gt=0)
+        if options['locations']:
+            records = records.filter(location_id__in=options['locations'])
+
+        by_location = {}
+        unpriced = []
+        for variant_id, location_id, sku, uncosted, unit_cost in records.values_list(
+            'variant_id', 'location_id', 'variant__sku', 'uncosted', 'unit_cost'
+        ).order_by():
+            if unit_cost is None:
+                unpriced.append(sku)
+            by_location.setdefault(location_id, []).append(
+                (variant_id, location_id, uncosted, unit_cost or Decimal(0))
+            )
+
+        total_units = total_value = 0
+        for location_id, lines in sorted(by_location.items()):
+            units = sum(line[2] for line in lines)
+            value = sum(line[2] * line[3] for line in lines)
+            total_units += units
+            total_value += value
+            self.stdout.write(f'Location {location_id}: {len(lines)} records, {units} units, value {value:.2f}')
+            if not options['dry_run']:
+                with transaction.atomic():
+                    valuation.receive(lines, 'ADJUSTMENT', 0, entry_type='OPENING')
+
+        if unpriced:
+            self.stdout.write(self.style.WARNING(
+                f'{len(unpriced)} variants never purchased, valued at 0: {", ".join(sorted(set(unpriced))[:20])}'
+            ))
+        verb = 'Would open' if options['dry_run'] else 'Opened'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {total_units} units at {total_value:.2f}'))
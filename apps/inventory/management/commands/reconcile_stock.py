@@ -0,0 +1,195 @@
+"""
+Management command to reconcile the stock ledger against StockRecord
+Usage: python manage.py reconcile_stock [--workers 8] [--location 3] [--output report.csv] [--fix]
+
+Each location is handled by one worker process running one grouped query
+over its ledger rows and one over its stock records, so the work scales
+with the number of stores rather than the number of rows fetched into
+Python. Discrepancies are written to a CSV report.
+
+StockRecord is treated as the source of truth: --fix writes an ADJUSTMENT
+ledger row for each discrepancy so the ledger sums to the recorded
+quantity again. Reservation rows (RESERVE) are not counted.
+"""
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+
+def _init_worker():
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    # Never reuse a connection inherited from the parent process
+    connections.close_all()
+
+
+def _ledger_totals(location_id, variant_ids=None):
+    from apps.inventory.models import StockTransaction
+    rows = StockTransaction.objects.affecting_on_hand().filter(location_id=location_id)
+    if variant_ids is not None:
+        rows = rows.filter(variant_id__in=variant_ids)
+    return {
+        row['variant']: (row['total'], row['rows'])
+        for row in rows.values('variant').annotate(total=Sum('quantity'), rows=Count('id')).order_by()
+    }
+
+
+def reconcile_location(location_id):
+    """
+    Compare ledger totals with stock records at one location.
+    Returns (location_id, ledger_rows, records_checked, seconds, discrepancies)
+    where discrepancies are (variant_id, recorded, ledger) tuples.
+    """
+    from apps.inventory.models import StockRecord
+
+    started = time.monotonic()
+    ledger = _ledger_totals(location_id)
+    recorded = dict(
+        StockRecord.objects.filter(location_id=location_id).values_list('variant_id', 'quantity')
+    )
+    discrepancies = []
+    for variant_id in sorted(ledger.keys() | recorded.keys()):
+        ledger_qty = ledger.get(variant_id, (0, 0))[0]
+        record_qty = recorded.get(variant_id, 0)
+        if ledger_qty != record_qty:
+            discrepancies.append((variant_id, record_qty, ledger_qty))
+    ledger_rows = sum(rows for _, rows in ledger.values())
+    return location_id, ledger_rows, len(recorded), time.monotonic() - started, discrepancies
+
+
+class Command(BaseCommand):
+    help = 'Compares ledger totals with StockRecord quantities per variant and location'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Worker processes (1 runs in this process)'
+        )
+        parser.add_argument(
+            '--location', type=int, action='append', dest='locations',
+            help='Only reconcile this location id (repeatable)'
+        )
+        parser.add_argument('--output', help='CSV report path (default: reconcile-<timestamp>.csv)')
+        parser.add_argument(
+            '--fix', action='store_true',
+            help='Write ADJUSTMENT ledger rows so the ledger matches StockRecord'
+        )
+
+    def handle(self, *args, **options):
+        from apps.users.models import Store
+
+        stores = Store.objects.order_by('pk')
+        if options['locations']:
+            stores = stores.filter(pk__in=options['locations'])
+        stores = dict(stores.values_list('pk', 'name'))
+        output = options['output'] or f"reconcile-{timezone.localtime():%Y%m%d-%H%M%S}.csv"
+        workers = max(1, min(options['workers'], len(stores) or 1))
+
+        started = time.monotonic()
+        results = []
+        for done, result in enumerate(self._run(list(stores), workers), start=1):
+            location_id, ledger_rows, records, seconds, discrepancies = result
+            results.append(result)
+            self.stdout.write(
+                f'[{done}/{len(stores)}] {stores[location_id]}: {ledger_rows} ledger rows, '
+                f'{records} stock records, {len(discrepancies)} discrepancies ({seconds:.1f}s)'
+            )
+
+        discrepancies = [
+            (location_id, variant_id, recorded, ledger)
+            for location_id, _, _, _, found in results
+            for variant_id, recorded, ledger in found
+        ]
+        self._write_report(output, discrepancies, stores)
+
+        fixed = self._fix(discrepancies) if options['fix'] and discrepancies else 0
+
+        elapsed = time.monotonic() - started
+        total_rows = sum(result[1] for result in results)
+        self.stdout.write(
+            f'{len(stores)} locations, {total_rows} ledger rows in {elapsed:.1f}s '
+            f'({total_rows / elapsed if elapsed else 0:.0f} rows/s) with {workers} worker(s)'
+        )
+        style = self.style.WARNING if discrepancies else self.style.SUCCESS
+        self.stdout.write(style(f'{len(discrepancies)} discrepancies written to {output}'))
+        if options['fix']:
+            self.stdout.write(self.style.SUCCESS(f'{fixed} adjustment rows written'))
+
+    def _run(self, location_ids, workers):
+        if workers == 1:
+            for location_id in location_ids:
+                yield reconcile_location(location_id)
+            return
+
+        # Forked workers must open their own connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            futures = [pool.submit(reconcile_location, location_id) for location_id in location_ids]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def _write_report(self, path, discrepancies, stores):
+        from apps.catalog.models import ProductVariant
+
+        skus = dict(
+            ProductVariant.objects.filter(
+                pk__in={variant_id for _, variant_id, _, _ in discrepancies}
+            ).values_list('pk', 'sku')
+        )
+        with open(path, 'w', newline='') as report:
+            writer = csv.writer(report)
+            writer.writerow([
+                'location_id', 'location', 'variant_id', 'sku',
+                'stock_record_quantity', 'ledger_quantity', 'difference'
+            ])
+            for location_id, variant_id, recorded, ledger in sorted(discrepancies):
+                writer.writerow([
+                    location_id, stores[location_id], variant_id, skus.get(variant_id, ''),
+                    recorded, ledger, recorded - ledger
+                ])
+
+    def _fix(self, discrepancies):
+        """
+        Re-check each discrepancy with the stock rows locked (the ledger may
+        have moved since the scan) and write the balancing ADJUSTMENT rows
+        """
+        from apps.inventory import services
+        from apps.inventory.models import StockTransaction
+
+        by_location = {}
+        for location_id, variant_id, _, _ in discrepancies:
+            by_location.setdefault(location_id, []).append(variant_id)
+
+        written = 0
+        for location_id, variant_ids in by_location.items():
+            with transaction.atomic():
+                records = services.lock_stock_records(location_id, variant_ids)
+                ledger = _ledger_totals(location_id, variant_ids)
+                adjustments = []
+                for variant_id in variant_ids:
+                    record = records.get(variant_id)
+                    recorded = record.quantity if record else 0
+                    ledger_qty = ledger.get(variant_id, (0, 0))[0]
+                    if recorded == ledger_qty:
+                        continue
+                    adjustments.append(StockTransaction(
+                        variant_id=variant_id,
+                        location_id=location_id,
+                        transaction_type='ADJUSTMENT',
+                        quantity=recorded - ledger_qty,
+                        reference_type='ADJUSTMENT',
+                        reference_id=record.id if record else 0,
+                        notes=f'Reconciliation: ledger {ledger_qty} -> stock record {recorded}'
+                        + ('' if record else ' (no stock record)')
+                    ))
+                StockTransaction.objects.bulk_create(adjustments)
+                written += len(adjustments)
+        return written
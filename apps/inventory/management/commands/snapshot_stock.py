@@ -0,0 +1,51 @@
+"""
+Management command to write end-of-day stock snapshots from the ledger
+Usage: python manage.py snapshot_stock [--date 2026-03-31] [--days 7] [--rebuild]
+
+Run nightly (after midnight) to snapshot the day that just closed. Each run
+reads only the ledger rows since the previous snapshot.
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from apps.inventory.snapshots import build_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Writes end-of-day stock snapshots used by point-in-time stock queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--date',
+            help='Last day to snapshot (YYYY-MM-DD, default: yesterday)'
+        )
+        parser.add_argument(
+            '--days', type=int, default=1,
+            help='Number of days ending at --date to snapshot, oldest first'
+        )
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Replace snapshots that already exist'
+        )
+
+    def handle(self, *args, **options):
+        if options['date']:
+            last = parse_date(options['date'])
+            if last is None:
+                raise CommandError('--date must be YYYY-MM-DD')
+        else:
+            last = timezone.localdate() - timedelta(days=1)
+        if last >= timezone.localdate():
+            raise CommandError('Only days that have ended can be snapshotted')
+        if options['days'] < 1:
+            raise CommandError('--days must be at least 1')
+
+        for offset in range(options['days'] - 1, -1, -1):
+            date = last - timedelta(days=offset)
+            snapshot = build_snapshot(date, rebuild=options['rebuild'])
+            self.stdout.write(f'{date}: {snapshot.line_count} lines')
+
+        self.stdout.write(self.style.SUCCESS('Stock snapshots up to date'))
@@ -0,0 +1,95 @@
+"""
+Management command to switch hot-SKU sharding on or off and rebalance shards
+Usage: python manage.py stock_shards --sku SKU --location 3 --shards 8
+       python manage.py stock_shards --sku SKU --location 3 --shards 0
+       python manage.py stock_shards --rebalance [--loop --interval 5]
+
+--shards sets the record's shard count and immediately moves its available
+stock into the shards (0 folds everything back into the record). With
+--rebalance every sharded record is consolidated; run it with --loop while
+a hot SKU is on sale so drained shards are refilled and summaries/alerts
+catch up. Without options, lists the sharded records.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from apps.inventory import services
+from apps.inventory.models import StockRecord
+
+
+class Command(BaseCommand):
+    help = 'Enables, disables and rebalances StockShards for hot SKUs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sku', help='Variant SKU to (un)shard')
+        parser.add_argument('--location', type=int, help='Location id of the stock record')
+        parser.add_argument('--shards', type=int, help='Number of shards; 0 disables sharding')
+        parser.add_argument('--rebalance', action='store_true', help='Rebalance every sharded record')
+        parser.add_argument('--loop', action='store_true', help='With --rebalance, keep running as a daemon')
+        parser.add_argument(
+            '--interval', type=float, default=5.0,
+            help='Seconds to sleep between rebalances with --loop'
+        )
+
+    def handle(self, *args, **options):
+        if options['shards'] is not None:
+            self._configure(options['sku'], options['location'], options['shards'])
+        elif options['rebalance']:
+            try:
+                while True:
+                    self._rebalance_all()
+                    if not options['loop']:
+                        break
+                    time.sleep(options['interval'])
+            except KeyboardInterrupt:
+                self.stdout.write('Stopped')
+        else:
+            self._list()
+
+    def _configure(self, sku, location_id, shards):
+        if not sku or location_id is None:
+            raise CommandError('--shards needs --sku and --location')
+        if shards < 0:
+            raise CommandError('--shards must be 0 or more')
+        try:
+            record = StockRecord.objects.select_related('location').get(
+                variant__sku=sku, location_id=location_id
+            )
+        except StockRecord.DoesNotExist:
+            raise CommandError(f'No stock record for {sku} at location {location_id}')
+
+        with transaction.atomic():
+            StockRecord.objects.filter(pk=record.pk).update(shard_count=shards)
+            record = services.rebalance_shards(record)
+            services.stock_changed(record.location_id, [record.variant_id])
+        self.stdout.write(self.style.SUCCESS(
+            f'{sku} @ {record.location}: {shards} shards' if shards else f'{sku} @ {record.location}: sharding off'
+        ))
+
+    def _sharded(self):
+        return StockRecord.objects.filter(Q(shard_count__gt=0) | Q(shards__isnull=False)).distinct()
+
+    def _rebalance_all(self):
+        started = time.monotonic()
+        records = list(self._sharded().values_list('pk', 'location_id', 'variant_id'))
+        for pk, location_id, variant_id in records:
+            # One short transaction per record, so checkouts only wait on one at a time
+            with transaction.atomic():
+                services.rebalance_shards(pk)
+                services.stock_changed(location_id, [variant_id])
+        if records:
+            self.stdout.write(f'Rebalanced {len(records)} records in {time.monotonic() - started:.2f}s')
+
+    def _list(self):
+        records = self._sharded().with_shard_stock().select_related('variant', 'location')
+        for record in records:
+            self.stdout.write(
+                f'{record.variant.sku} @ {record.location} (location {record.location_id}): '
+                f'{record.shard_count} shards, {record.available_quantity + record.shard_free} available '
+                f'({record.shard_free} in shards)'
+            )
+        if not records:
+            self.stdout.write('No sharded stock records')
@@ -0,0 +1,85 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:40
+
+from django.db import migrations, models
+from django.db.models import F, Q, FilteredRelation
+import django.db.models.deletion
+
+
+def backfill_is_triggered(apps, schema_editor):
+    """Seed the stored state so the first write after deploy doesn't emit stale events"""
+    StockAlert = apps.get_model("inventory", "StockAlert")
+    triggered = (
+        StockAlert.objects.annotate(
+            stock_record=FilteredRelation(
+                "variant__stock_records",
+                condition=Q(variant__stock_records__location=F("location")),
+            )
+        )
+        .filter(
+            Q(stock_record__id__isnull=True)
+            | Q(
+                threshold__gt=F("stock_record__quantity")
+                - F("stock_record__reserved_quantity")
+            )
+        )
+        .values("id")
+    )
+    StockAlert.objects.filter(id__in=triggered).update(is_triggered=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inventory", "0002_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stockalert",
+            name="is_triggered",
+            field=models.BooleanField(
+                default=False,
+                editable=False,
+                help_text="Last evaluated state, maintained at stock write time",
+            ),
+        ),
+        migrations.CreateModel(
+            name="StockAlertEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "event_type",
+                    models.CharField(
+                        choices=[
+                            ("TRIGGERED", "Fell below threshold"),
+                            ("CLEARED", "Back above threshold"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("available_quantity", models.IntegerField()),
+                ("threshold", models.PositiveIntegerField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "alert",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="events",
+                        to="inventory.stockalert",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["id"],
+            },
+        ),
+        migrations.RunPython(backfill_is_triggered, migrations.RunPython.noop),
+    ]
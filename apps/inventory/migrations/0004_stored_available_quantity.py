@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:41
+
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+
+def backfill_available_quantity(apps, schema_editor):
+    StockRecord = apps.get_model("inventory", "StockRecord")
+    StockRecord.objects.update(
+        available_quantity=Greatest(F("quantity") - F("reserved_quantity"), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inventory", "0003_stock_alert_events"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stockrecord",
+            name="available_quantity",
+            field=models.IntegerField(
+                default=0,
+                editable=False,
+                help_text="Quantity available for new orders (quantity - reserved, floored at 0)",
+            ),
+        ),
+        migrations.RunPython(backfill_available_quantity, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="stockrecord",
+            index=models.Index(
+                fields=["location", "available_quantity"],
+                name="stock_location_available_idx",
+            ),
+        ),
+    ]
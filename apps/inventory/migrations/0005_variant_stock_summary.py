@@ -0,0 +1,78 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:42
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+import django.db.models.deletion
+
+
+def backfill_summaries(apps, schema_editor):
+    StockRecord = apps.get_model("inventory", "StockRecord")
+    VariantStockSummary = apps.get_model("inventory", "VariantStockSummary")
+    rows = (
+        StockRecord.objects.values("variant")
+        .annotate(
+            total_quantity=Sum("quantity"),
+            total_reserved=Sum("reserved_quantity"),
+            total_available=Sum("available_quantity"),
+            locations_stocked=Count("pk", filter=Q(quantity__gt=0)),
+        )
+        .order_by()
+    )
+    VariantStockSummary.objects.bulk_create(
+        [
+            VariantStockSummary(
+                variant_id=row["variant"],
+                total_quantity=row["total_quantity"],
+                total_reserved=row["total_reserved"],
+                total_available=row["total_available"],
+                locations_stocked=row["locations_stocked"],
+            )
+            for row in rows.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0001_initial"),
+        ("inventory", "0004_stored_available_quantity"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VariantStockSummary",
+            fields=[
+                (
+                    "variant",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stock_summary",
+                        serialize=False,
+                        to="catalog.productvariant",
+                    ),
+                ),
+                (
+                    "total_quantity",
+                    models.IntegerField(
+                        default=0, help_text="On hand across all locations"
+                    ),
+                ),
+                ("total_reserved", models.IntegerField(default=0)),
+                ("total_available", models.IntegerField(default=0)),
+                (
+                    "locations_stocked",
+                    models.PositiveIntegerField(
+                        default=0, help_text="Number of locations with stock on hand"
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name_plural": "Variant stock summaries",
+            },
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inventory", "0005_variant_stock_summary"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="stocktransaction",
+            options={"ordering": ["-timestamp", "-id"]},
+        ),
+        migrations.AddIndex(
+            model_name="stocktransaction",
+            index=models.Index(
+                fields=["timestamp", "id"], name="stock_txn_timestamp_id_idx"
+            ),
+        ),
+    ]
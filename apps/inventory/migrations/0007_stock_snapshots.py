@@ -0,0 +1,111 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def mark_reservation_rows(apps, schema_editor):
+    # Reservations were logged as OUT rows, double counting every confirmed sale
+    StockTransaction = apps.get_model("inventory", "StockTransaction")
+    StockTransaction.objects.filter(
+        transaction_type="OUT",
+        reference_type="SO",
+        notes__startswith="Reserved for Order",
+    ).update(transaction_type="RESERVE")
+
+
+def unmark_reservation_rows(apps, schema_editor):
+    StockTransaction = apps.get_model("inventory", "StockTransaction")
+    StockTransaction.objects.filter(transaction_type="RESERVE").update(
+        transaction_type="OUT"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0001_initial"),
+        ("catalog", "0001_initial"),
+        ("inventory", "0006_keyset_pagination_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StockSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(unique=True)),
+                ("line_count", models.PositiveIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "ordering": ["-date"],
+            },
+        ),
+        migrations.AlterField(
+            model_name="stocktransaction",
+            name="transaction_type",
+            field=models.CharField(
+                choices=[
+                    ("IN", "Stock In"),
+                    ("OUT", "Stock Out"),
+                    ("TRANSFER", "Transfer"),
+                    ("ADJUSTMENT", "Manual Adjustment"),
+                    ("RETURN", "Return"),
+                    ("RESERVE", "Reservation"),
+                ],
+                max_length=20,
+            ),
+        ),
+        migrations.CreateModel(
+            name="StockSnapshotLine",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("quantity", models.IntegerField()),
+                (
+                    "location",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="users.store",
+                    ),
+                ),
+                (
+                    "snapshot",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="lines",
+                        to="inventory.stocksnapshot",
+                    ),
+                ),
+                (
+                    "variant",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="catalog.productvariant",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("snapshot", "location", "variant")},
+            },
+        ),
+        migrations.RunPython(mark_reservation_rows, unmark_reservation_rows),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inventory", "0008_stock_transfers"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stockalert",
+            name="avg_daily_demand",
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="stockalert",
+            name="forecast_updated_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="stockalert",
+            name="safety_stock",
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="stockalert",
+            name="suggested_threshold",
+            field=models.PositiveIntegerField(
+                blank=True,
+                editable=False,
+                help_text="Reorder point from the last demand forecast",
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inventory", "0009_alert_demand_forecast"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stockrecord",
+            name="shard_count",
+            field=models.PositiveSmallIntegerField(
+                default=0,
+                help_text="Split reservations across this many StockShards (0 = not sharded)",
+            ),
+        ),
+        migrations.CreateModel(
+            name="StockShard",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("shard", models.PositiveSmallIntegerField()),
+                (
+                    "capacity",
+                    models.PositiveIntegerField(
+                        default=0, help_text="Units escrowed from the record"
+                    ),
+                ),
+                (
+                    "reserved",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="Units of capacity reserved since the last rebalance",
+                    ),
+                ),
+                (
+                    "record",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="shards",
+                        to="inventory.stockrecord",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["record", "shard"],
+                "unique_together": {("record", "shard")},
+            },
+        ),
+    ]
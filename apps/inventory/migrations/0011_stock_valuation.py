@@ -0,0 +1,215 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0001_initial"),
+        ("users", "0001_initial"),
+        ("inventory", "0010_stock_shards"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ValuationEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "entry_type",
+                    models.CharField(
+                        choices=[
+                            ("OPENING", "Opening Balance"),
+                            ("RECEIPT", "Receipt"),
+                            ("SALE", "Sale"),
+                            ("RETURN", "Return"),
+                            ("TRANSFER_OUT", "Transfer Out"),
+                            ("TRANSFER_IN", "Transfer In"),
+                            ("ADJUSTMENT", "Adjustment"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "quantity",
+                    models.IntegerField(
+                        help_text="Positive for units in, negative for units out"
+                    ),
+                ),
+                ("fifo_value", models.DecimalField(decimal_places=4, max_digits=16)),
+                ("average_value", models.DecimalField(decimal_places=4, max_digits=16)),
+                (
+                    "reference_type",
+                    models.CharField(
+                        choices=[
+                            ("PO", "Purchase Order"),
+                            ("SO", "Sales Order"),
+                            ("TRANSFER", "Stock Transfer"),
+                            ("RETURN", "Return"),
+                            ("ADJUSTMENT", "Manual Adjustment"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("reference_id", models.IntegerField()),
+                ("timestamp", models.DateTimeField(auto_now_add=True)),
+                (
+                    "location",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="users.store",
+                    ),
+                ),
+                (
+                    "variant",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="catalog.productvariant",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "Valuation entries",
+                "ordering": ["-timestamp", "-id"],
+                "indexes": [
+                    models.Index(fields=["timestamp"], name="valuation_entry_time_idx"),
+                    models.Index(
+                        fields=["reference_type", "reference_id"],
+                        name="valuation_entry_ref_idx",
+                    ),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="StockValuation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "quantity",
+                    models.IntegerField(
+                        default=0,
+                        help_text="Units with a cost (remaining in cost layers)",
+                    ),
+                ),
+                (
+                    "fifo_value",
+                    models.DecimalField(
+                        decimal_places=4,
+                        default=0,
+                        help_text="Value of the remaining cost layers",
+                        max_digits=16,
+                    ),
+                ),
+                (
+                    "average_value",
+                    models.DecimalField(
+                        decimal_places=4,
+                        default=0,
+                        help_text="quantity x running weighted average cost",
+                        max_digits=16,
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "location",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="valuations",
+                        to="users.store",
+                    ),
+                ),
+                (
+                    "variant",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="valuations",
+                        to="catalog.productvariant",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("variant", "location")},
+            },
+        ),
+        migrations.CreateModel(
+            name="CostLayer",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("quantity", models.PositiveIntegerField(help_text="Units received")),
+                (
+                    "remaining",
+                    models.PositiveIntegerField(help_text="Units not consumed yet"),
+                ),
+                ("unit_cost", models.DecimalField(decimal_places=4, max_digits=12)),
+                (
+                    "reference_type",
+                    models.CharField(
+                        choices=[
+                            ("PO", "Purchase Order"),
+                            ("SO", "Sales Order"),
+                            ("TRANSFER", "Stock Transfer"),
+                            ("RETURN", "Return"),
+                            ("ADJUSTMENT", "Manual Adjustment"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("reference_id", models.IntegerField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "location",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="cost_layers",
+                        to="users.store",
+                    ),
+                ),
+                (
+                    "variant",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="cost_layers",
+                        to="catalog.productvariant",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["created_at", "id"],
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("remaining__gt", 0)),
+                        fields=["variant", "location", "created_at"],
+                        name="cost_layer_open_idx",
+                    )
+                ],
+            },
+        ),
+    ]
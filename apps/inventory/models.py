@@ -1,8 +1,34 @@
 from django.db import models
+from django.db.models import F, Q, FilteredRelation, ExpressionWrapper, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from apps.catalog.models import ProductVariant
 from apps.users.models import Store, CustomUser
 
 
+def shard_free_stock(record_ref='pk'):
+    """
+    Units escrowed to the StockShards of the record at record_ref and not
+    reserved yet (0 for unsharded records). These are counted in the
+    record's reserved_quantity, so reads add them back to available.
+    """
+    free = StockShard.objects.filter(record=OuterRef(record_ref)).values('record').annotate(
+        free=Sum(F('capacity') - F('reserved'))
+    ).values('free').order_by()
+    return Coalesce(Subquery(free, output_field=models.IntegerField()), 0)
+
+
+class StockRecordQuerySet(models.QuerySet):
+    
+    def with_shard_stock(self):
+        """
+        Annotate shard_free (see shard_free_stock) and true_available, the
+        units new orders can take: available_quantity plus shard_free
+        """
+        return self.annotate(shard_free=shard_free_stock()).annotate(
+            true_available=F('available_quantity') + F('shard_free')
+        )
+
+
 class StockRecord(models.Model):
     """Current stock levels for each variant at each location"""
     
@@ -21,38 +47,112 @@ class StockRecord(models.Model):
         default=0,
         help_text="Quantity reserved for pending orders"
     )
+    available_quantity = models.IntegerField(
+        default=0,
+        editable=False,
+        help_text="Quantity available for new orders (quantity - reserved, floored at 0)"
+    )
+    shard_count = models.PositiveSmallIntegerField(
+        default=0,
+        help_text="Split reservations across this many StockShards (0 = not sharded)"
+    )
     last_updated = models.DateTimeField(auto_now=True)
     
+    objects = StockRecordQuerySet.as_manager()
+    
     class Meta:
         unique_together = ('variant', 'location')
         ordering = ['variant', 'location']
+        indexes = [
+            models.Index(fields=['location', 'available_quantity'], name='stock_location_available_idx'),
+        ]
     
     def __str__(self):
         return f"{self.variant.sku} @ {self.location.name}: {self.available_quantity}"
     
-    @property
-    def available_quantity(self):
-        """Quantity available for new orders"""
-        return max(0, self.quantity - self.reserved_quantity)
+    def update_available_quantity(self):
+        """Recompute the stored available quantity after changing quantity/reserved in Python"""
+        self.available_quantity = max(0, self.quantity - self.reserved_quantity)
+    
+    def save(self, *args, **kwargs):
+        self.update_available_quantity()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'available_quantity' not in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['available_quantity']
+        super().save(*args, **kwargs)
     
     def reserve_stock(self, qty):
         """Reserve stock for pending order"""
-        if self.available_quantity >= qty:
-            self.reserved_quantity += qty
-            self.save()
-            return True
-        return False
+        from .services import reserve, stock_changed, InsufficientStock
+        try:
+            reserve(self.variant, self.location, qty)
+        except InsufficientStock:
+            return False
+        stock_changed(self.location, [self.variant_id])
+        self.refresh_from_db(fields=['quantity', 'reserved_quantity', 'available_quantity', 'last_updated'])
+        return True
     
     def release_reservation(self, qty):
         """Release reserved stock (cancelled order)"""
-        self.reserved_quantity = max(0, self.reserved_quantity - qty)
-        self.save()
+        from .services import release, stock_changed
+        release(self.variant, self.location, qty)
+        stock_changed(self.location, [self.variant_id])
+        self.refresh_from_db(fields=['quantity', 'reserved_quantity', 'available_quantity', 'last_updated'])
     
     def confirm_sale(self, qty):
         """Confirm sale - decrement both quantity and reserved"""
-        self.quantity = max(0, self.quantity - qty)
-        self.reserved_quantity = max(0, self.reserved_quantity - qty)
-        self.save()
+        from .services import confirm_sale, stock_changed
+        confirm_sale(self.variant, self.location, qty)
+        stock_changed(self.location, [self.variant_id])
+        self.refresh_from_db(fields=['quantity', 'reserved_quantity', 'available_quantity', 'last_updated'])
+
+
+class StockShard(models.Model):
+    """A slice of a hot StockRecord's available units that reservations can take without locking the record"""
+    
+    record = models.ForeignKey(StockRecord, on_delete=models.CASCADE, related_name='shards')
+    shard = models.PositiveSmallIntegerField()
+    capacity = models.PositiveIntegerField(default=0, help_text="Units escrowed from the record")
+    reserved = models.PositiveIntegerField(default=0, help_text="Units of capacity reserved since the last rebalance")
+    
+    class Meta:
+        unique_together = ('record', 'shard')
+        ordering = ['record', 'shard']
+    
+    def __str__(self):
+        return f"{self.record_id}#{self.shard}: {self.reserved}/{self.capacity}"
+
+
+class VariantStockSummary(models.Model):
+    """Stock totals across all locations, maintained with every stock mutation"""
+    
+    variant = models.OneToOneField(
+        ProductVariant,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stock_summary'
+    )
+    total_quantity = models.IntegerField(default=0, help_text="On hand across all locations")
+    total_reserved = models.IntegerField(default=0)
+    total_available = models.IntegerField(default=0)
+    locations_stocked = models.PositiveIntegerField(
+        default=0,
+        help_text="Number of locations with stock on hand"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = 'Variant stock summaries'
+    
+    def __str__(self):
+        return f"{self.variant.sku}: {self.total_available} available at {self.locations_stocked} locations"
+
+
+class StockTransactionQuerySet(models.QuerySet):
+    
+    def affecting_on_hand(self):
+        """Rows that change StockRecord.quantity (excludes reservation records)"""
+        return self.exclude(transaction_type__in=StockTransaction.RESERVATION_TYPES)
 
 
 class StockTransaction(models.Model):
@@ -64,8 +164,12 @@ class StockTransaction(models.Model):
         ('TRANSFER', 'Transfer'),
         ('ADJUSTMENT', 'Manual Adjustment'),
         ('RETURN', 'Return'),
+        ('RESERVE', 'Reservation'),
     ]
     
+    # Recorded for the audit trail only - on-hand quantity is unchanged
+    RESERVATION_TYPES = ['RESERVE']
+    
     REFERENCE_TYPE_CHOICES = [
         ('PO', 'Purchase Order'),
         ('SO', 'Sales Order'),
@@ -97,13 +201,47 @@ class StockTransaction(models.Model):
     notes = models.TextField(blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     
+    objects = StockTransactionQuerySet.as_manager()
+    
     class Meta:
-        ordering = ['-timestamp']
+        ordering = ['-timestamp', '-id']
+        indexes = [
+            # Keyset pagination of the ledger (see apps.core.pagination.KeysetPagination)
+            models.Index(fields=['timestamp', 'id'], name='stock_txn_timestamp_id_idx'),
+        ]
     
     def __str__(self):
         return f"{self.transaction_type} - {self.variant.sku} @ {self.location.name}: {self.quantity}"
 
 
+class StockAlertQuerySet(models.QuerySet):
+    
+    def with_stock_status(self):
+        """
+        Annotate current_stock and is_below_threshold from a LEFT JOIN to the
+        matching StockRecord, so alert status costs no extra query per alert
+        """
+        return self.annotate(
+            stock_record=FilteredRelation(
+                'variant__stock_records',
+                condition=Q(variant__stock_records__location=F('location'))
+            )
+        ).annotate(
+            current_stock=Coalesce(F('stock_record__available_quantity'), 0)
+            + shard_free_stock('stock_record__id')
+        ).annotate(
+            # No stock record = alert needed
+            is_below_threshold=ExpressionWrapper(
+                Q(stock_record__id__isnull=True) | Q(current_stock__lt=F('threshold')),
+                output_field=models.BooleanField()
+            )
+        )
+    
+    def triggered(self):
+        """Active alerts currently below threshold, evaluated in one query"""
+        return self.with_stock_status().filter(is_active=True, is_below_threshold=True)
+
+
 class StockAlert(models.Model):
     """Low stock alerts configuration"""
     
@@ -122,8 +260,26 @@ class StockAlert(models.Model):
         help_text="Alert when stock falls below this level"
     )
     is_active = models.BooleanField(default=True)
+    is_triggered = models.BooleanField(
+        default=False,
+        editable=False,
+        help_text="Last evaluated state, maintained at stock write time"
+    )
+    
+    # Written by the forecast_demand command
+    avg_daily_demand = models.FloatField(null=True, blank=True, editable=False)
+    safety_stock = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    suggested_threshold = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Reorder point from the last demand forecast"
+    )
+    forecast_updated_at = models.DateTimeField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = StockAlertQuerySet.as_manager()
+    
     class Meta:
         unique_together = ('variant', 'location')
         ordering = ['variant', 'location']
@@ -138,3 +294,265 @@ class StockAlert(models.Model):
             return stock.available_quantity < self.threshold
         except StockRecord.DoesNotExist:
             return True  # No stock record = alert needed
+
+
+class StockAlertEvent(models.Model):
+    """Threshold crossings recorded when stock is written (newest last)"""
+    
+    EVENT_TYPE_CHOICES = [
+        ('TRIGGERED', 'Fell below threshold'),
+        ('CLEARED', 'Back above threshold'),
+    ]
+    
+    alert = models.ForeignKey(
+        StockAlert,
+        on_delete=models.CASCADE,
+        related_name='events'
+    )
+    event_type = models.CharField(max_length=20, choices=EVENT_TYPE_CHOICES)
+    available_quantity = models.IntegerField()
+    threshold = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['id']
+    
+    def __str__(self):
+        return f"{self.get_event_type_display()}: {self.alert.variant.sku} @ {self.alert.location.name}"
+
+
+class StockSnapshot(models.Model):
+    """Ledger balances at the end of a day, used as a starting point for as-of queries"""
+    
+    date = models.DateField(unique=True)
+    line_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-date']
+    
+    def __str__(self):
+        return f"Stock snapshot {self.date} ({self.line_count} lines)"
+
+
+class StockSnapshotLine(models.Model):
+    """On-hand quantity of one variant at one location in a snapshot (non-zero only)"""
+    
+    snapshot = models.ForeignKey(
+        StockSnapshot,
+        on_delete=models.CASCADE,
+        related_name='lines'
+    )
+    variant = models.ForeignKey(
+        ProductVariant,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    location = models.ForeignKey(
+        Store,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    quantity = models.IntegerField()
+    
+    class Meta:
+        unique_together = ('snapshot', 'location', 'variant')
+    
+    def __str__(self):
+        return f"{self.snapshot.date}: {self.variant.sku} @ {self.location.name} = {self.quantity}"
+
+
+class StockTransfer(models.Model):
+    """Movement of stock between two locations (e.g. warehouse to branch)"""
+    
+    STATUS_CHOICES = [
+        ('DRAFT', 'Draft'),
+        ('DISPATCHED', 'Dispatched'),
+        ('RECEIVED', 'Received'),
+        ('CANCELLED', 'Cancelled'),
+    ]
+    
+    transfer_number = models.CharField(max_length=50, unique=True)
+    from_location = models.ForeignKey(
+        Store,
+        on_delete=models.PROTECT,
+        related_name='transfers_out'
+    )
+    to_location = models.ForeignKey(
+        Store,
+        on_delete=models.PROTECT,
+        related_name='transfers_in'
+    )
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='DRAFT')
+    created_by = models.ForeignKey(
+        CustomUser,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='created_transfers'
+    )
+    dispatched_by = models.ForeignKey(
+        CustomUser,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='dispatched_transfers'
+    )
+    received_by = models.ForeignKey(
+        CustomUser,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='received_transfers'
+    )
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+    received_at = models.DateTimeField(null=True, blank=True)
+    notes = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Transfer #{self.transfer_number}: {self.from_location.name} -> {self.to_location.name}"
+    
+    def save(self, *args, **kwargs):
+        if not self.transfer_number:
+            from apps.core.sequences import next_document_number
+            self.transfer_number = next_document_number('TRF', StockTransfer, 'transfer_number')
+        super().save(*args, **kwargs)
+
+
+class StockTransferItem(models.Model):
+    """Line items in a stock transfer"""
+    
+    transfer = models.ForeignKey(
+        StockTransfer,
+        on_delete=models.CASCADE,
+        related_name='items'
+    )
+    variant = models.ForeignKey(
+        ProductVariant,
+        on_delete=models.PROTECT,
+        related_name='transfer_items'
+    )
+    quantity = models.PositiveIntegerField()
+    
+    class Meta:
+        ordering = ['transfer', 'id']
+        unique_together = ('transfer', 'variant')
+    
+    def __str__(self):
+        return f"{self.variant.sku} x {self.quantity}"
+
+
+class CostLayer(models.Model):
+    """Units received at one unit cost, consumed oldest first (FIFO valuation)"""
+    
+    variant = models.ForeignKey(
+        ProductVariant,
+        on_delete=models.CASCADE,
+        related_name='cost_layers'
+    )
+    location = models.ForeignKey(
+        Store,
+        on_delete=models.CASCADE,
+        related_name='cost_layers'
+    )
+    quantity = models.PositiveIntegerField(help_text="Units received")
+    remaining = models.PositiveIntegerField(help_text="Units not consumed yet")
+    unit_cost = models.DecimalField(max_digits=12, decimal_places=4)
+    reference_type = models.CharField(max_length=20, choices=StockTransaction.REFERENCE_TYPE_CHOICES)
+    reference_id = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(
+                fields=['variant', 'location', 'created_at'],
+                condition=Q(remaining__gt=0),
+                name='cost_layer_open_idx'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.variant.sku} @ {self.location.name}: {self.remaining}/{self.quantity} at {self.unit_cost}"
+
+
+class StockValuation(models.Model):
+    """Running value of each variant's stock at each location, under both FIFO and weighted average cost"""
+    
+    variant = models.ForeignKey(
+        ProductVariant,
+        on_delete=models.CASCADE,
+        related_name='valuations'
+    )
+    location = models.ForeignKey(
+        Store,
+        on_delete=models.CASCADE,
+        related_name='valuations'
+    )
+    quantity = models.IntegerField(default=0, help_text="Units with a cost (remaining in cost layers)")
+    fifo_value = models.DecimalField(
+        max_digits=16, decimal_places=4, default=0,
+        help_text="Value of the remaining cost layers"
+    )
+    average_value = models.DecimalField(
+        max_digits=16, decimal_places=4, default=0,
+        help_text="quantity x running weighted average cost"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ('variant', 'location')
+    
+    def __str__(self):
+        return f"{self.variant.sku} @ {self.location.name}: {self.quantity} units"
+    
+    @property
+    def average_cost(self):
+        return self.average_value / self.quantity if self.quantity > 0 else 0
+
+
+class ValuationEntry(models.Model):
+    """Units and value moved in or out of a StockValuation by one document"""
+    
+    ENTRY_TYPE_CHOICES = [
+        ('OPENING', 'Opening Balance'),
+        ('RECEIPT', 'Receipt'),
+        ('SALE', 'Sale'),
+        ('RETURN', 'Return'),
+        ('TRANSFER_OUT', 'Transfer Out'),
+        ('TRANSFER_IN', 'Transfer In'),
+        ('ADJUSTMENT', 'Adjustment'),
+    ]
+    
+    variant = models.ForeignKey(
+        ProductVariant,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    location = models.ForeignKey(
+        Store,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    entry_type = models.CharField(max_length=20, choices=ENTRY_TYPE_CHOICES)
+    quantity = models.IntegerField(help_text="Positive for units in, negative for units out")
+    fifo_value = models.DecimalField(max_digits=16, decimal_places=4)
+    average_value = models.DecimalField(max_digits=16, decimal_places=4)
+    reference_type = models.CharField(max_length=20, choices=StockTransaction.REFERENCE_TYPE_CHOICES)
+    reference_id = models.IntegerField()
+    timestamp = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-timestamp', '-id']
+        verbose_name_plural = 'Valuation entries'
+        indexes = [
+            models.Index(fields=['timestamp'], name='valuation_entry_time_idx'),
+            models.Index(fields=['reference_type', 'reference_id'], name='valuation_entry_ref_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_entry_type_display()}: {self.variant.sku} @ {self.location.name} ({self.quantity})"
@@ -1,10 +1,25 @@
 from rest_framework import serializers
 from django.db import models as django_models
-from .models import StockRecord, StockTransaction, StockAlert
-from apps.catalog.serializers import ProductVariantSerializer
+from django.db import transaction
+from .models import (
+    StockRecord, StockTransaction, StockAlert, StockAlertEvent, StockTransfer, StockTransferItem
+)
+from apps.catalog.models import ProductVariant
+from apps.catalog.serializers import (
+    ProductVariantSerializer, PrefetchedVariantField, prefetch_availability, prefetch_variants
+)
 from apps.users.serializers import StoreSerializer
 
 
+class StockRecordListSerializer(serializers.ListSerializer):
+    """Fetches the availability of every nested variant on the page in one cache batch"""
+    
+    def to_representation(self, data):
+        records = list(data.all() if isinstance(data, django_models.manager.BaseManager) else data)
+        prefetch_availability(self, [record.variant_id for record in records])
+        return super().to_representation(records)
+
+
 class StockRecordSerializer(serializers.ModelSerializer):
     """Serializer for stock records"""
     
@@ -21,12 +36,22 @@ class StockRecordSerializer(serializers.ModelSerializer):
             'quantity', 'reserved_quantity', 'available_quantity', 'details_url', 'last_updated'
         ]
         read_only_fields = ['last_updated', 'reserved_quantity']
+        list_serializer_class = StockRecordListSerializer
         
     def get_details_url(self, obj):
         request = self.context.get('request')
         if request:
             return request.build_absolute_uri(f'/api/inventory/stock/{obj.id}/')
         return None
+    
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Units escrowed to shards but not reserved yet are still available
+        free = getattr(instance, 'shard_free', 0)
+        if free:
+            data['reserved_quantity'] -= free
+            data['available_quantity'] += free
+        return data
 
 
 class StockTransactionSerializer(serializers.ModelSerializer):
@@ -118,12 +143,19 @@ class StockAlertSerializer(serializers.ModelSerializer):
         model = StockAlert
         fields = [
             'id', 'variant', 'variant_details', 'location', 'location_details',
-            'threshold', 'is_active', 'current_stock', 'is_below_threshold', 'created_at'
+            'threshold', 'is_active', 'current_stock', 'is_below_threshold',
+            'avg_daily_demand', 'safety_stock', 'suggested_threshold', 'forecast_updated_at',
+            'created_at'
+        ]
+        read_only_fields = [
+            'avg_daily_demand', 'safety_stock', 'suggested_threshold', 'forecast_updated_at', 'created_at'
         ]
-        read_only_fields = ['created_at']
     
     def get_current_stock(self, obj):
         """Get current available stock for this variant/location"""
+        # Annotated by StockAlert.objects.with_stock_status()
+        if hasattr(obj, 'current_stock'):
+            return obj.current_stock
         try:
             stock = StockRecord.objects.get(variant=obj.variant, location=obj.location)
             return stock.available_quantity
@@ -132,4 +164,88 @@ class StockAlertSerializer(serializers.ModelSerializer):
     
     def get_is_below_threshold(self, obj):
         """Check if currently below threshold"""
+        if hasattr(obj, 'is_below_threshold'):
+            return obj.is_below_threshold
         return obj.check_alert()
+
+
+class StockAlertEventSerializer(serializers.ModelSerializer):
+    """Serializer for the alert crossing feed"""
+    
+    variant = serializers.IntegerField(source='alert.variant_id', read_only=True)
+    variant_sku = serializers.CharField(source='alert.variant.sku', read_only=True)
+    location = serializers.IntegerField(source='alert.location_id', read_only=True)
+    location_name = serializers.CharField(source='alert.location.name', read_only=True)
+    event_type_display = serializers.CharField(source='get_event_type_display', read_only=True)
+    
+    class Meta:
+        model = StockAlertEvent
+        fields = [
+            'id', 'alert', 'variant', 'variant_sku', 'location', 'location_name',
+            'event_type', 'event_type_display', 'available_quantity', 'threshold', 'created_at'
+        ]
+
+
+class StockTransferItemSerializer(serializers.ModelSerializer):
+    """Serializer for transfer line items"""
+    
+    variant = PrefetchedVariantField(queryset=ProductVariant.objects.all())
+    variant_sku = serializers.CharField(source='variant.sku', read_only=True)
+    quantity = serializers.IntegerField(min_value=1)
+    
+    class Meta:
+        model = StockTransferItem
+        fields = ['id', 'variant', 'variant_sku', 'quantity']
+
+
+class StockTransferSerializer(serializers.ModelSerializer):
+    """Serializer for inter-store stock transfers"""
+    
+    items = StockTransferItemSerializer(many=True)
+    from_location_name = serializers.CharField(source='from_location.name', read_only=True)
+    to_location_name = serializers.CharField(source='to_location.name', read_only=True)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    created_by_name = serializers.CharField(source='created_by.username', read_only=True)
+    
+    class Meta:
+        model = StockTransfer
+        fields = [
+            'id', 'transfer_number', 'from_location', 'from_location_name',
+            'to_location', 'to_location_name', 'status', 'status_display', 'items',
+            'created_by', 'created_by_name', 'dispatched_by', 'dispatched_at',
+            'received_by', 'received_at', 'notes', 'created_at', 'updated_at'
+        ]
+        read_only_fields = [
+            'transfer_number', 'status', 'created_by', 'dispatched_by', 'dispatched_at',
+            'received_by', 'received_at', 'created_at', 'updated_at'
+        ]
+    
+    def to_internal_value(self, data):
+        """Load all line-item variants with one query before field validation"""
+        prefetch_variants(self, data)
+        return super().to_internal_value(data)
+    
+    def validate(self, attrs):
+        user = self.context['request'].user
+        # Store managers can only send their own stock; any store can be the destination
+        if user.role != 'ADMIN' and attrs['from_location'] != user.store:
+            raise serializers.ValidationError({'from_location': 'Transfers can only be sent from your own store'})
+        if attrs['from_location'] == attrs['to_location']:
+            raise serializers.ValidationError({'to_location': 'Must differ from from_location'})
+        if not attrs['items']:
+            raise serializers.ValidationError({'items': 'At least one item is required'})
+        variant_ids = [item['variant'].id for item in attrs['items']]
+        if len(variant_ids) != len(set(variant_ids)):
+            raise serializers.ValidationError({'items': 'Each variant may only appear once'})
+        return attrs
+    
+    @transaction.atomic
+    def create(self, validated_data):
+        items_data = validated_data.pop('items')
+        validated_data['created_by'] = self.context['request'].user
+        transfer = StockTransfer.objects.create(**validated_data)
+        StockTransferItem.objects.bulk_create([
+            StockTransferItem(transfer=transfer, **item_data)
+            for item_data in items_data
+        ])
+        return transfer
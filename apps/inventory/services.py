@@ -0,0 +1,620 @@
+"""
+Stock reservation service
+
+All changes to StockRecord quantities go through this module. Each operation
+is a single conditional UPDATE built from F-expressions, so the availability
+check and the write happen in one round trip and the row lock is only held
+from the UPDATE until the surrounding transaction commits.
+
+Multi-line documents (orders, GRNs, transfers) call lock_stock_records() or
+lock_stock_pairs() first so every row they touch is locked up front, in
+primary key order, by one query. Two
+documents sharing SKUs then always queue on the same first row instead of
+deadlocking on each other's second row.
+reserve_many() is still one conditional UPDATE for all the lines;
+move_many(), release_many() and confirm_many() check the locked rows in
+Python and write them with one bulk_update, which is only correct
+because the caller holds those locks until it commits.
+
+Updates also rewrite the stored available_quantity column from the new
+quantity and reserved values, so it can be filtered and ordered on.
+
+Every mutation path finishes with stock_changed(location, variants) so
+state derived from stock levels is updated for just the touched rows in
+the same transaction.
+
+Hot SKUs
+--------
+A record with shard_count > 0 escrows its available units into that many
+StockShard rows (rebalance_shards()). The escrow is counted in the
+record's reserved_quantity, so every other path keeps working on the
+record's own rows and can never sell escrowed units twice. Reservations
+(reserve_from_shards(), reserve_sharded()) take their units from a random
+shard that can cover them, skipping shards locked by other checkouts, and
+only fall back to the record row when none can - so N shards give N
+checkouts that don't queue on each other. Releases, sales and restocks
+still go to the record, which keeps the arithmetic exact:
+
+    true reserved  = reserved_quantity - free shard units
+    true available = available_quantity + free shard units
+
+(shard_free_stock() / StockRecord.objects.with_shard_stock()). Reads that
+report availability add the free shard units back. Removals (adjust(),
+move_many()) first take the free escrow back onto the record with
+reclaim_shards() and re-split what is left afterwards. Shards fragment as
+they drain, so rebalance_shards() - run periodically by the stock_shards
+command while sharding is on - consolidates them and re-splits the stock.
+
+Lock order: a transaction locks its StockRecords once, in primary key
+order (lock_stock_pairs()), and shard rows are only ever locked with SKIP
+LOCKED. A checkout may hold shard locks while it waits for its records,
+but nothing waits for a shard, so the two can't deadlock. The cost is that
+reclaim_shards() and rebalance_shards() leave the shards of in-flight
+checkouts alone.
+"""
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import (
+    StockRecord, StockShard, StockAlert, StockAlertEvent, VariantStockSummary, shard_free_stock
+)
+
+
+class InsufficientStock(Exception):
+    """
+    Raised when a stock movement would over-commit a StockRecord.
+    available is None when no stock record exists for the variant/location.
+    """
+
+    def __init__(self, variant, location, requested, available):
+        self.variant = variant
+        self.location = location
+        self.requested = requested
+        self.available = available
+        super().__init__(
+            f"Insufficient stock for {variant.sku}. Available: {available or 0}"
+        )
+
+
+def _pk(obj):
+    return getattr(obj, 'pk', obj)
+
+
+def lock_stock_pairs(pairs, create_missing=False):
+    """
+    Lock the StockRecords for many (variant, location) pairs - possibly
+    spanning several locations - in a single SELECT ... FOR UPDATE ordered
+    by primary key. Returns a dict keyed by (variant_id, location_id).
+    With create_missing, records that do not exist yet are inserted
+    (ON CONFLICT DO NOTHING) before locking.
+    """
+    keys = sorted({(_pk(variant), _pk(location)) for variant, location in pairs})
+    if not keys:
+        return {}
+    if create_missing:
+        StockRecord.objects.bulk_create(
+            [
+                StockRecord(variant_id=variant_id, location_id=location_id)
+                for variant_id, location_id in keys
+            ],
+            ignore_conflicts=True
+        )
+    by_location = {}
+    for variant_id, location_id in keys:
+        by_location.setdefault(location_id, []).append(variant_id)
+    condition = Q()
+    for location_id, variant_ids in by_location.items():
+        condition |= Q(location_id=location_id, variant_id__in=variant_ids)
+    records = StockRecord.objects.select_for_update().filter(condition).order_by('pk')
+    return {(record.variant_id, record.location_id): record for record in records}
+
+
+def lock_stock_records(location, variants, create_missing=False):
+    """
+    Lock the StockRecords for many variants at one location (see
+    lock_stock_pairs). Returns a dict keyed by variant id.
+    """
+    records = lock_stock_pairs(
+        [(variant, location) for variant in variants],
+        create_missing=create_missing
+    )
+    return {variant_id: record for (variant_id, _), record in records.items()}
+
+
+def reserve_many(records, quantities):
+    """
+    Reserve stock on records from lock_stock_records(); quantities maps
+    variant id -> units. Like reserve(), this is one conditional UPDATE:
+    each row is only written if its own available_quantity covers its
+    line, so the check holds whether or not the caller locked first (the
+    lock only fixes the order rows are taken in). If any line is short the
+    UPDATE is rolled back to a savepoint and InsufficientStock raised, so
+    nothing is reserved. The records are updated in memory to match.
+    """
+    if not quantities:
+        return
+    from apps.catalog.models import ProductVariant
+    
+    for variant_id, qty in quantities.items():
+        if variant_id not in records:
+            raise InsufficientStock(ProductVariant.objects.get(pk=variant_id), None, qty, None)
+    lines = {records[variant_id].pk: qty for variant_id, qty in quantities.items()}
+    qty = Case(
+        *[When(pk=pk, then=Value(units)) for pk, units in lines.items()],
+        output_field=IntegerField()
+    )
+    new_reserved = F('reserved_quantity') + qty
+    now = timezone.now()
+    savepoint = transaction.savepoint()
+    updated = StockRecord.objects.filter(pk__in=lines, available_quantity__gte=qty).update(
+        reserved_quantity=new_reserved,
+        available_quantity=Greatest(F('quantity') - new_reserved, 0),
+        last_updated=now
+    )
+    if updated < len(lines):
+        transaction.savepoint_rollback(savepoint)
+        available = dict(StockRecord.objects.filter(pk__in=lines).values_list('pk', 'available_quantity'))
+        for variant_id, units in quantities.items():
+            record = records[variant_id]
+            if available.get(record.pk, 0) < units:
+                raise InsufficientStock(
+                    ProductVariant.objects.get(pk=variant_id), record.location, units, available.get(record.pk)
+                )
+    transaction.savepoint_commit(savepoint)
+    for variant_id, units in quantities.items():
+        record = records[variant_id]
+        record.reserved_quantity += units
+        record.update_available_quantity()
+        record.last_updated = now
+
+
+def move_many(records, deltas):
+    """
+    Apply on-hand quantity changes to records already locked by
+    lock_stock_pairs(). deltas maps (variant_id, location_id) -> units
+    (negative to remove). Removals may not take reserved units, but do
+    take free shard units (see reclaim_shards()). All rows are written
+    with one bulk UPDATE; raises InsufficientStock before writing
+    anything if any removal cannot be covered.
+    """
+    now = timezone.now()
+    # Removals may take units escrowed to shards; re-split them afterwards
+    resharded = reclaim_shards([records[key] for key, delta in deltas.items() if delta < 0 and key in records])
+    for key, delta in deltas.items():
+        record = records.get(key)
+        available = record.available_quantity if record else None
+        if delta < 0 and (available is None or available < -delta):
+            from apps.catalog.models import ProductVariant
+            from apps.users.models import Store
+            raise InsufficientStock(
+                ProductVariant.objects.get(pk=key[0]),
+                Store.objects.get(pk=key[1]),
+                -delta,
+                available
+            )
+    for key, delta in deltas.items():
+        record = records[key]
+        record.quantity += delta
+        record.update_available_quantity()
+        record.last_updated = now
+    StockRecord.objects.bulk_update(
+        [records[key] for key in deltas],
+        ['quantity', 'available_quantity', 'last_updated']
+    )
+    for record in resharded:
+        rebalanced = rebalance_shards(record)
+        record.reserved_quantity = rebalanced.reserved_quantity
+        record.available_quantity = rebalanced.available_quantity
+
+
+def release_many(records, quantities):
+    """
+    Release reservations on records already locked by lock_stock_pairs().
+    quantities maps (variant_id, location_id) -> units; reserved floors at 0.
+    All rows are written with one bulk UPDATE.
+    """
+    now = timezone.now()
+    released = []
+    for key, qty in quantities.items():
+        record = records.get(key)
+        if record is None:
+            continue
+        record.reserved_quantity = max(0, record.reserved_quantity - qty)
+        record.update_available_quantity()
+        record.last_updated = now
+        released.append(record)
+    StockRecord.objects.bulk_update(
+        released,
+        ['reserved_quantity', 'available_quantity', 'last_updated']
+    )
+
+
+def confirm_many(records, quantities):
+    """
+    Convert reservations into sales on records already locked by
+    lock_stock_pairs(). quantities maps (variant_id, location_id) -> units;
+    quantity and reserved both drop by it (reserved floors at 0). All rows
+    are written with one bulk UPDATE; raises InsufficientStock before
+    writing anything if a row has fewer units on hand.
+    """
+    now = timezone.now()
+    for key, qty in quantities.items():
+        record = records.get(key)
+        if record is None or record.quantity < qty:
+            from apps.catalog.models import ProductVariant
+            from apps.users.models import Store
+            raise InsufficientStock(
+                ProductVariant.objects.get(pk=key[0]),
+                Store.objects.get(pk=key[1]),
+                qty,
+                record.quantity if record else None
+            )
+    for key, qty in quantities.items():
+        record = records[key]
+        record.quantity -= qty
+        record.reserved_quantity = max(0, record.reserved_quantity - qty)
+        record.update_available_quantity()
+        record.last_updated = now
+    StockRecord.objects.bulk_update(
+        [records[key] for key in quantities],
+        ['quantity', 'reserved_quantity', 'available_quantity', 'last_updated']
+    )
+
+
+def sharded_records(location, variants):
+    """
+    StockRecords at location with sharding enabled, keyed by variant id.
+    They are not locked - reserve on them with reserve_from_shards().
+    """
+    return {
+        record.variant_id: record
+        for record in StockRecord.objects.filter(
+            location=location,
+            variant_id__in={_pk(v) for v in variants},
+            shard_count__gt=0
+        )
+    }
+
+
+def _reserve_from_shard(record_id, qty):
+    """
+    Reserve qty units on a random shard of the record that can cover them.
+    Shards locked by other transactions are skipped rather than waited on.
+    Returns False when no shard can take the line.
+    """
+    shard = StockShard.objects.select_for_update(skip_locked=True).filter(
+        record_id=record_id,
+        capacity__gte=F('reserved') + qty
+    ).order_by('?').first()
+    if shard is None:
+        return False
+    StockShard.objects.filter(pk=shard.pk).update(reserved=F('reserved') + qty)
+    return True
+
+
+def _reserve_across_shards(record_id, qty):
+    """
+    Reserve up to qty units spread over every shard of the record that has
+    free units and isn't locked by another transaction - only if together
+    they cover qty. Returns the units reserved (qty or 0).
+    """
+    shards = list(
+        StockShard.objects.select_for_update(skip_locked=True).filter(
+            record_id=record_id,
+            capacity__gt=F('reserved')
+        ).order_by('pk')
+    )
+    if sum(shard.capacity - shard.reserved for shard in shards) < qty:
+        return 0
+    remaining = qty
+    taken = []
+    for shard in shards:
+        take = min(remaining, shard.capacity - shard.reserved)
+        shard.reserved += take
+        taken.append(shard)
+        remaining -= take
+        if not remaining:
+            break
+    StockShard.objects.bulk_update(taken, ['reserved'])
+    return qty
+
+
+def reserve_from_shards(records, quantities):
+    """
+    First step of a checkout with hot SKUs: reserve each line of quantities
+    (variant id -> units) on a random shard of its record from
+    sharded_records() that can cover it. Never waits on a lock, so it runs
+    before the checkout locks any StockRecord. Returns the variant ids
+    served; the caller locks the records of the rest together with its
+    other rows and reserves them with draw_from_shards() and reserve_many().
+    """
+    return {
+        variant_id
+        for variant_id, qty in quantities.items()
+        if _reserve_from_shard(records[variant_id].pk, qty)
+    }
+
+
+def draw_from_shards(records, quantities):
+    """
+    For lines no single shard could cover: where a record locked by
+    lock_stock_records() has fewer available units than its line, reserve
+    the shortfall spread over the record's free shards. Returns the units
+    each line still needs from its record (pass them to reserve_many()).
+    """
+    remaining = dict(quantities)
+    for variant_id, qty in quantities.items():
+        record = records.get(variant_id)
+        short = qty - record.available_quantity if record else 0
+        if short > 0:
+            remaining[variant_id] -= _reserve_across_shards(record.pk, short)
+    return remaining
+
+
+def reclaim_shards(records):
+    """
+    Take the free units escrowed to the shards of records (locked by the
+    caller) back onto the records, shrinking each shard to what it has
+    reserved. Removals run this first, so they can use those units and
+    never leave shards escrowing stock that is gone; rebalance_shards()
+    splits the stock again afterwards. Shards locked by in-flight
+    checkouts are skipped and keep their escrow. Returns the sharded
+    records.
+    """
+    records = [record for record in records if record.shard_count]
+    if not records:
+        return []
+    shards = list(
+        StockShard.objects.select_for_update(skip_locked=True).filter(record__in=records).order_by('pk')
+    )
+    free = {}
+    for shard in shards:
+        free[shard.record_id] = free.get(shard.record_id, 0) + shard.capacity - shard.reserved
+        shard.capacity = shard.reserved
+    StockShard.objects.bulk_update(shards, ['capacity'])
+    for record in records:
+        record.reserved_quantity = max(0, record.reserved_quantity - free.get(record.pk, 0))
+        record.update_available_quantity()
+    StockRecord.objects.bulk_update(records, ['reserved_quantity', 'available_quantity'])
+    return records
+
+
+def rebalance_shards(record):
+    """
+    Consolidate a record's shards: fold the units reserved through them
+    into reserved_quantity and take back the rest of their escrow, then
+    split the record's available units evenly over shard_count fresh
+    shards (or drop them when shard_count is 0). The remainder of the
+    split stays on the record. Shards locked by in-flight checkouts are
+    left as they are until the next rebalance. Caller runs stock_changed().
+    """
+    record = StockRecord.objects.select_for_update().get(pk=_pk(record))
+    shards = list(
+        StockShard.objects.select_for_update(skip_locked=True).filter(record=record).order_by('shard')
+    )
+    free = sum(shard.capacity - shard.reserved for shard in shards)
+    record.reserved_quantity = max(0, record.reserved_quantity - free)
+    record.update_available_quantity()
+    
+    count = record.shard_count
+    # Locked shards aren't read above, but their indexes are taken
+    existing = set(StockShard.objects.filter(record=record).values_list('shard', flat=True))
+    StockShard.objects.filter(pk__in=[shard.pk for shard in shards if shard.shard >= count]).delete()
+    kept = [shard.pk for shard in shards if shard.shard < count]
+    added = [index for index in range(count) if index not in existing]
+    targets = len(kept) + len(added)
+    share = record.available_quantity // targets if targets else 0
+    StockShard.objects.filter(pk__in=kept).update(capacity=share, reserved=0)
+    StockShard.objects.bulk_create([StockShard(record=record, shard=index, capacity=share) for index in added])
+    record.reserved_quantity += share * targets
+    record.save(update_fields=['reserved_quantity', 'last_updated'])
+    return record
+
+
+def _stock(variant, location):
+    return StockRecord.objects.filter(variant=variant, location=location)
+
+
+def _move(queryset, quantity=0, reserved=0):
+    """
+    UPDATE the rows in queryset by the given deltas (reserved floors at 0)
+    and recompute available_quantity from the new values in the same
+    statement. Returns the number of rows updated.
+    """
+    new_quantity = F('quantity') + quantity
+    new_reserved = Greatest(F('reserved_quantity') + reserved, 0)
+    return queryset.update(
+        quantity=new_quantity,
+        reserved_quantity=new_reserved,
+        available_quantity=Greatest(new_quantity - new_reserved, 0),
+        last_updated=timezone.now()
+    )
+
+
+def _current_available(variant, location):
+    """Available quantity for error reporting (None when there is no stock record)"""
+    stock = _stock(variant, location).first()
+    return stock.available_quantity if stock else None
+
+
+def _current_on_hand(variant, location):
+    """On-hand quantity for error reporting (None when there is no stock record)"""
+    stock = _stock(variant, location).first()
+    return stock.quantity if stock else None
+
+
+def reserve(variant, location, qty):
+    """
+    Reserve qty units for a pending order.
+    Raises InsufficientStock if fewer than qty units are available.
+    """
+    updated = _move(
+        _stock(variant, location).filter(available_quantity__gte=qty),
+        reserved=qty
+    )
+    if not updated:
+        raise InsufficientStock(variant, location, qty, _current_available(variant, location))
+
+
+def reserve_sharded(variant, location, qty):
+    """reserve() that tries the record's shards first when it is sharded"""
+    record = _stock(variant, location).filter(shard_count__gt=0).only('pk').first()
+    if record is None or not _reserve_from_shard(record.pk, qty):
+        reserve(variant, location, qty)
+
+
+def release(variant, location, qty):
+    """Release a reservation (cancelled or deleted pending order)"""
+    _move(_stock(variant, location), reserved=-qty)
+
+
+def confirm_sale(variant, location, qty):
+    """
+    Convert a reservation into a sale - decrement both quantity and reserved.
+    Raises InsufficientStock if less than qty units are on hand.
+    """
+    updated = _move(
+        _stock(variant, location).filter(quantity__gte=qty),
+        quantity=-qty,
+        reserved=-qty
+    )
+    if not updated:
+        raise InsufficientStock(variant, location, qty, _current_on_hand(variant, location))
+
+
+def restock(variant, location, qty):
+    """Put sold units back on hand (cancelled confirmed order)"""
+    _move(_stock(variant, location), quantity=qty)
+
+
+def receive(variant, location, qty):
+    """Increment on-hand quantity, creating the stock record if needed (GRN)"""
+    StockRecord.objects.get_or_create(
+        variant=variant,
+        location=location,
+        defaults={'quantity': 0, 'reserved_quantity': 0}
+    )
+    restock(variant, location, qty)
+
+
+@transaction.atomic
+def adjust(variant, location, adjustment):
+    """
+    Apply a manual adjustment (positive or negative) to on-hand quantity.
+    Raises InsufficientStock if a negative adjustment would go below zero.
+    """
+    if adjustment >= 0:
+        receive(variant, location, adjustment)
+        return
+
+    # Shards must not keep escrowing units the adjustment writes off
+    resharded = reclaim_shards(_stock(variant, location).filter(shard_count__gt=0).select_for_update())
+    updated = _move(
+        _stock(variant, location).filter(quantity__gte=-adjustment),
+        quantity=adjustment
+    )
+    if not updated:
+        raise InsufficientStock(variant, location, -adjustment, _current_on_hand(variant, location))
+    for record in resharded:
+        rebalance_shards(record)
+
+
+def stock_changed(location, variants):
+    """
+    Hook run once per mutation (order, GRN, adjustment, ...) with the
+    variants whose stock changed at location
+    """
+    from .cache import availability_cache
+    
+    refresh_variant_summaries(variants)
+    record_alert_crossings(location, variants)
+    availability_cache.invalidate(_pk(location), {_pk(v) for v in variants})
+
+
+def shards_changed(location, variants):
+    """
+    stock_changed() for reservations served by shards: only the
+    availability cache is invalidated. Summaries and alerts of hot SKUs
+    catch up when the shards are rebalanced, rather than every checkout
+    queueing on the same summary row.
+    """
+    from .cache import availability_cache
+    
+    if variants:
+        availability_cache.invalidate(_pk(location), {_pk(v) for v in variants})
+
+
+def refresh_variant_summaries(variants):
+    """
+    Recompute VariantStockSummary for the given variants from their
+    StockRecords. The summary rows are locked (primary key order) before
+    aggregating so concurrent mutations at other locations can't write
+    back a stale total.
+    """
+    variant_ids = sorted({_pk(v) for v in variants})
+    if not variant_ids:
+        return
+    
+    VariantStockSummary.objects.bulk_create(
+        [VariantStockSummary(variant_id=variant_id) for variant_id in variant_ids],
+        ignore_conflicts=True
+    )
+    summaries = list(
+        VariantStockSummary.objects.select_for_update().filter(
+            variant_id__in=variant_ids
+        ).order_by('pk')
+    )
+    totals = {
+        row['variant']: row
+        for row in StockRecord.objects.filter(variant_id__in=variant_ids).annotate(
+            free=shard_free_stock()
+        ).values('variant').annotate(
+            total_quantity=Sum('quantity'),
+            total_reserved=Sum(F('reserved_quantity') - F('free')),
+            total_available=Sum(F('available_quantity') + F('free')),
+            locations_stocked=Count('pk', filter=Q(quantity__gt=0))
+        ).order_by()
+    }
+    for summary in summaries:
+        row = totals.get(summary.variant_id, {})
+        summary.total_quantity = row.get('total_quantity') or 0
+        summary.total_reserved = row.get('total_reserved') or 0
+        summary.total_available = row.get('total_available') or 0
+        summary.locations_stocked = row.get('locations_stocked') or 0
+        summary.updated_at = timezone.now()
+    VariantStockSummary.objects.bulk_update(
+        summaries,
+        ['total_quantity', 'total_reserved', 'total_available', 'locations_stocked', 'updated_at']
+    )
+
+
+def record_alert_crossings(location, variants):
+    """
+    Re-evaluate the active alerts on the given rows and write a
+    StockAlertEvent for each one that crossed its threshold since it was
+    last evaluated. Cost is proportional to the rows touched, not the
+    number of alerts.
+    """
+    alerts = StockAlert.objects.with_stock_status().filter(
+        location=location,
+        variant_id__in={_pk(v) for v in variants},
+        is_active=True
+    ).order_by()
+    crossed = [alert for alert in alerts if alert.is_below_threshold != alert.is_triggered]
+    if not crossed:
+        return
+    
+    StockAlertEvent.objects.bulk_create([
+        StockAlertEvent(
+            alert=alert,
+            event_type='TRIGGERED' if alert.is_below_threshold else 'CLEARED',
+            available_quantity=alert.current_stock,
+            threshold=alert.threshold
+        )
+        for alert in crossed
+    ])
+    for alert in crossed:
+        alert.is_triggered = alert.is_below_threshold
+    StockAlert.objects.bulk_update(crossed, ['is_triggered'])
@@ -0,0 +1,134 @@
+"""
+Point-in-time stock from ledger snapshots
+
+A StockSnapshot stores the on-hand balance of every (variant, location) with
+a non-zero ledger total at the end of a day (local time). Each snapshot is
+built from the previous one plus that day's StockTransaction rows, so a
+nightly run only reads one day of ledger.
+
+stock_as_of() starts from the snapshot nearest to the requested day and
+replays only the ledger rows between the two, forwards or backwards,
+instead of summing the whole history.
+
+Reservation rows (RESERVE) do not change on-hand quantity and are ignored.
+Rebuilding a snapshot does not rebuild the later ones chained from it; pass
+every affected day to snapshot_stock --rebuild after back-dated corrections.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import StockSnapshot, StockSnapshotLine, StockTransaction
+
+
+def day_end(date):
+    """Aware datetime at which a local calendar day ends (next local midnight)"""
+    return timezone.make_aware(datetime.combine(date + timedelta(days=1), time.min))
+
+
+def _ledger_deltas(start, end, location=None, variant=None):
+    """
+    Net on-hand movement per (variant_id, location_id) for ledger rows in
+    [start, end). start=None means from the beginning of the ledger.
+    """
+    rows = StockTransaction.objects.affecting_on_hand().filter(timestamp__lt=end)
+    if start is not None:
+        rows = rows.filter(timestamp__gte=start)
+    if location is not None:
+        rows = rows.filter(location=location)
+    if variant is not None:
+        rows = rows.filter(variant=variant)
+    return {
+        (row['variant'], row['location']): row['delta']
+        for row in rows.values('variant', 'location').annotate(delta=Sum('quantity')).order_by()
+    }
+
+
+def _snapshot_balances(snapshot, location=None, variant=None):
+    lines = snapshot.lines.all()
+    if location is not None:
+        lines = lines.filter(location=location)
+    if variant is not None:
+        lines = lines.filter(variant=variant)
+    return {
+        (variant_id, location_id): quantity
+        for variant_id, location_id, quantity in lines.values_list('variant_id', 'location_id', 'quantity')
+    }
+
+
+def _apply(balances, deltas, sign=1):
+    merged = defaultdict(int, balances)
+    for key, delta in deltas.items():
+        merged[key] += sign * delta
+    return {key: quantity for key, quantity in merged.items() if quantity}
+
+
+@transaction.atomic
+def build_snapshot(date, rebuild=False):
+    """
+    Write the snapshot for the end of date from the latest earlier snapshot
+    plus the ledger rows since it. Returns the existing snapshot unchanged
+    unless rebuild is set.
+    """
+    existing = StockSnapshot.objects.filter(date=date).first()
+    if existing and not rebuild:
+        return existing
+    if existing:
+        existing.delete()
+
+    previous = StockSnapshot.objects.filter(date__lt=date).order_by('-date').first()
+    if previous:
+        balances = _snapshot_balances(previous)
+        start = day_end(previous.date)
+    else:
+        balances, start = {}, None
+    balances = _apply(balances, _ledger_deltas(start, day_end(date)))
+
+    snapshot = StockSnapshot.objects.create(date=date, line_count=len(balances))
+    StockSnapshotLine.objects.bulk_create(
+        [
+            StockSnapshotLine(
+                snapshot=snapshot,
+                variant_id=variant_id,
+                location_id=location_id,
+                quantity=quantity
+            )
+            for (variant_id, location_id), quantity in balances.items()
+        ],
+        batch_size=5000
+    )
+    return snapshot
+
+
+def _nearest_snapshot(date):
+    """Closest snapshot on either side of date (the earlier one wins ties)"""
+    before = StockSnapshot.objects.filter(date__lte=date).order_by('-date').first()
+    after = StockSnapshot.objects.filter(date__gt=date).order_by('date').first()
+    if before and (not after or (date - before.date) <= (after.date - date)):
+        return before
+    return after
+
+
+def stock_as_of(date, location=None, variant=None):
+    """
+    On-hand quantity per (variant_id, location_id) at the end of date,
+    optionally narrowed to one location and/or variant.
+    Returns (snapshot, balances); snapshot is None when no snapshot exists
+    and the ledger was summed from the start.
+    """
+    end = day_end(date)
+    snapshot = _nearest_snapshot(date)
+    if snapshot is None:
+        return None, _apply({}, _ledger_deltas(None, end, location, variant))
+
+    balances = _snapshot_balances(snapshot, location, variant)
+    snapshot_end = day_end(snapshot.date)
+    if snapshot.date <= date:
+        deltas = _ledger_deltas(snapshot_end, end, location, variant)
+        return snapshot, _apply(balances, deltas)
+    # Later snapshot - undo the movements between the requested day and it
+    deltas = _ledger_deltas(end, snapshot_end, location, variant)
+    return snapshot, _apply(balances, deltas, sign=-1)
@@ -1,3 +1,1057 @@
+import csv
+import json
+import os
+import tempfile
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+import numpy as np
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.catalog.models import Category, Product, ProductVariant
+from apps.users.models import Store, CustomUser
+from . import services, valuation
+from .cache import AvailabilityCache, availability_cache
+from .forecasting import compute_forecasts, reorder_points
+from .management.commands.reconcile_stock import reconcile_location
+from .models import (
+    StockRecord, StockShard, StockAlert, StockAlertEvent, StockTransaction, StockValuation, ValuationEntry,
+    VariantStockSummary
+)
+from .snapshots import build_snapshot, day_end, stock_as_of
+
+
+class InventoryTestCase(TestCase):
+    """Two stores, a manager at the first and 10 variants with 100 units each there"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.store = Store.objects.create(name='Main Store', code='MS-001', address='Mumbai')
+        cls.other_store = Store.objects.create(name='Second Store', code='SS-001', address='Pune')
+        cls.admin = CustomUser.objects.create(username='admin', role='ADMIN')
+        cls.manager = CustomUser.objects.create(username='manager', role='STORE_MANAGER', store=cls.store)
+        category = Category.objects.create(name='Fabric')
+        product = Product.objects.create(name='Cotton Roll', category=category, base_price=100)
+        cls.variants = []
+        for i in range(10):
+            variant = ProductVariant.objects.create(
+                product=product,
+                sku=f'CR-{i:03d}',
+                retail_price=150,
+                wholesale_price=100,
+                min_wholesale_qty=1
+            )
+            StockRecord.objects.create(variant=variant, location=cls.store, quantity=100)
+            cls.variants.append(variant)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+    def _stock(self, variant, location=None):
+        return StockRecord.objects.get(variant=variant, location=location or self.store)
+
+
+class StockAlertStatusTests(InventoryTestCase):
+    """Alert status comes from one annotated query, not a query per alert"""
+
+    def test_status_annotations(self):
+        StockRecord.objects.filter(variant=self.variants[1], location=self.store).update(
+            quantity=100, reserved_quantity=95, available_quantity=5
+        )
+        above = StockAlert.objects.create(variant=self.variants[0], location=self.store, threshold=10)
+        below = StockAlert.objects.create(variant=self.variants[1], location=self.store, threshold=10)
+        missing = StockAlert.objects.create(variant=self.variants[2], location=self.other_store, threshold=10)
+
+        alerts = {alert.pk: alert for alert in StockAlert.objects.with_stock_status()}
+        self.assertEqual(alerts[above.pk].current_stock, 100)
+        self.assertFalse(alerts[above.pk].is_below_threshold)
+        self.assertEqual(alerts[below.pk].current_stock, 5)
+        self.assertTrue(alerts[below.pk].is_below_threshold)
+        # No stock record at the location counts as out of stock
+        self.assertEqual(alerts[missing.pk].current_stock, 0)
+        self.assertTrue(alerts[missing.pk].is_below_threshold)
+
+    def test_triggered_skips_inactive_alerts(self):
+        active = StockAlert.objects.create(variant=self.variants[0], location=self.store, threshold=200)
+        StockAlert.objects.create(variant=self.variants[1], location=self.store, threshold=200, is_active=False)
+        StockAlert.objects.create(variant=self.variants[2], location=self.store, threshold=10)
+
+        self.assertEqual(list(StockAlert.objects.triggered().values_list('pk', flat=True)), [active.pk])
+
+    def test_triggered_endpoint_query_count_independent_of_alert_count(self):
+        def triggered_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/inventory/alerts/triggered/')
+            self.assertEqual(response.status_code, 200)
+            return len(response.data), len(queries)
+
+        StockAlert.objects.create(variant=self.variants[0], location=self.store, threshold=200)
+        one, small = triggered_queries()
+        for variant in self.variants[1:]:
+            StockAlert.objects.create(variant=variant, location=self.store, threshold=200)
+        many, large = triggered_queries()
+        self.assertEqual((one, many), (1, 10))
+        self.assertEqual(small, large)
+
+
+class StockAlertEventTests(InventoryTestCase):
+    """Threshold crossings are recorded when stock is written and served as a feed"""
+
+    def _events(self, **params):
+        response = self.client.get('/api/inventory/alert-events/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_crossings_recorded_once_per_flip(self):
+        variant = self.variants[0]
+        alert = StockAlert.objects.create(variant=variant, location=self.store, threshold=50)
+
+        services.adjust(variant, self.store, -60)
+        services.stock_changed(self.store, [variant])
+        services.adjust(variant, self.store, -10)
+        services.stock_changed(self.store, [variant])
+        services.adjust(variant, self.store, 40)
+        services.stock_changed(self.store, [variant])
+
+        events = list(StockAlertEvent.objects.filter(alert=alert).values_list(
+            'event_type', 'available_quantity', 'threshold'
+        ))
+        self.assertEqual(events, [('TRIGGERED', 40, 50), ('CLEARED', 70, 50)])
+        alert.refresh_from_db()
+        self.assertFalse(alert.is_triggered)
+
+    def test_unrelated_writes_record_nothing(self):
+        StockAlert.objects.create(variant=self.variants[0], location=self.store, threshold=50)
+        services.adjust(self.variants[1], self.store, -90)
+        services.stock_changed(self.store, [self.variants[1]])
+        self.assertFalse(StockAlertEvent.objects.exists())
+
+    def test_feed_pages_forward_from_cursor(self):
+        alerts = [
+            StockAlert.objects.create(variant=variant, location=self.store, threshold=10)
+            for variant in self.variants[:3]
+        ]
+        events = [
+            StockAlertEvent.objects.create(alert=alert, event_type='TRIGGERED', available_quantity=0, threshold=10)
+            for alert in alerts
+        ]
+
+        page = self._events(limit=2)
+        self.assertEqual([row['id'] for row in page['results']], [events[0].pk, events[1].pk])
+        self.assertTrue(page['has_more'])
+        page = self._events(since=page['cursor'], limit=2)
+        self.assertEqual([row['id'] for row in page['results']], [events[2].pk])
+        self.assertFalse(page['has_more'])
+        self.assertEqual(self._events(since=page['cursor'])['results'], [])
+
+    def test_feed_returns_rows_committed_out_of_order(self):
+        alert = StockAlert.objects.create(variant=self.variants[0], location=self.store, threshold=10)
+        first, late, last = [
+            StockAlertEvent.objects.create(alert=alert, event_type='TRIGGERED', available_quantity=0, threshold=10)
+            for _ in range(3)
+        ]
+        # Stand-in for a transaction that took its id before the last row
+        # but hadn't committed when the feed was polled
+        late_id = late.pk
+        late.delete()
+
+        page = self._events()
+        self.assertEqual([row['id'] for row in page['results']], [first.pk, last.pk])
+        StockAlertEvent.objects.create(
+            pk=late_id, alert=alert, event_type='CLEARED', available_quantity=20, threshold=10
+        )
+        page = self._events(since=page['cursor'])
+        self.assertEqual([row['id'] for row in page['results']], [late_id])
+        # Served once only
+        self.assertEqual(self._events(since=page['cursor'])['results'], [])
+
+
+class StockServiceTests(InventoryTestCase):
+    """Batch movements write every line or none of them"""
+
+    def _reserved(self, variants):
+        return [self._stock(variant).reserved_quantity for variant in variants]
+
+    def test_reserve_many_reserves_every_line(self):
+        records = services.lock_stock_records(self.store, self.variants[:3])
+        with self.assertNumQueries(3):
+            services.reserve_many(records, {self.variants[0].id: 10, self.variants[1].id: 20, self.variants[2].id: 30})
+        self.assertEqual(self._reserved(self.variants[:3]), [10, 20, 30])
+        self.assertEqual(records[self.variants[2].id].available_quantity, 70)
+
+    def test_short_line_reserves_nothing(self):
+        records = services.lock_stock_records(self.store, self.variants[:2])
+        with self.assertRaises(services.InsufficientStock) as raised:
+            services.reserve_many(records, {self.variants[0].id: 10, self.variants[1].id: 101})
+        self.assertEqual(
+            (raised.exception.variant, raised.exception.requested, raised.exception.available),
+            (self.variants[1], 101, 100)
+        )
+        self.assertEqual(self._reserved(self.variants[:2]), [0, 0])
+        self.assertEqual(records[self.variants[0].id].reserved_quantity, 0)
+
+    def test_short_line_only_rolls_back_to_its_savepoint(self):
+        with transaction.atomic():
+            services.reserve(self.variants[2], self.store, 5)
+            records = services.lock_stock_records(self.store, self.variants[:2])
+            with self.assertRaises(services.InsufficientStock):
+                services.reserve_many(records, {self.variants[0].id: 100, self.variants[1].id: 101})
+            # The caller's transaction is still usable and keeps its earlier writes
+            services.reserve_many(records, {self.variants[0].id: 100})
+        self.assertEqual(self._reserved(self.variants[:3]), [100, 0, 5])
+
+    def test_line_without_a_record_is_insufficient(self):
+        records = services.lock_stock_records(self.other_store, self.variants[:1])
+        with self.assertRaises(services.InsufficientStock) as raised:
+            services.reserve_many(records, {self.variants[0].id: 1})
+        self.assertIsNone(raised.exception.available)
+
+    def test_release_many_floors_at_zero(self):
+        services.reserve(self.variants[0], self.store, 10)
+        services.reserve(self.variants[1], self.store, 10)
+        records = services.lock_stock_pairs([(self.variants[0], self.store), (self.variants[1], self.store)])
+        with self.assertNumQueries(1):
+            services.release_many(records, {
+                (self.variants[0].id, self.store.pk): 4,
+                (self.variants[1].id, self.store.pk): 25,
+                (self.variants[2].id, self.other_store.pk): 1,
+            })
+        self.assertEqual(self._reserved(self.variants[:2]), [6, 0])
+        self.assertEqual(self._stock(self.variants[1]).available_quantity, 100)
+
+    def test_confirm_many_moves_reserved_units_out(self):
+        services.reserve(self.variants[0], self.store, 10)
+        services.reserve(self.variants[1], self.store, 10)
+        records = services.lock_stock_pairs([(self.variants[0], self.store), (self.variants[1], self.store)])
+        with self.assertNumQueries(1):
+            services.confirm_many(records, {
+                (self.variants[0].id, self.store.pk): 10, (self.variants[1].id, self.store.pk): 4
+            })
+        self.assertEqual(
+            [(stock.quantity, stock.reserved_quantity, stock.available_quantity)
+             for stock in map(self._stock, self.variants[:2])],
+            [(90, 0, 90), (96, 6, 90)]
+        )
+
+    def test_confirm_many_short_row_writes_nothing(self):
+        records = services.lock_stock_pairs([(self.variants[0], self.store), (self.variants[1], self.store)])
+        with self.assertRaises(services.InsufficientStock) as raised:
+            services.confirm_many(records, {
+                (self.variants[0].id, self.store.pk): 10, (self.variants[1].id, self.store.pk): 101
+            })
+        self.assertEqual((raised.exception.requested, raised.exception.available), (101, 100))
+        self.assertEqual([self._stock(variant).quantity for variant in self.variants[:2]], [100, 100])
+
+
+class StockLockTests(InventoryTestCase):
+    """Multi-line movements lock their rows with one query, in primary key order"""
+
+    def _lock(self, pairs, create_missing=False, queries=1):
+        with CaptureQueriesContext(connection) as captured, self.assertNumQueries(queries):
+            records = services.lock_stock_pairs(pairs, create_missing=create_missing)
+        sql = captured[-1]['sql']
+        self.assertIn('ORDER BY "inventory_stockrecord"."id" ASC', sql)
+        if connection.features.has_select_for_update:
+            self.assertIn('FOR UPDATE', sql)
+        return records
+
+    def test_pairs_across_locations_are_one_ordered_query(self):
+        StockRecord.objects.create(variant=self.variants[3], location=self.other_store, quantity=5)
+        pairs = [(self.variants[3], self.other_store), (self.variants[5], self.store), (self.variants[1], self.store)]
+        records = self._lock(pairs)
+        self.assertEqual(set(records), {(variant.id, location.pk) for variant, location in pairs})
+        self.assertEqual(records[(self.variants[3].id, self.other_store.pk)].quantity, 5)
+
+    def test_missing_records_are_created_then_locked(self):
+        records = self._lock([(self.variants[0], self.other_store), (self.variants[0], self.store)], True, queries=2)
+        self.assertEqual(records[(self.variants[0].id, self.other_store.pk)].quantity, 0)
+        self.assertEqual(records[(self.variants[0].id, self.store.pk)].quantity, 100)
+
+    def test_records_at_one_location_are_keyed_by_variant(self):
+        with self.assertNumQueries(1):
+            records = services.lock_stock_records(self.store, [self.variants[2].id, self.variants[0]])
+        self.assertEqual(set(records), {self.variants[0].id, self.variants[2].id})
+        self.assertEqual(services.lock_stock_pairs([]), {})
+
+
+class StoredAvailableQuantityTests(InventoryTestCase):
+    """available_quantity is stored and kept equal to quantity - reserved by every write path"""
+
+    def assertInSync(self, variant, available):
+        stock = self._stock(variant)
+        self.assertEqual(stock.available_quantity, available)
+        self.assertEqual(stock.available_quantity, max(0, stock.quantity - stock.reserved_quantity))
+
+    def test_save_recomputes_even_with_update_fields(self):
+        stock = self._stock(self.variants[0])
+        stock.reserved_quantity = 30
+        stock.save(update_fields=['reserved_quantity'])
+        self.assertInSync(self.variants[0], 70)
+
+    def test_service_updates_recompute_in_the_same_statement(self):
+        variant = self.variants[0]
+        services.reserve(variant, self.store, 30)
+        self.assertInSync(variant, 70)
+        services.confirm_sale(variant, self.store, 10)
+        self.assertInSync(variant, 70)
+        services.release(variant, self.store, 20)
+        self.assertInSync(variant, 90)
+        services.adjust(variant, self.store, -15)
+        self.assertInSync(variant, 75)
+        services.receive(variant, self.store, 5)
+        self.assertInSync(variant, 80)
+
+    def test_model_helpers_refresh_the_stored_column(self):
+        stock = self._stock(self.variants[0])
+        self.assertTrue(stock.reserve_stock(30))
+        self.assertEqual((stock.reserved_quantity, stock.available_quantity), (30, 70))
+        stock.confirm_sale(10)
+        self.assertEqual((stock.quantity, stock.available_quantity), (90, 70))
+        stock.release_reservation(20)
+        self.assertEqual((stock.reserved_quantity, stock.available_quantity), (0, 90))
+        self.assertFalse(stock.reserve_stock(91))
+        self.assertEqual(stock.available_quantity, 90)
+
+    def test_reserve_fails_on_stored_column(self):
+        with self.assertRaises(services.InsufficientStock) as raised:
+            services.reserve(self.variants[0], self.store, 101)
+        self.assertEqual(raised.exception.available, 100)
+        self.assertInSync(self.variants[0], 100)
+
+    def test_list_filters_and_orders_on_available_quantity(self):
+        for variant, reserved in zip(self.variants[:3], (90, 60, 95)):
+            services.reserve(variant, self.store, reserved)
+
+        response = self.client.get('/api/inventory/stock/', {
+            'available_quantity__lte': 40, 'ordering': 'available_quantity'
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['available_quantity'] for row in response.data['results']], [5, 10, 40])
+
+
+class VariantStockSummaryTests(InventoryTestCase):
+    """Every stock mutation leaves VariantStockSummary equal to the sums over StockRecord"""
+
+    def assertSummariesMatch(self):
+        totals = {
+            row['variant']: row
+            for row in StockRecord.objects.values('variant').annotate(
+                total_quantity=Sum('quantity'),
+                total_reserved=Sum('reserved_quantity'),
+                total_available=Sum('available_quantity'),
+                locations_stocked=Count('pk', filter=Q(quantity__gt=0))
+            ).order_by()
+        }
+        summaries = VariantStockSummary.objects.filter(variant__in=self.variants[:2])
+        self.assertEqual(len(summaries), 2)
+        for summary in summaries:
+            row = totals[summary.variant_id]
+            self.assertEqual(
+                (summary.total_quantity, summary.total_reserved, summary.total_available, summary.locations_stocked),
+                (row['total_quantity'], row['total_reserved'], row['total_available'], row['locations_stocked'])
+            )
+
+    def test_summary_follows_reserve_confirm_adjust_and_transfer(self):
+        lines = [{'variant': variant.pk, 'quantity': 10} for variant in self.variants[:2]]
+        customer = CustomUser.objects.create(username='buyer', role='CUSTOMER', is_approved=True)
+        order = self.client.post('/api/sales/orders/', {'customer': customer.pk, 'items': lines}, format='json')
+        self.assertEqual(order.status_code, 201)
+        self.assertSummariesMatch()
+        self.assertEqual(VariantStockSummary.objects.get(variant=self.variants[0]).total_reserved, 10)
+
+        self.assertEqual(self.client.post(f'/api/sales/orders/{order.data["id"]}/confirm/').status_code, 200)
+        self.assertSummariesMatch()
+
+        response = self.client.post('/api/inventory/adjust/', {
+            'variant': self.variants[0].pk, 'location': self.store.pk, 'adjustment': -5, 'reason': 'Damaged'
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertSummariesMatch()
+
+        transfer = self.client.post('/api/inventory/transfers/', {
+            'from_location': self.store.pk, 'to_location': self.other_store.pk, 'items': lines
+        }, format='json').data['id']
+        self.client.post(f'/api/inventory/transfers/{transfer}/dispatch/')
+        self.assertSummariesMatch()
+        admin = APIClient()
+        admin.force_authenticate(self.admin)
+        admin.post(f'/api/inventory/transfers/{transfer}/receive/')
+        self.assertSummariesMatch()
+        summary = VariantStockSummary.objects.get(variant=self.variants[0])
+        self.assertEqual((summary.total_quantity, summary.locations_stocked), (85, 2))
+
+
+class ShardedStockTests(InventoryTestCase):
+    """Free shard units count as available for reads, filters and removals"""
+
+    def setUp(self):
+        super().setUp()
+        self.hot = self.variants[0]
+        StockRecord.objects.filter(variant=self.hot, location=self.store).update(shard_count=4)
+        services.rebalance_shards(self._stock(self.hot))
+
+    def _true_available(self, variant):
+        return StockRecord.objects.with_shard_stock().get(variant=variant, location=self.store).true_available
+
+    def _shard_free(self):
+        return sum(shard.capacity - shard.reserved for shard in StockShard.objects.filter(record__variant=self.hot))
+
+    def test_escrow_counts_as_available_in_list_filters_and_ordering(self):
+        self.assertEqual(self._stock(self.hot).available_quantity, 0)
+        services.reserve(self.variants[1], self.store, 95)
+
+        response = self.client.get('/api/inventory/stock/low_stock/', {'threshold': 10})
+        self.assertEqual([row['variant'] for row in response.data], [self.variants[1].id])
+        response = self.client.get('/api/inventory/stock/', {
+            'available_quantity__gte': 100, 'ordering': '-available_quantity'
+        })
+        first = response.data['results'][0]
+        self.assertEqual((first['variant'], first['available_quantity'], first['reserved_quantity']), (self.hot.id, 100, 0))
+        response = self.client.get('/api/inventory/stock/', {'ordering': 'available_quantity'})
+        self.assertEqual(response.data['results'][0]['variant'], self.variants[1].id)
+
+    def test_negative_adjustment_takes_shard_units(self):
+        self.assertTrue(services._reserve_from_shard(self._stock(self.hot).pk, 5))
+        services.adjust(self.hot, self.store, -90)
+        stock = self._stock(self.hot)
+        self.assertEqual(stock.quantity, 10)
+        # 5 reserved through a shard stay reserved; the rest is re-split
+        self.assertEqual(self._true_available(self.hot), 5)
+        self.assertEqual(self._shard_free(), 4)
+        self.assertEqual(stock.reserved_quantity - self._shard_free(), 5)
+
+    def test_move_many_takes_shard_units(self):
+        records = services.lock_stock_pairs([(self.hot, self.store), (self.variants[1], self.store)])
+        services.move_many(records, {(self.hot.id, self.store.pk): -60, (self.variants[1].id, self.store.pk): 5})
+        self.assertEqual(self._true_available(self.hot), 40)
+        self.assertEqual(self._shard_free(), 40)
+        record = records[(self.hot.id, self.store.pk)]
+        self.assertEqual((record.quantity, record.reserved_quantity), (40, 40))
+
+        with self.assertRaises(services.InsufficientStock):
+            services.move_many(records, {(self.hot.id, self.store.pk): -41})
+
+
+class LedgerKeysetPaginationTests(InventoryTestCase):
+    """The ledger pages on (timestamp, id), so tied timestamps neither repeat nor drop rows"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        rows = StockTransaction.objects.bulk_create([
+            StockTransaction(
+                variant=cls.variants[i % 10],
+                location=cls.store,
+                transaction_type='ADJUSTMENT',
+                quantity=1,
+                reference_type='ADJUSTMENT',
+                reference_id=i,
+                performed_by=cls.manager
+            )
+            for i in range(25)
+        ])
+        # Five rows to a timestamp, so every page boundary falls inside a tie
+        start = timezone.now() - timedelta(days=1)
+        for i, row in enumerate(rows):
+            StockTransaction.objects.filter(pk=row.pk).update(timestamp=start + timedelta(minutes=i // 5))
+        cls.newest_first = list(StockTransaction.objects.order_by('-timestamp', '-id').values_list('pk', flat=True))
+
+    def _walk(self, url, link):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([row['id'] for row in response.data['results']])
+            url = response.data[link]
+        return pages
+
+    def test_forward_and_back_visit_every_row_once(self):
+        pages = self._walk('/api/inventory/transactions/?page_size=7', 'next')
+        self.assertEqual([len(page) for page in pages], [7, 7, 7, 4])
+        self.assertEqual(sum(pages, []), self.newest_first)
+
+        last_page = self.client.get('/api/inventory/transactions/?page_size=7').data
+        for _ in range(3):
+            last_page = self.client.get(last_page['next']).data
+        back = self._walk(last_page['previous'], 'previous')
+        self.assertEqual(sum(reversed(back), []), self.newest_first[:21])
+
+    def test_ascending_order_and_count(self):
+        response = self.client.get('/api/inventory/transactions/', {'ordering': 'timestamp', 'page_size': 10})
+        self.assertEqual(response.data['count'], 25)
+        pages = self._walk(response.data['next'], 'next')
+        ids = [row['id'] for row in response.data['results']] + sum(pages, [])
+        self.assertEqual(ids, self.newest_first[::-1])
+
+    def test_count_can_be_skipped(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/inventory/transactions/', {'count': 'false'})
+        self.assertNotIn('count', response.data)
+        self.assertFalse(any('COUNT(' in query['sql'].upper() for query in queries))
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get('/api/inventory/transactions/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+class LedgerExportTests(InventoryTestCase):
+    """Exports stream CSV/NDJSON; their errors are still JSON, labelled as JSON"""
+
+    def setUp(self):
+        super().setUp()
+        for variant in self.variants[:3]:
+            StockTransaction.objects.create(
+                variant=variant,
+                location=self.store,
+                transaction_type='IN',
+                quantity=100,
+                reference_type='PO',
+                reference_id=1,
+                performed_by=self.manager
+            )
+
+    def test_csv_and_ndjson(self):
+        response = self.client.get('/api/inventory/transactions/export/', {'format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:4], ['id', 'timestamp', 'variant_id', 'sku'])
+        self.assertEqual(len(lines), 4)
+
+        response = self.client.get('/api/inventory/transactions/export/', {'format': 'ndjson'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['sku'] for row in rows], ['CR-000', 'CR-001', 'CR-002'])
+
+    def test_errors_are_json(self):
+        response = self.client.get('/api/inventory/transactions/export/', {'format': 'csv', 'from': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('from', json.loads(response.content))
+
+        customer = CustomUser.objects.create(username='buyer', role='CUSTOMER')
+        self.client.force_authenticate(customer)
+        response = self.client.get('/api/inventory/transactions/export/', {'format': 'ndjson'})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('detail', json.loads(response.content))
+
+
+class StockSnapshotTests(InventoryTestCase):
+    """As-of stock from the nearest snapshot must match summing the whole ledger"""
+
+    def setUp(self):
+        super().setUp()
+        self.today = timezone.localdate()
+        self.days = [self.today - timedelta(days=offset) for offset in range(10, 0, -1)]
+        # A receipt on day 0, then a sale of one more unit every day, and a
+        # reservation that must not count towards on-hand
+        self._ledger(self.days[0], self.variants[0], 'IN', 100)
+        self._ledger(self.days[0], self.variants[1], 'IN', 50, location=self.other_store)
+        for number, day in enumerate(self.days):
+            self._ledger(day, self.variants[0], 'OUT', -(number + 1))
+            self._ledger(day, self.variants[0], 'RESERVE', -5)
+
+    def _ledger(self, day, variant, transaction_type, quantity, location=None):
+        row = StockTransaction.objects.create(
+            variant=variant,
+            location=location or self.store,
+            transaction_type=transaction_type,
+            quantity=quantity,
+            reference_type='ADJUSTMENT',
+            reference_id=0,
+            performed_by=self.manager
+        )
+        noon = timezone.make_aware(datetime.combine(day, time(12)))
+        StockTransaction.objects.filter(pk=row.pk).update(timestamp=noon)
+
+    def _expected(self, day):
+        sold = sum(range(1, self.days.index(day) + 2))
+        return {
+            (self.variants[0].pk, self.store.pk): 100 - sold,
+            (self.variants[1].pk, self.other_store.pk): 50,
+        }
+
+    def test_as_of_matches_ledger_from_either_side_of_a_snapshot(self):
+        self.assertEqual(stock_as_of(self.days[4])[1], self._expected(self.days[4]))
+
+        build_snapshot(self.days[2])
+        build_snapshot(self.days[7])
+        for day in self.days:
+            snapshot, balances = stock_as_of(day)
+            self.assertIsNotNone(snapshot)
+            self.assertEqual(balances, self._expected(day), day)
+
+    def test_snapshot_chains_from_previous_one(self):
+        first = build_snapshot(self.days[2])
+        self.assertEqual(first.line_count, 2)
+        later = build_snapshot(self.days[5])
+        self.assertEqual(
+            {(line.variant_id, line.location_id): line.quantity for line in later.lines.all()},
+            self._expected(self.days[5])
+        )
+        # Existing snapshots are kept unless rebuilt
+        self._ledger(self.days[5], self.variants[0], 'ADJUSTMENT', -3)
+        self.assertEqual(build_snapshot(self.days[5]).pk, later.pk)
+        expected = self._expected(self.days[5])[(self.variants[0].pk, self.store.pk)] - 3
+        rebuilt = build_snapshot(self.days[5], rebuild=True)
+        self.assertEqual(rebuilt.lines.get(variant=self.variants[0]).quantity, expected)
+
+    def test_as_of_endpoint_narrows_to_location(self):
+        build_snapshot(self.days[3])
+        response = self.client.get('/api/inventory/stock/as_of/', {
+            'date': self.days[6].isoformat(), 'location': self.store.pk
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['snapshot_date'], self.days[3])
+        self.assertEqual(
+            [(row['sku'], row['quantity']) for row in response.data['results']],
+            [('CR-000', 100 - sum(range(1, 8)))]
+        )
+        self.assertEqual(self.client.get('/api/inventory/stock/as_of/').status_code, 400)
+
+
+class ReconcileStockTests(InventoryTestCase):
+    """reconcile_stock reports ledger/StockRecord mismatches and --fix balances the ledger"""
+
+    def setUp(self):
+        super().setUp()
+        # The ledger explains the 100 units of every variant but two, and
+        # has a row at a location without a stock record
+        for variant in self.variants[2:]:
+            self._ledger(variant, self.store, 'IN', 100)
+        self._ledger(self.variants[0], self.store, 'IN', 90)
+        self._ledger(self.variants[0], self.store, 'RESERVE', -40)
+        self._ledger(self.variants[0], self.other_store, 'IN', 7)
+        report = tempfile.NamedTemporaryFile(suffix='.csv', delete=False)
+        report.close()
+        self.report = report.name
+        self.addCleanup(os.remove, self.report)
+
+    def _ledger(self, variant, location, transaction_type, quantity):
+        StockTransaction.objects.create(
+            variant=variant,
+            location=location,
+            transaction_type=transaction_type,
+            quantity=quantity,
+            reference_type='PO',
+            reference_id=0,
+            performed_by=self.manager
+        )
+
+    def _reconcile(self, *args):
+        call_command('reconcile_stock', '--workers', '1', '--output', self.report, *args, stdout=StringIO())
+        with open(self.report, newline='') as report:
+            return [
+                (int(row['location_id']), row['sku'], int(row['stock_record_quantity']), int(row['ledger_quantity']))
+                for row in csv.DictReader(report)
+            ]
+
+    def test_reports_discrepancies_per_location(self):
+        self.assertEqual(sorted(self._reconcile()), [
+            (self.store.pk, 'CR-000', 100, 90),
+            (self.store.pk, 'CR-001', 100, 0),
+            (self.other_store.pk, 'CR-000', 0, 7),
+        ])
+        location_id, ledger_rows, records, _, found = reconcile_location(self.store.pk)
+        self.assertEqual((location_id, ledger_rows, records, len(found)), (self.store.pk, 9, 10, 2))
+
+    def test_fix_writes_balancing_adjustments(self):
+        self._reconcile('--fix')
+        adjustments = StockTransaction.objects.filter(transaction_type='ADJUSTMENT')
+        self.assertEqual(
+            sorted(adjustments.values_list('location_id', 'variant__sku', 'quantity')),
+            sorted([(self.store.pk, 'CR-000', 10), (self.store.pk, 'CR-001', 100), (self.other_store.pk, 'CR-000', -7)])
+        )
+        self.assertEqual(self._reconcile(), [])
+
+
+class StockTransferTests(InventoryTestCase):
+    """Transfers move stock out of the source on dispatch and into the destination on receipt"""
+
+    def _create(self, from_location, lines, client=None):
+        return (client or self.client).post('/api/inventory/transfers/', {
+            'from_location': from_location.pk,
+            'to_location': (self.other_store if from_location == self.store else self.store).pk,
+            'items': [{'variant': variant.pk, 'quantity': quantity} for variant, quantity in lines],
+        }, format='json')
+
+    def _quantities(self, variant):
+        return [
+            StockRecord.objects.filter(variant=variant, location=location).values_list('quantity', flat=True).first()
+            for location in (self.store, self.other_store)
+        ]
+
+    def _other_manager(self):
+        client = APIClient()
+        client.force_authenticate(
+            CustomUser.objects.create(username='other-manager', role='STORE_MANAGER', store=self.other_store)
+        )
+        return client
+
+    def test_dispatch_then_receive(self):
+        response = self._create(self.store, [(self.variants[0], 30), (self.variants[1], 5)])
+        self.assertEqual(response.status_code, 201)
+        transfer_id = response.data['id']
+
+        response = self.client.post(f'/api/inventory/transfers/{transfer_id}/dispatch/')
+        self.assertEqual(response.data['status'], 'DISPATCHED')
+        self.assertEqual(self._quantities(self.variants[0]), [70, None])
+
+        response = self._other_manager().post(f'/api/inventory/transfers/{transfer_id}/receive/')
+        self.assertEqual(response.data['status'], 'RECEIVED')
+        self.assertEqual(self._quantities(self.variants[0]), [70, 30])
+        self.assertEqual(self._quantities(self.variants[1]), [95, 5])
+        self.assertEqual(
+            sorted(StockTransaction.objects.filter(reference_type='TRANSFER').values_list('quantity', flat=True)),
+            [-30, -5, 5, 30]
+        )
+
+    def test_short_source_dispatches_nothing(self):
+        transfer_id = self._create(self.store, [(self.variants[0], 30), (self.variants[1], 101)]).data['id']
+        response = self.client.post(f'/api/inventory/transfers/{transfer_id}/dispatch/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._quantities(self.variants[0]), [100, None])
+
+    def test_cancel_returns_dispatched_stock(self):
+        transfer_id = self._create(self.store, [(self.variants[0], 30)]).data['id']
+        self.client.post(f'/api/inventory/transfers/{transfer_id}/dispatch/')
+        response = self.client.post(f'/api/inventory/transfers/{transfer_id}/cancel/')
+        self.assertEqual(response.data['status'], 'CANCELLED')
+        self.assertEqual(self._quantities(self.variants[0]), [100, None])
+
+    def test_managers_only_send_from_their_own_store(self):
+        response = self._create(self.other_store, [(self.variants[0], 1)])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('from_location', response.data)
+
+        # A transfer into the manager's store is visible to them, but only
+        # the source store (or an admin) may dispatch it
+        admin = APIClient()
+        admin.force_authenticate(self.admin)
+        StockRecord.objects.create(variant=self.variants[0], location=self.other_store, quantity=10)
+        transfer_id = self._create(self.other_store, [(self.variants[0], 10)], client=admin).data['id']
+        response = self.client.post(f'/api/inventory/transfers/{transfer_id}/dispatch/')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self._quantities(self.variants[0]), [100, 10])
+        response = admin.post(f'/api/inventory/transfers/{transfer_id}/dispatch/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_only_the_destination_receives_and_the_source_cancels(self):
+        other = self._other_manager()
+        transfer_id = self._create(self.store, [(self.variants[0], 30)]).data['id']
+        self.client.post(f'/api/inventory/transfers/{transfer_id}/dispatch/')
+
+        response = self.client.post(f'/api/inventory/transfers/{transfer_id}/receive/')
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('error', response.data)
+        response = other.post(f'/api/inventory/transfers/{transfer_id}/cancel/')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self._quantities(self.variants[0]), [70, None])
+
+        # Admins act for either store
+        admin = APIClient()
+        admin.force_authenticate(self.admin)
+        self.assertEqual(admin.post(f'/api/inventory/transfers/{transfer_id}/receive/').data['status'], 'RECEIVED')
+        self.assertEqual(self._quantities(self.variants[0]), [70, 30])
+
+
+class AvailabilityCacheTests(InventoryTestCase):
+    """Availability is served from a versioned cache, invalidated when stock writes commit"""
+
+    def setUp(self):
+        super().setUp()
+        availability_cache.clear()
+        services.refresh_variant_summaries(self.variants)
+        self.ids = [variant.id for variant in self.variants]
+
+    def test_misses_load_in_one_query_and_hits_in_none(self):
+        cache = AvailabilityCache(max_entries=100)
+        with self.assertNumQueries(1):
+            self.assertEqual(cache.get_many(self.ids, self.store.pk), dict.fromkeys(self.ids, 100))
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.get_many(self.ids, self.store.pk), dict.fromkeys(self.ids, 100))
+        # Totals across locations are keyed separately
+        with self.assertNumQueries(1):
+            self.assertEqual(cache.get_many(self.ids), dict.fromkeys(self.ids, 100))
+        self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (10, 20))
+
+    def test_stock_write_invalidates_on_commit(self):
+        cache = AvailabilityCache(max_entries=100)
+        variant = self.variants[0]
+        cache.get_many([variant.id], self.store.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            services.reserve(variant, self.store, 30)
+            cache.invalidate(self.store.pk, [variant.id])
+            # Not visible until the writing transaction commits
+            self.assertEqual(cache.get_many([variant.id], self.store.pk), {variant.id: 100})
+        self.assertEqual(cache.get_many([variant.id], self.store.pk), {variant.id: 70})
+
+    def test_local_versions_are_bounded(self):
+        cache = AvailabilityCache(max_entries=4)
+        cache.get_many(self.ids[:1], self.store.pk)
+        for variant_id in self.ids[1:]:
+            cache._bump([(variant_id, self.store.pk)])
+        self.assertLessEqual(cache.stats()['versions'], cache.max_versions)
+        # The entry cached before the floor moved is not trusted any more
+        misses = cache.stats()['misses']
+        cache.get_many(self.ids[:1], self.store.pk)
+        self.assertEqual(cache.stats()['misses'], misses + 1)
+
+    def test_variant_list_reads_page_availability_in_one_batch(self):
+        def variant_queries(page_size):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/catalog/variants/', {'page_size': page_size})
+            self.assertEqual(response.status_code, 200)
+            return response.data['results'], len(queries)
+
+        services.reserve(self.variants[0], self.store, 100)
+        services.refresh_variant_summaries([self.variants[0]])
+        availability_cache.clear()
+        rows, _ = variant_queries(10)
+        self.assertEqual([row['stock_available'] for row in rows], [False] + [True] * 9)
+
+        availability_cache.clear()
+        _, cold = variant_queries(10)
+        _, warm = variant_queries(10)
+        self.assertEqual(cold, warm + 1)
+
+
+class ForecastTests(InventoryTestCase):
+    """Daily demand statistics are read with one query and reduced per variant/location"""
+
+    today = datetime(2026, 3, 1).date()
+
+    def _sale(self, variant, days_ago, units, transaction_type='OUT', location=None, reference_type='SO'):
+        row = StockTransaction.objects.create(
+            variant=variant,
+            location=location or self.store,
+            transaction_type=transaction_type,
+            quantity=-units if transaction_type == 'OUT' else units,
+            reference_type=reference_type,
+            reference_id=1
+        )
+        moment = timezone.make_aware(datetime.combine(self.today - timedelta(days=days_ago), time(12)))
+        StockTransaction.objects.filter(pk=row.pk).update(timestamp=moment)
+
+    def _expected(self, demand, method, alpha=0.1, window=28):
+        """Mean and std of a dense daily demand series (oldest day first)"""
+        demand = np.array(demand, dtype=np.float64)
+        if method == 'ewma':
+            weights = (1 - alpha) ** np.arange(len(demand) - 1, -1, -1)
+        else:
+            weights = np.zeros(len(demand))
+            weights[-min(window, len(demand)):] = 1.0
+        weights /= weights.sum()
+        mean = (weights * demand).sum()
+        return mean, np.sqrt((weights * (demand - mean) ** 2).sum())
+
+    def _history(self):
+        variant = self.variants[0]
+        self._sale(variant, 1, 5)
+        self._sale(variant, 1, 1, transaction_type='RETURN')
+        self._sale(variant, 3, 8)
+        self._sale(variant, 3, 2)
+        self._sale(variant, 9, 6)
+        # Ignored: outside the window, today, not a sale, another location
+        self._sale(variant, 11, 50)
+        self._sale(variant, 0, 50)
+        self._sale(variant, 2, 50, reference_type='ADJUSTMENT')
+        self._sale(self.variants[1], 2, 7, location=self.other_store)
+        # Oldest of the 10 days first
+        return [0, 6, 0, 0, 0, 0, 0, 10, 0, 4]
+
+    def test_ewma_matches_dense_series(self):
+        demand = self._history()
+        forecasts = compute_forecasts(days=10, method='ewma', alpha=0.2, today=self.today)
+        mean, std = self._expected(demand, 'ewma', alpha=0.2)
+        avg, safety, threshold = forecasts[(self.variants[0].id, self.store.pk)]
+        self.assertAlmostEqual(avg, mean)
+        expected_safety, expected_threshold = reorder_points(np.array([mean]), np.array([std]))
+        self.assertEqual((safety, threshold), (expected_safety[0], expected_threshold[0]))
+        other, _ = self._expected([0] * 8 + [7, 0], 'ewma', alpha=0.2)
+        self.assertAlmostEqual(forecasts[(self.variants[1].id, self.other_store.pk)][0], other)
+
+    def test_sma_uses_last_window_days(self):
+        demand = self._history()
+        forecasts = compute_forecasts(days=10, method='sma', window=4, today=self.today)
+        mean, std = self._expected(demand, 'sma', window=4)
+        avg, safety, threshold = forecasts[(self.variants[0].id, self.store.pk)]
+        self.assertAlmostEqual(avg, mean)
+        self.assertAlmostEqual(avg, 14 / 4)
+        expected_safety, expected_threshold = reorder_points(np.array([mean]), np.array([std]))
+        self.assertEqual((safety, threshold), (expected_safety[0], expected_threshold[0]))
+
+    def test_location_filter_and_net_returns(self):
+        self._history()
+        self._sale(self.variants[2], 4, 3)
+        self._sale(self.variants[2], 4, 5, transaction_type='RETURN')
+        forecasts = compute_forecasts(days=10, locations=[self.store.pk], today=self.today)
+        self.assertEqual(set(forecasts), {(self.variants[0].id, self.store.pk), (self.variants[2].id, self.store.pk)})
+        # Returns outweighing sales never suggest negative stock
+        avg, _, threshold = forecasts[(self.variants[2].id, self.store.pk)]
+        self.assertLess(avg, 0)
+        self.assertGreaterEqual(threshold, 0)
+
+    def test_chunks_fold_to_the_same_statistics(self):
+        self._history()
+        for days_ago, variant in enumerate(self.variants[2:], 1):
+            self._sale(variant, days_ago, days_ago)
+        expected = compute_forecasts(days=10, today=self.today)
+        with patch('apps.inventory.forecasting.CHUNK_SIZE', 2):
+            forecasts = compute_forecasts(days=10, today=self.today)
+        self.assertEqual(set(forecasts), set(expected))
+        for key, (avg, safety, threshold) in expected.items():
+            self.assertAlmostEqual(forecasts[key][0], avg)
+            self.assertEqual(forecasts[key][1:], (safety, threshold))
+
+    def test_one_query_for_any_number_of_pairs(self):
+        for days_ago, variant in enumerate(self.variants, 1):
+            self._sale(variant, days_ago, days_ago)
+            self._sale(variant, days_ago, 1, location=self.other_store)
+        with CaptureQueriesContext(connection) as queries:
+            forecasts = compute_forecasts(days=30, today=self.today)
+        self.assertEqual(len(forecasts), 20)
+        self.assertEqual(len(queries), 1)
+
+    def test_command_applies_and_creates_alerts(self):
+        self.today = timezone.localdate()
+        self._sale(self.variants[0], 1, 30)
+        self._sale(self.variants[1], 2, 20)
+        alert = StockAlert.objects.create(variant=self.variants[0], location=self.store, threshold=1)
+        quiet = StockAlert.objects.create(variant=self.variants[2], location=self.store, threshold=5)
+
+        call_command('forecast_demand', '--days', '10', '--apply', '--create-missing', stdout=StringIO())
+        alert.refresh_from_db()
+        self.assertGreater(alert.suggested_threshold, 1)
+        self.assertEqual(alert.threshold, alert.suggested_threshold)
+        # No sales in the window: demand is zero but the manual threshold stays
+        quiet.refresh_from_db()
+        self.assertEqual((quiet.avg_daily_demand, quiet.threshold), (0.0, 5))
+        created = StockAlert.objects.get(variant=self.variants[1], location=self.store)
+        self.assertEqual(created.threshold, created.suggested_threshold)
+
+
+class ValuationTests(InventoryTestCase):
+    """FIFO layers and running average cost, moved by documents and rolled back for past dates"""
+
+    def setUp(self):
+        super().setUp()
+        self.variant = self.variants[0]
+        self.key = (self.variant.id, self.store.pk)
+
+    def _receive(self, reference_id, quantity, unit_cost, location=None):
+        location = location or self.store
+        return valuation.receive([(self.variant.id, location.pk, quantity, Decimal(unit_cost))], 'PO', reference_id)
+
+    def _issue(self, quantity, entry_type='SALE', reference_type='SO', reference_id=1):
+        entries = valuation.issue([(*self.key, quantity)], entry_type, reference_type, reference_id)
+        return entries[0] if entries else None
+
+    def _valuation(self, location=None):
+        return StockValuation.objects.get(variant=self.variant, location=location or self.store)
+
+    def test_fifo_consumes_oldest_layers_across_several(self):
+        self._receive(1, 10, '2')
+        self._receive(2, 5, '3')
+        self._receive(3, 10, '4')
+
+        entry = self._issue(12)
+        # FIFO: 10 x 2 + 2 x 3; average: 12 units of 75 over 25
+        self.assertEqual((entry.quantity, entry.fifo_value, entry.average_value), (-12, Decimal('-26'), Decimal('-36')))
+        self.assertEqual(
+            list(self.variant.cost_layers.values_list('remaining', flat=True)), [0, 3, 10]
+        )
+        stock = self._valuation()
+        self.assertEqual((stock.quantity, stock.fifo_value, stock.average_value), (13, Decimal('49'), Decimal('39')))
+
+        entry = self._issue(13, reference_id=2)
+        self.assertEqual((entry.fifo_value, entry.average_value), (Decimal('-49'), Decimal('-39')))
+        stock = self._valuation()
+        self.assertEqual((stock.quantity, stock.fifo_value, stock.average_value), (0, 0, 0))
+
+    def test_units_without_cost_are_not_valued(self):
+        self._receive(1, 5, '2')
+        entry = self._issue(8)
+        self.assertEqual((entry.quantity, entry.fifo_value), (-5, Decimal('-10')))
+        self.assertIsNone(self._issue(1, reference_id=2))
+
+    def test_average_cost_rounding_leaves_no_dust(self):
+        self._receive(1, 1, '1')
+        self._receive(2, 2, '0.5')
+        entries = [self._issue(1, reference_id=reference_id) for reference_id in (1, 2, 3)]
+        for entry in entries[:2]:
+            self.assertEqual(entry.average_value.as_tuple().exponent, -4)
+        # The last unit out takes whatever is left of the rounded average
+        self.assertEqual(sum(entry.average_value for entry in entries), Decimal('-2'))
+        self.assertEqual(self._valuation().average_value, 0)
+
+    def test_receive_issue_return_round_trip(self):
+        self._receive(1, 10, '2')
+        self._receive(2, 10, '5')
+        sale = self._issue(12, reference_id=7)
+        self.assertEqual((sale.fifo_value, sale.average_value), (Decimal('-30'), Decimal('-42')))
+        # A later receipt moves the average; the return still comes back at the cost it left with
+        self._receive(3, 10, '9')
+
+        entry, = valuation.receive_issued('SO', 7, 'SALE', 'RETURN')
+        self.assertEqual(
+            (entry.entry_type, entry.quantity, entry.fifo_value, entry.average_value),
+            ('RETURN', 12, Decimal('30'), Decimal('42'))
+        )
+        self.assertEqual(self.variant.cost_layers.order_by('-id').first().unit_cost, Decimal('2.5'))
+        stock = self._valuation()
+        self.assertEqual((stock.quantity, stock.fifo_value, stock.average_value), (30, Decimal('160'), Decimal('160')))
+        self.assertEqual(valuation.cogs_report()['total_cogs'], 0)
+
+    def test_transfer_round_trip(self):
+        self._receive(1, 10, '2')
+        self._receive(2, 10, '4')
+        out = valuation.issue([(*self.key, 15)], 'TRANSFER_OUT', 'TRANSFER', 3)[0]
+        self.assertEqual((out.fifo_value, out.average_value), (Decimal('-40'), Decimal('-45')))
+
+        entry, = valuation.receive_issued('TRANSFER', 3, 'TRANSFER_OUT', 'TRANSFER_IN', self.other_store.pk)
+        self.assertEqual((entry.location_id, entry.quantity, entry.fifo_value), (self.other_store.pk, 15, Decimal('40')))
+        arrived = self._valuation(self.other_store)
+        self.assertEqual((arrived.quantity, arrived.fifo_value, arrived.average_value), (15, Decimal('40'), Decimal('45')))
+        for method in valuation.METHODS:
+            report = valuation.valuation_report(method)
+            self.assertEqual((report['total_quantity'], report['total_value']), (20, Decimal('60')))
+
+        # And back to the source at the cost it arrived with
+        valuation.issue([(self.variant.id, self.other_store.pk, 15)], 'TRANSFER_OUT', 'TRANSFER', 4)
+        valuation.receive_issued('TRANSFER', 4, 'TRANSFER_OUT', 'TRANSFER_IN', self.store.pk)
+        stock = self._valuation()
+        self.assertEqual((stock.quantity, stock.fifo_value, stock.average_value), (20, Decimal('60'), Decimal('60')))
+        emptied = self._valuation(self.other_store)
+        # 40 over 15 units is a rounded layer cost; the emptied row keeps no dust
+        self.assertEqual((emptied.quantity, emptied.fifo_value, emptied.average_value), (0, 0, 0))
+
+    def test_as_of_rolls_back_later_entries(self):
+        yesterday = timezone.localdate() - timedelta(days=1)
+        self._receive(1, 10, '2')
+        ValuationEntry.objects.update(timestamp=day_end(yesterday) - timedelta(hours=1))
+        self._issue(4)
+        self._receive(2, 5, '3', location=self.other_store)
+
+        past = valuation.valuation_report('fifo', as_of=day_end(yesterday))
+        self.assertEqual(
+            [(row['location'], row['quantity'], row['value']) for row in past['rows']],
+            [(self.store.pk, 10, Decimal('20'))]
+        )
+        now = valuation.valuation_report('fifo', locations=[self.store.pk])
+        self.assertEqual((now['total_quantity'], now['total_value']), (6, Decimal('12')))
 
-# Create your tests here.
+        response = self.client.get('/api/inventory/valuation/', {'date': yesterday.isoformat(), 'method': 'average'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['total_quantity'], response.data['total_value']), (10, Decimal('20')))
+        response = self.client.get('/api/inventory/valuation/', {'method': 'lifo'})
+        self.assertEqual(response.status_code, 400)
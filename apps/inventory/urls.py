@@ -4,13 +4,21 @@ from .views import (
     StockRecordViewSet,
     StockTransactionViewSet,
     StockAdjustmentView,
-    StockAlertViewSet
+    StockAlertViewSet,
+    StockAlertEventViewSet,
+    StockTransferViewSet,
+    AvailabilityViewSet,
+    ValuationViewSet
 )
 
 router = DefaultRouter()
 router.register(r'stock', StockRecordViewSet, basename='stock-record')
+router.register(r'availability', AvailabilityViewSet, basename='availability')
 router.register(r'transactions', StockTransactionViewSet, basename='stock-transaction')
 router.register(r'alerts', StockAlertViewSet, basename='stock-alert')
+router.register(r'alert-events', StockAlertEventViewSet, basename='stock-alert-event')
+router.register(r'transfers', StockTransferViewSet, basename='stock-transfer')
+router.register(r'valuation', ValuationViewSet, basename='valuation')
 
 urlpatterns = [
     path('adjust/', StockAdjustmentView.as_view(), name='stock-adjust'),
@@ -0,0 +1,347 @@
+"""
+Inventory valuation
+
+Every receipt (GRN, return, transfer in, opening balance) adds a CostLayer
+and every issue (sale, transfer out, write-off) consumes the oldest open
+layers of that (variant, location) first. Alongside the layers, each
+StockValuation row keeps two running totals, updated in the same step:
+
+- fifo_value: the value of the remaining layers
+- average_value: quantity x weighted average cost. A receipt adds its
+  cost; an issue takes quantity x the current average
+
+Each document writes one ValuationEntry per line with the units and value
+(under both methods) it moved, so
+
+- the valuation now is the StockValuation rows
+- the valuation at the end of a past day is those rows minus the entries
+  written since
+- COGS for a period is the sum of SALE and RETURN entries in it
+
+and no report ever replays the stock ledger. A document locks the
+StockValuation rows it touches (primary key order) and their open layers
+with one query each, so its cost is independent of history.
+
+Units issued beyond the open layers - stock on hand before valuation
+started - carry no cost; run the open_stock_valuation command once to give
+them an opening layer.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .models import CostLayer, StockValuation, ValuationEntry
+
+PRECISION = Decimal('0.0001')
+METHODS = ('fifo', 'average')
+
+
+def _q(value):
+    return Decimal(value).quantize(PRECISION)
+
+
+def _pairs_condition(keys):
+    """Q matching every (variant_id, location_id) in keys, one IN per location"""
+    by_location = defaultdict(list)
+    for variant_id, location_id in keys:
+        by_location[location_id].append(variant_id)
+    condition = Q()
+    for location_id, variant_ids in by_location.items():
+        condition |= Q(location_id=location_id, variant_id__in=variant_ids)
+    return condition
+
+
+def _lock_valuations(keys):
+    """Lock (creating where missing) the StockValuation rows for keys; dict by key"""
+    keys = sorted(set(keys))
+    StockValuation.objects.bulk_create(
+        [StockValuation(variant_id=variant_id, location_id=location_id) for variant_id, location_id in keys],
+        ignore_conflicts=True
+    )
+    rows = StockValuation.objects.select_for_update().filter(_pairs_condition(keys)).order_by('pk')
+    return {(row.variant_id, row.location_id): row for row in rows}
+
+
+def _save(valuations, layers, entries):
+    now = timezone.now()
+    for valuation in valuations:
+        valuation.updated_at = now
+    StockValuation.objects.bulk_update(valuations, ['quantity', 'fifo_value', 'average_value', 'updated_at'])
+    if layers:
+        CostLayer.objects.bulk_create(layers)
+    ValuationEntry.objects.bulk_create(entries)
+
+
+def _receive(lines, entry_type, reference_type):
+    """
+    lines: [(reference_id, variant_id, location_id, quantity, fifo_value, average_value)].
+    Each line becomes a layer at its FIFO unit cost, rounded to PRECISION.
+    """
+    lines = [line for line in lines if line[3] > 0]
+    if not lines:
+        return []
+    valuations = _lock_valuations((variant_id, location_id) for _, variant_id, location_id, *_ in lines)
+    layers, entries = [], []
+    for reference_id, variant_id, location_id, quantity, fifo_value, average_value in lines:
+        # Units coming back keep their exact value; only the layer's unit cost is rounded
+        unit_cost = _q(Decimal(fifo_value) / quantity)
+        fifo_value, average_value = _q(fifo_value), _q(average_value)
+        valuation = valuations[(variant_id, location_id)]
+        valuation.quantity += quantity
+        valuation.fifo_value += fifo_value
+        valuation.average_value += average_value
+        layers.append(CostLayer(
+            variant_id=variant_id,
+            location_id=location_id,
+            quantity=quantity,
+            remaining=quantity,
+            unit_cost=unit_cost,
+            reference_type=reference_type,
+            reference_id=reference_id
+        ))
+        entries.append(ValuationEntry(
+            variant_id=variant_id,
+            location_id=location_id,
+            entry_type=entry_type,
+            quantity=quantity,
+            fifo_value=fifo_value,
+            average_value=average_value,
+            reference_type=reference_type,
+            reference_id=reference_id
+        ))
+    _save(valuations.values(), layers, entries)
+    return entries
+
+
+def receive(lines, reference_type, reference_id, entry_type='RECEIPT'):
+    """Value received units; lines: [(variant_id, location_id, quantity, unit_cost)]"""
+    return _receive(
+        [
+            (reference_id, variant_id, location_id, quantity, quantity * unit_cost, quantity * unit_cost)
+            for variant_id, location_id, quantity, unit_cost in lines
+        ],
+        entry_type, reference_type
+    )
+
+
+def receive_at_average(lines, reference_type, reference_id, entry_type='ADJUSTMENT'):
+    """
+    Value units found without a purchase price (e.g. positive adjustments)
+    at each row's current average cost; lines: [(variant_id, location_id, quantity)]
+    """
+    valuations = {
+        (row.variant_id, row.location_id): row
+        for row in StockValuation.objects.filter(
+            _pairs_condition({(variant_id, location_id) for variant_id, location_id, _ in lines})
+        )
+    }
+    priced = []
+    for variant_id, location_id, quantity in lines:
+        valuation = valuations.get((variant_id, location_id))
+        unit_cost = valuation.average_cost if valuation else 0
+        priced.append((variant_id, location_id, quantity, unit_cost))
+    return receive(priced, reference_type, reference_id, entry_type)
+
+
+def issue(lines, entry_type, reference_type, reference_id):
+    """
+    Take units out at cost; lines: [(variant_id, location_id, quantity)].
+    FIFO consumes the oldest open layers, average cost takes the units'
+    share of average_value. Entries only count units that had a cost.
+    Returns the ValuationEntries written.
+    """
+    return issue_many([(reference_id, lines)], entry_type, reference_type)
+
+
+def issue_many(documents, entry_type, reference_type):
+    """
+    issue() for many documents at once - documents is [(reference_id, lines)],
+    costed in that order - with one lock and one write for all of them
+    """
+    quantities = defaultdict(int)
+    for reference_id, lines in documents:
+        for variant_id, location_id, quantity in lines:
+            if quantity > 0:
+                quantities[(reference_id, variant_id, location_id)] += quantity
+    if not quantities:
+        return []
+
+    keys = {key[1:] for key in quantities}
+    valuations = _lock_valuations(keys)
+    open_layers = defaultdict(list)
+    for layer in CostLayer.objects.select_for_update().filter(
+        _pairs_condition(keys), remaining__gt=0
+    ).order_by('created_at', 'id'):
+        open_layers[(layer.variant_id, layer.location_id)].append(layer)
+
+    consumed, entries = set(), []
+    for (reference_id, *key), quantity in quantities.items():
+        key = tuple(key)
+        valuation = valuations[key]
+        valued = min(quantity, max(valuation.quantity, 0))
+        if not valued:
+            continue
+        fifo_value, outstanding = Decimal(0), valued
+        layers = open_layers[key]
+        while outstanding and layers:
+            layer = layers[0]
+            take = min(layer.remaining, outstanding)
+            layer.remaining -= take
+            fifo_value += take * layer.unit_cost
+            outstanding -= take
+            consumed.add(layer)
+            if not layer.remaining:
+                layers.pop(0)
+        if valued == valuation.quantity:
+            # Last units out take whatever is left, so no rounding dust stays behind
+            fifo_value = valuation.fifo_value
+            average_value = valuation.average_value
+        else:
+            average_value = _q(valuation.average_value * valued / valuation.quantity)
+
+        valuation.quantity -= valued
+        valuation.fifo_value -= fifo_value
+        valuation.average_value -= average_value
+        entries.append(ValuationEntry(
+            variant_id=key[0],
+            location_id=key[1],
+            entry_type=entry_type,
+            quantity=-valued,
+            fifo_value=-fifo_value,
+            average_value=-average_value,
+            reference_type=reference_type,
+            reference_id=reference_id
+        ))
+    if consumed:
+        CostLayer.objects.bulk_update(consumed, ['remaining'])
+    _save(valuations.values(), [], entries)
+    return entries
+
+
+def receive_issued(reference_type, reference_id, issued_type, entry_type, location_id=None):
+    """
+    Bring back units a document issued - a cancelled sale, a transfer
+    arriving (location_id = destination) or returning to its source - at
+    the cost they left with.
+    """
+    return receive_issued_many(reference_type, [reference_id], issued_type, entry_type, location_id)
+
+
+def receive_issued_many(reference_type, reference_ids, issued_type, entry_type, location_id=None):
+    """receive_issued() for many documents with one read and one write"""
+    issued = ValuationEntry.objects.filter(
+        reference_type=reference_type,
+        reference_id__in=reference_ids,
+        entry_type=issued_type
+    ).values('reference_id', 'variant', 'location').annotate(
+        units=Sum('quantity'),
+        fifo=Sum('fifo_value'),
+        average=Sum('average_value')
+    ).order_by('reference_id')
+    return _receive(
+        [
+            (
+                row['reference_id'], row['variant'], location_id or row['location'],
+                -row['units'], -row['fifo'], -row['average']
+            )
+            for row in issued
+        ],
+        entry_type, reference_type
+    )
+
+
+def _method(method):
+    method = (method or getattr(settings, 'INVENTORY_VALUATION_METHOD', 'fifo')).lower()
+    if method not in METHODS:
+        raise ValueError(f"Unknown valuation method {method!r}; use one of {', '.join(METHODS)}")
+    return method
+
+
+def valuation_report(method=None, locations=None, as_of=None):
+    """
+    Units and value per (variant, location), now or at as_of (an aware
+    datetime). Returns {'method', 'rows': [...], 'total_quantity', 'total_value'}.
+    """
+    method = _method(method)
+    field = f'{method}_value'
+    valuations = StockValuation.objects.all()
+    if locations:
+        valuations = valuations.filter(location_id__in=locations)
+    totals = {
+        (variant_id, location_id): [quantity, value]
+        for variant_id, location_id, quantity, value in valuations.values_list(
+            'variant_id', 'location_id', 'quantity', field
+        )
+    }
+    if as_of is not None:
+        # Roll back everything valued after as_of
+        later = ValuationEntry.objects.filter(timestamp__gt=as_of)
+        if locations:
+            later = later.filter(location_id__in=locations)
+        for row in later.values('variant', 'location').annotate(
+            units=Sum('quantity'), value=Sum(field)
+        ).order_by():
+            total = totals.setdefault((row['variant'], row['location']), [0, Decimal(0)])
+            total[0] -= row['units']
+            total[1] -= row['value']
+
+    from apps.catalog.models import ProductVariant
+    skus = dict(ProductVariant.objects.filter(
+        id__in={variant_id for variant_id, _ in totals}
+    ).values_list('id', 'sku'))
+    rows = [
+        {
+            'variant': variant_id,
+            'sku': skus.get(variant_id),
+            'location': location_id,
+            'quantity': quantity,
+            'value': _q(value),
+            'unit_cost': _q(value / quantity) if quantity > 0 else None,
+        }
+        for (variant_id, location_id), (quantity, value) in sorted(totals.items())
+        if quantity or value
+    ]
+    return {
+        'method': method,
+        'rows': rows,
+        'total_quantity': sum(row['quantity'] for row in rows),
+        'total_value': _q(sum((row['value'] for row in rows), Decimal(0))),
+    }
+
+
+def cogs_report(start=None, end=None, method=None, locations=None):
+    """
+    Cost of goods sold, net of returns, per (variant, location) for
+    entries in [start, end) (aware datetimes; None = unbounded).
+    Returns {'method', 'rows': [...], 'total_quantity', 'total_cogs'}.
+    """
+    method = _method(method)
+    entries = ValuationEntry.objects.filter(entry_type__in=['SALE', 'RETURN'])
+    if start is not None:
+        entries = entries.filter(timestamp__gte=start)
+    if end is not None:
+        entries = entries.filter(timestamp__lt=end)
+    if locations:
+        entries = entries.filter(location_id__in=locations)
+    rows = [
+        {
+            'variant': row['variant'],
+            'sku': row['variant__sku'],
+            'location': row['location'],
+            'quantity': -row['units'],
+            'cogs': _q(-row['value']),
+        }
+        for row in entries.values('variant', 'variant__sku', 'location').annotate(
+            units=Sum('quantity'),
+            value=Sum(f'{method}_value')
+        ).order_by('variant__sku', 'location')
+    ]
+    return {
+        'method': method,
+        'rows': rows,
+        'total_quantity': sum(row['quantity'] for row in rows),
+        'total_cogs': _q(sum((row['cogs'] for row in rows), Decimal(0))),
+    }
@@ -1,27 +1,60 @@
 from rest_framework import viewsets, generics, status
 from rest_framework.decorators import action
+from rest_framework.filters import OrderingFilter, SearchFilter
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.db import transaction
-from .models import StockRecord, StockTransaction, StockAlert
+from django_filters import rest_framework as filters
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from .models import StockRecord, StockTransaction, StockAlert, StockAlertEvent, StockTransfer
+from . import services, valuation
 from .serializers import (
     StockRecordSerializer,
     StockTransactionSerializer,
     StockAdjustmentSerializer,
-    StockAlertSerializer
+    StockAlertSerializer,
+    StockAlertEventSerializer,
+    StockTransferSerializer
 )
+from apps.core.exports import EXPORT_RENDERERS, export_response, parse_date_range
+from apps.core.pagination import SinceIdPagination, KeysetPagination
 from apps.users.permissions import IsStoreManager, IsSalesStaff
 
 
+class StockRecordFilter(filters.FilterSet):
+    """available_quantity filters match what is reported: shard escrow not yet reserved counts as available"""
+    
+    available_quantity = filters.NumberFilter(field_name='true_available')
+    available_quantity__lte = filters.NumberFilter(field_name='true_available', lookup_expr='lte')
+    available_quantity__gte = filters.NumberFilter(field_name='true_available', lookup_expr='gte')
+    
+    class Meta:
+        model = StockRecord
+        fields = ['variant', 'location']
+
+
+class StockOrderingFilter(OrderingFilter):
+    """?ordering=available_quantity sorts on true_available (see StockRecordFilter)"""
+    
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if not ordering:
+            return ordering
+        return [term.replace('available_quantity', 'true_available') for term in ordering]
+
+
 class StockRecordViewSet(viewsets.ReadOnlyModelViewSet):
     """
     Read-only viewset for stock records
     List and retrieve current stock levels
     """
-    queryset = StockRecord.objects.all().select_related('variant', 'location')
+    queryset = StockRecord.objects.with_shard_stock().select_related('variant', 'location')
     serializer_class = StockRecordSerializer
     permission_classes = [IsSalesStaff]
-    filterset_fields = ['variant', 'location']
+    filter_backends = [filters.DjangoFilterBackend, SearchFilter, StockOrderingFilter]
+    filterset_class = StockRecordFilter
     search_fields = ['variant__sku', 'variant__product__name', 'location__name']
     ordering_fields = ['quantity', 'available_quantity', 'last_updated']
     
@@ -29,9 +62,157 @@ class StockRecordViewSet(viewsets.ReadOnlyModelViewSet):
     def low_stock(self, request):
         """Get all stock records with low available quantity"""
         threshold = request.query_params.get('threshold', 10)
-        low_stock = self.queryset.filter(quantity__lte=threshold)
+        # true_available is never below available_quantity, so the
+        # (location, available_quantity) index still narrows the rows
+        low_stock = self.filter_queryset(self.get_queryset()).filter(
+            available_quantity__lte=threshold,
+            true_available__lte=threshold
+        ).order_by('true_available')
         serializer = self.get_serializer(low_stock, many=True)
         return Response(serializer.data)
+    
+    @action(detail=False, methods=['get'])
+    def as_of(self, request):
+        """
+        On-hand stock at the end of a past day, rebuilt from the nearest
+        ledger snapshot plus the ledger rows in between
+        ?date=YYYY-MM-DD&location=<id>&variant=<id>
+        """
+        from apps.catalog.models import ProductVariant
+        from apps.users.models import Store
+        from .snapshots import stock_as_of
+        
+        date = parse_date(request.query_params.get('date') or '')
+        if date is None:
+            return Response(
+                {'error': 'date is required (YYYY-MM-DD)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        filters = {}
+        for param in ('location', 'variant'):
+            value = request.query_params.get(param)
+            if value:
+                if not value.isdigit():
+                    return Response(
+                        {'error': f'{param} must be an id'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                filters[param] = int(value)
+        
+        snapshot, balances = stock_as_of(date, **filters)
+        variants = ProductVariant.objects.in_bulk({key[0] for key in balances})
+        stores = Store.objects.in_bulk({key[1] for key in balances})
+        results = [
+            {
+                'variant': variant_id,
+                'sku': variants[variant_id].sku,
+                'location': location_id,
+                'location_name': stores[location_id].name,
+                'quantity': quantity,
+            }
+            for (variant_id, location_id), quantity in sorted(
+                balances.items(), key=lambda item: (item[0][1], item[0][0])
+            )
+        ]
+        return Response({
+            'date': date,
+            'snapshot_date': snapshot.date if snapshot else None,
+            'results': results,
+        })
+
+
+class AvailabilityViewSet(viewsets.ViewSet):
+    """
+    Cached availability for a page of variants
+    ?variants=1,2,3&location=<id> (omit location for the total across locations)
+    """
+    permission_classes = [IsAuthenticated]
+    max_variants = 200
+    
+    def list(self, request):
+        from .cache import availability_cache
+        
+        try:
+            variant_ids = [
+                int(value) for value in request.query_params.get('variants', '').split(',') if value
+            ]
+            location = request.query_params.get('location')
+            location = int(location) if location else None
+        except ValueError:
+            return Response(
+                {'error': 'variants and location must be ids'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not variant_ids or len(variant_ids) > self.max_variants:
+            return Response(
+                {'error': f'Pass between 1 and {self.max_variants} variant ids'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        available = availability_cache.get_many(variant_ids, location)
+        return Response({
+            'location': location,
+            'results': [
+                {'variant': variant_id, 'available_quantity': available[variant_id]}
+                for variant_id in variant_ids
+            ],
+        })
+    
+    @action(detail=False, methods=['get'], permission_classes=[IsStoreManager])
+    def stats(self, request):
+        """Hit rate, size and evictions of this process's cache"""
+        from .cache import availability_cache
+        
+        return Response(availability_cache.stats())
+
+
+class ValuationViewSet(viewsets.ViewSet):
+    """
+    Stock valuation and cost of goods sold from the maintained valuation state
+    ?method=fifo|average (default INVENTORY_VALUATION_METHOD)&location=<id>
+    Store managers only see their own store
+    """
+    permission_classes = [IsStoreManager]
+    
+    def _params(self, request):
+        """(method, locations, error message)"""
+        method = request.query_params.get('method')
+        if method and method.lower() not in valuation.METHODS:
+            return None, None, f"method must be one of {', '.join(valuation.METHODS)}"
+        location = request.query_params.get('location')
+        if location and not location.isdigit():
+            return None, None, 'location must be an id'
+        user = request.user
+        if user.role != 'ADMIN' and user.store:
+            return method, [user.store_id], None
+        return method, [int(location)] if location else None, None
+    
+    def list(self, request):
+        """Units and value per variant and location, now or at the end of ?date=YYYY-MM-DD"""
+        from .snapshots import day_end
+        
+        method, locations, error = self._params(request)
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        as_of = request.query_params.get('date')
+        if as_of:
+            date = parse_date(as_of)
+            if date is None:
+                return Response({'error': 'date must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+            as_of = day_end(date)
+        return Response(valuation.valuation_report(method, locations, as_of or None))
+    
+    @action(detail=False, methods=['get'])
+    def cogs(self, request):
+        """Cost of goods sold net of returns ?from=YYYY-MM-DD&to=YYYY-MM-DD (inclusive)"""
+        method, locations, error = self._params(request)
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        period = parse_date_range(request, 'timestamp')
+        return Response(valuation.cogs_report(
+            period.get('timestamp__gte'), period.get('timestamp__lt'), method, locations
+        ))
 
 
 class StockTransactionViewSet(viewsets.ReadOnlyModelViewSet):
@@ -44,10 +225,36 @@ class StockTransactionViewSet(viewsets.ReadOnlyModelViewSet):
     )
     serializer_class = StockTransactionSerializer
     permission_classes = [IsSalesStaff]
+    pagination_class = KeysetPagination
+    keyset_field = 'timestamp'
     filterset_fields = ['variant', 'location', 'transaction_type', 'reference_type']
     search_fields = ['variant__sku', 'notes']
     ordering_fields = ['timestamp']
-    ordering = ['-timestamp']
+    ordering = ['-timestamp', '-id']
+    
+    @action(detail=False, methods=['get'], renderer_classes=EXPORT_RENDERERS)
+    def export(self, request, format=None):
+        """
+        Stream the ledger as CSV or NDJSON
+        ?format=csv|ndjson&from=YYYY-MM-DD&to=YYYY-MM-DD plus the list filters
+        """
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            **parse_date_range(request, 'timestamp')
+        ).order_by('timestamp', 'id')
+        return export_response(queryset, [
+            ('id', 'id'),
+            ('timestamp', 'timestamp'),
+            ('variant_id', 'variant_id'),
+            ('sku', 'variant__sku'),
+            ('location_id', 'location_id'),
+            ('location', 'location__code'),
+            ('transaction_type', 'transaction_type'),
+            ('quantity', 'quantity'),
+            ('reference_type', 'reference_type'),
+            ('reference_id', 'reference_id'),
+            ('performed_by', 'performed_by__username'),
+            ('notes', 'notes'),
+        ], request.accepted_renderer.format, 'stock-transactions')
 
 
 class StockAdjustmentView(generics.CreateAPIView):
@@ -68,16 +275,25 @@ class StockAdjustmentView(generics.CreateAPIView):
         adjustment = serializer.validated_data['adjustment']
         reason = serializer.validated_data['reason']
         
-        # Get or create stock record with locking
-        stock, created = StockRecord.objects.select_for_update().get_or_create(
-            variant=variant,
-            location=location,
-            defaults={'quantity': 0, 'reserved_quantity': 0}
-        )
+        # Lock (creating if missing) the stock row, then apply a single
+        # conditional UPDATE that re-checks the floor at write time
+        services.lock_stock_records(location, [variant], create_missing=True)
+        try:
+            services.adjust(variant, location, adjustment)
+        except services.InsufficientStock as exc:
+            transaction.set_rollback(True)
+            return Response(
+                {'adjustment': f"Cannot remove {exc.requested} units. Only {exc.available or 0} available."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        services.stock_changed(location, [variant])
+        stock = StockRecord.objects.get(variant=variant, location=location)
         
-        # Update quantity
-        stock.quantity += adjustment
-        stock.save()
+        # Found units are valued at the current average cost, lost ones written off at cost
+        if adjustment > 0:
+            valuation.receive_at_average([(variant.id, location.id, adjustment)], 'ADJUSTMENT', stock.id)
+        elif adjustment < 0:
+            valuation.issue([(variant.id, location.id, -adjustment)], 'ADJUSTMENT', 'ADJUSTMENT', stock.id)
         
         # Create transaction record
         StockTransaction.objects.create(
@@ -101,15 +317,213 @@ class StockAlertViewSet(viewsets.ModelViewSet):
     CRUD operations for stock alerts
     Managers can configure low-stock thresholds
     """
-    queryset = StockAlert.objects.all().select_related('variant', 'location')
+    queryset = StockAlert.objects.with_stock_status().select_related('variant__stock_summary', 'location')
     serializer_class = StockAlertSerializer
     permission_classes = [IsStoreManager]
     filterset_fields = ['variant', 'location', 'is_active']
     
+    def perform_create(self, serializer):
+        alert = serializer.save()
+        services.record_alert_crossings(alert.location, [alert.variant_id])
+    
+    def perform_update(self, serializer):
+        alert = serializer.save()
+        services.record_alert_crossings(alert.location, [alert.variant_id])
+    
     @action(detail=False, methods=['get'])
     def triggered(self, request):
         """Get all alerts that are currently triggered (below threshold)"""
-        active_alerts = self.queryset.filter(is_active=True)
-        triggered = [alert for alert in active_alerts if alert.check_alert()]
+        triggered = StockAlert.objects.triggered().select_related('variant__stock_summary', 'location')
         serializer = self.get_serializer(triggered, many=True)
         return Response(serializer.data)
+
+
+class StockAlertEventViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Feed of alert threshold crossings, recorded when stock is written
+    Poll with ?since=<cursor> to get only events newer than the last call
+    """
+    queryset = StockAlertEvent.objects.all().select_related(
+        'alert__variant', 'alert__location'
+    )
+    serializer_class = StockAlertEventSerializer
+    permission_classes = [IsStoreManager]
+    pagination_class = SinceIdPagination
+    filterset_fields = ['alert', 'alert__location', 'event_type']
+
+
+class StockTransferViewSet(viewsets.ModelViewSet):
+    """
+    Inter-store stock transfers: DRAFT -> DISPATCHED -> RECEIVED
+    Dispatch takes the lines out of the source location, receive puts them
+    into the destination; stock is in transit in between.
+    """
+    queryset = StockTransfer.objects.all().select_related(
+        'from_location', 'to_location', 'created_by'
+    ).prefetch_related('items__variant')
+    serializer_class = StockTransferSerializer
+    permission_classes = [IsStoreManager]
+    http_method_names = ['get', 'post', 'delete', 'head', 'options']
+    filterset_fields = ['from_location', 'to_location', 'status']
+    search_fields = ['transfer_number']
+    ordering_fields = ['created_at', 'dispatched_at', 'received_at']
+    ordering = ['-created_at']
+    
+    def get_queryset(self):
+        """Store managers only see transfers in or out of their store"""
+        queryset = super().get_queryset()
+        user = self.request.user
+        if user.role != 'ADMIN' and user.store:
+            return queryset.filter(Q(from_location=user.store) | Q(to_location=user.store))
+        return queryset
+    
+    def destroy(self, request, *args, **kwargs):
+        transfer = self.get_object()
+        if transfer.status != 'DRAFT':
+            return Response(
+                {'error': 'Only DRAFT transfers can be deleted'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        transfer.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
+    def _lock(self):
+        """Re-read the transfer with its row locked so a step can't run twice"""
+        return StockTransfer.objects.select_for_update().get(pk=self.get_object().pk)
+    
+    def _move_stock(self, transfer, sides, note):
+        """
+        Move every line of the transfer. sides is a list of (location, sign):
+        -1 takes the lines out of location, +1 puts them in. All StockRecords
+        on every side are locked with one ordered query and written with one
+        bulk UPDATE; ledger rows are bulk inserted.
+        Raises InsufficientStock before writing if a source can't cover a line.
+        """
+        items = list(transfer.items.all())
+        records = services.lock_stock_pairs(
+            [(item.variant_id, location) for location, _ in sides for item in items],
+            create_missing=True
+        )
+        services.move_many(records, {
+            (item.variant_id, location.id): sign * item.quantity
+            for location, sign in sides
+            for item in items
+        })
+        StockTransaction.objects.bulk_create([
+            StockTransaction(
+                variant_id=item.variant_id,
+                location=location,
+                transaction_type='TRANSFER',
+                quantity=sign * item.quantity,
+                reference_type='TRANSFER',
+                reference_id=transfer.id,
+                performed_by=self.request.user,
+                notes=f"Transfer #{transfer.transfer_number} {note}"
+            )
+            for location, sign in sides
+            for item in items
+        ])
+        variant_ids = [item.variant_id for item in items]
+        for location, _ in sides:
+            services.stock_changed(location, variant_ids)
+        
+        # Value leaves the source at cost and arrives (or returns) at that same cost
+        for location, sign in sides:
+            if sign < 0:
+                valuation.issue(
+                    [(item.variant_id, location.id, item.quantity) for item in items],
+                    'TRANSFER_OUT', 'TRANSFER', transfer.id
+                )
+            else:
+                valuation.receive_issued('TRANSFER', transfer.id, 'TRANSFER_OUT', 'TRANSFER_IN', location.id)
+    
+    def _respond(self, transfer):
+        return Response(self.get_serializer(self.get_queryset().get(pk=transfer.pk)).data)
+    
+    # Named dispatch_transfer because APIView.dispatch is the request entry point
+    @action(detail=True, methods=['post'], url_path='dispatch', url_name='dispatch')
+    @transaction.atomic
+    def dispatch_transfer(self, request, pk=None):
+        """
+        Take the lines out of the source location
+        Pass {"receive": true} to receive at the destination in the same step
+        """
+        transfer = self._lock()
+        user = request.user
+        if user.role != 'ADMIN' and transfer.from_location_id != user.store_id:
+            return Response(
+                {'error': 'Only the source store can dispatch a transfer'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        if transfer.status != 'DRAFT':
+            return Response(
+                {'error': 'Only DRAFT transfers can be dispatched'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        receive = str(request.data.get('receive', '')).lower() in ('1', 'true', 'yes')
+        sides = [(transfer.from_location, -1)]
+        if receive:
+            sides.append((transfer.to_location, 1))
+        try:
+            self._move_stock(transfer, sides, 'received' if receive else 'dispatched')
+        except services.InsufficientStock as exc:
+            transaction.set_rollback(True)
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        now = timezone.now()
+        transfer.status = 'RECEIVED' if receive else 'DISPATCHED'
+        transfer.dispatched_by = request.user
+        transfer.dispatched_at = now
+        if receive:
+            transfer.received_by = request.user
+            transfer.received_at = now
+        transfer.save()
+        return self._respond(transfer)
+    
+    @action(detail=True, methods=['post'])
+    @transaction.atomic
+    def receive(self, request, pk=None):
+        """Put dispatched lines into the destination location"""
+        transfer = self._lock()
+        user = request.user
+        if user.role != 'ADMIN' and transfer.to_location_id != user.store_id:
+            return Response(
+                {'error': 'Only the destination store can receive a transfer'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        if transfer.status != 'DISPATCHED':
+            return Response(
+                {'error': 'Only DISPATCHED transfers can be received'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        self._move_stock(transfer, [(transfer.to_location, 1)], 'received')
+        transfer.status = 'RECEIVED'
+        transfer.received_by = request.user
+        transfer.received_at = timezone.now()
+        transfer.save()
+        return self._respond(transfer)
+    
+    @action(detail=True, methods=['post'])
+    @transaction.atomic
+    def cancel(self, request, pk=None):
+        """Cancel a transfer; dispatched lines go back to the source location"""
+        transfer = self._lock()
+        user = request.user
+        if user.role != 'ADMIN' and transfer.from_location_id != user.store_id:
+            return Response(
+                {'error': 'Only the source store can cancel a transfer'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        if transfer.status not in ['DRAFT', 'DISPATCHED']:
+            return Response(
+                {'error': 'Only DRAFT or DISPATCHED transfers can be cancelled'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if transfer.status == 'DISPATCHED':
+            self._move_stock(transfer, [(transfer.from_location, 1)], 'cancelled')
+        transfer.status = 'CANCELLED'
+        transfer.save()
+        return self._respond(transfer)
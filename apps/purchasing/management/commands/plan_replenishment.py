@@ -0,0 +1,67 @@
+"""
+Management command to draft purchase orders for stock at or below its reorder point
+Usage: python manage.py plan_replenishment [--location 3] [--use-suggested] [--cover-days 14] [--dry-run]
+
+Meant to run nightly after forecast_demand.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.purchasing.replenishment import create_purchase_orders, plan_replenishment
+from apps.users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Drafts purchase orders for every SKU-location below its reorder point'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--location', type=int, action='append', dest='locations')
+        parser.add_argument(
+            '--use-suggested', action='store_true',
+            help='Use the forecast suggested_threshold instead of threshold where available'
+        )
+        parser.add_argument(
+            '--cover-days', type=float, default=0,
+            help='Also order this many days of forecast demand'
+        )
+        parser.add_argument('--user', help='Username recorded as created_by')
+        parser.add_argument('--dry-run', action='store_true', help='Print the plan without creating POs')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            user = CustomUser.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"Unknown user {options['user']}")
+
+        started = time.monotonic()
+        plan = plan_replenishment(
+            locations=options['locations'],
+            use_suggested=options['use_suggested'],
+            cover_days=options['cover_days']
+        )
+        lines = sum(len(order['lines']) for order in plan['orders'])
+        self.stdout.write(
+            f"Planned {len(plan['orders'])} purchase orders ({lines} lines) "
+            f"in {time.monotonic() - started:.1f}s"
+        )
+        for line in plan['unsourced']:
+            self.stdout.write(self.style.WARNING(
+                f"No previous supplier for variant {line['variant']} "
+                f"(store {line['store']}, short {line['quantity']})"
+            ))
+
+        if options['dry_run']:
+            for order in plan['orders']:
+                self.stdout.write(
+                    f"Supplier {order['supplier']} -> store {order['store']}: "
+                    f"{len(order['lines'])} lines, {sum(line['quantity'] for line in order['lines'])} units"
+                )
+            return
+
+        purchase_orders = create_purchase_orders(plan, user)
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(purchase_orders)} draft purchase orders: "
+            + ', '.join(po.po_number for po in purchase_orders)
+        ))
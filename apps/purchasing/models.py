@@ -1,6 +1,7 @@
 from django.db import models
 from apps.catalog.models import ProductVariant
 from apps.users.models import Store, CustomUser
+from apps.core.transitions import StateMachine
 
 
 class Supplier(models.Model):
@@ -71,6 +72,15 @@ class PurchaseOrder(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Status changes go through PurchaseOrder.states.apply() (see apps.core.transitions)
+    states = StateMachine(
+        send=(['DRAFT'], 'SENT'),
+        confirm=(['SENT'], 'CONFIRMED'),
+        ship=(['CONFIRMED'], 'SHIPPED'),
+        receive=(['CONFIRMED', 'SHIPPED'], 'RECEIVED'),
+        cancel=(['DRAFT', 'SENT', 'CONFIRMED'], 'CANCELLED'),
+    )
+    
     class Meta:
         ordering = ['-created_at']
     
@@ -79,14 +89,8 @@ class PurchaseOrder(models.Model):
     
     def save(self, *args, **kwargs):
         if not self.po_number:
-            from datetime import datetime
-            date_str = datetime.now().strftime('%Y%m%d')
-            last_po = PurchaseOrder.objects.filter(po_number__startswith=f'PO-{date_str}').order_by('-po_number').first()
-            if last_po:
-                last_num = int(last_po.po_number.split('-')[-1])
-                self.po_number = f'PO-{date_str}-{str(last_num + 1).zfill(4)}'
-            else:
-                self.po_number = f'PO-{date_str}-0001'
+            from apps.core.sequences import next_document_number
+            self.po_number = next_document_number('PO', PurchaseOrder, 'po_number')
         super().save(*args, **kwargs)
 
 
@@ -147,14 +151,8 @@ class GoodsReceiptNote(models.Model):
     
     def save(self, *args, **kwargs):
         if not self.grn_number:
-            from datetime import datetime
-            date_str = datetime.now().strftime('%Y%m%d')
-            last_grn = GoodsReceiptNote.objects.filter(grn_number__startswith=f'GRN-{date_str}').order_by('-grn_number').first()
-            if last_grn:
-                last_num = int(last_grn.grn_number.split('-')[-1])
-                self.grn_number = f'GRN-{date_str}-{str(last_num + 1).zfill(4)}'
-            else:
-                self.grn_number = f'GRN-{date_str}-0001'
+            from apps.core.sequences import next_document_number
+            self.grn_number = next_document_number('GRN', GoodsReceiptNote, 'grn_number')
         super().save(*args, **kwargs)
 
 
@@ -0,0 +1,169 @@
+"""
+Auto-replenishment
+
+For every active StockAlert, compares the inventory position
+
+    available stock + inbound (SENT/CONFIRMED/SHIPPED PO lines not yet received)
+                    + already drafted (DRAFT PO lines)
+
+against the alert's reorder point, and drafts purchase orders for the
+shortfall. Counting DRAFT lines keeps nightly runs from stacking a new
+draft on top of one nobody has sent yet.
+
+Each variant is bought from the supplier (at the unit price) of its most
+recent purchase order line; variants never purchased before can't be
+sourced and are reported instead. Shortfalls are grouped into one DRAFT PO
+per (supplier, store).
+
+Planning is three grouped queries whatever the number of SKUs; creating
+the plan is one document number allocation and two bulk inserts.
+"""
+import math
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from apps.inventory.models import StockAlert
+from .models import GRNItem, PurchaseOrder, PurchaseOrderItem
+
+INBOUND_STATUSES = ['SENT', 'CONFIRMED', 'SHIPPED']
+
+
+def _pipeline(locations=None):
+    """Outstanding (ordered - received) PO quantity per (variant_id, store_id), split by status"""
+    received = GRNItem.objects.filter(po_item=OuterRef('pk')).values('po_item').annotate(
+        total=Sum('quantity_received')
+    ).values('total')
+    items = PurchaseOrderItem.objects.filter(
+        purchase_order__status__in=INBOUND_STATUSES + ['DRAFT']
+    )
+    if locations:
+        items = items.filter(purchase_order__store_id__in=locations)
+    rows = items.annotate(
+        outstanding=Greatest(
+            F('quantity') - Coalesce(Subquery(received, output_field=IntegerField()), Value(0)),
+            Value(0)
+        )
+    ).values('variant', 'purchase_order__store', 'purchase_order__status').annotate(
+        total=Sum('outstanding')
+    ).order_by()
+
+    inbound, drafted = defaultdict(int), defaultdict(int)
+    for row in rows:
+        key = (row['variant'], row['purchase_order__store'])
+        if row['purchase_order__status'] == 'DRAFT':
+            drafted[key] += row['total'] or 0
+        else:
+            inbound[key] += row['total'] or 0
+    return inbound, drafted
+
+
+def _last_purchases(variant_ids):
+    """{variant_id: (supplier_id, unit_price)} from each variant's latest PO line"""
+    from apps.catalog.models import ProductVariant
+
+    latest = PurchaseOrderItem.objects.filter(variant=OuterRef('pk')).exclude(
+        purchase_order__status='CANCELLED'
+    ).order_by('-purchase_order__created_at', '-id')
+    rows = ProductVariant.objects.filter(id__in=variant_ids).annotate(
+        supplier_id=Subquery(latest.values('purchase_order__supplier')[:1]),
+        unit_price=Subquery(latest.values('unit_price')[:1])
+    ).values_list('id', 'supplier_id', 'unit_price')
+    return {
+        variant_id: (supplier_id, unit_price)
+        for variant_id, supplier_id, unit_price in rows
+        if supplier_id is not None
+    }
+
+
+def plan_replenishment(locations=None, use_suggested=False, cover_days=0):
+    """
+    Shortfalls at or below their reorder point, grouped by (supplier, store).
+    use_suggested takes the forecast suggested_threshold over threshold;
+    cover_days orders that many days of forecast demand on top.
+    Returns {'orders': [...], 'unsourced': [...]} (see code for line fields).
+    """
+    alerts = StockAlert.objects.with_stock_status().filter(is_active=True)
+    if locations:
+        alerts = alerts.filter(location_id__in=locations)
+    alerts = alerts.values_list(
+        'variant_id', 'location_id', 'threshold', 'suggested_threshold',
+        'avg_daily_demand', 'current_stock'
+    ).order_by()
+
+    inbound, drafted = _pipeline(locations)
+    shortfalls = []
+    for variant_id, location_id, threshold, suggested, demand, available in alerts:
+        reorder_point = suggested if use_suggested and suggested is not None else threshold
+        key = (variant_id, location_id)
+        position = available + inbound[key] + drafted[key]
+        if position > reorder_point:
+            continue
+        quantity = reorder_point - position + math.ceil((demand or 0) * cover_days)
+        if quantity > 0:
+            shortfalls.append({
+                'variant': variant_id,
+                'store': location_id,
+                'quantity': quantity,
+                'available': available,
+                'inbound': inbound[key],
+                'drafted': drafted[key],
+                'reorder_point': reorder_point,
+            })
+
+    sources = _last_purchases({line['variant'] for line in shortfalls})
+    orders, unsourced = defaultdict(list), []
+    for line in shortfalls:
+        source = sources.get(line['variant'])
+        if source is None:
+            unsourced.append(line)
+            continue
+        line['unit_price'] = source[1]
+        orders[(source[0], line['store'])].append(line)
+
+    return {
+        'orders': [
+            {'supplier': supplier_id, 'store': store_id, 'lines': lines}
+            for (supplier_id, store_id), lines in sorted(orders.items())
+        ],
+        'unsourced': unsourced,
+    }
+
+
+@transaction.atomic
+def create_purchase_orders(plan, user=None):
+    """Create one DRAFT PurchaseOrder per planned order; returns them"""
+    from apps.core.sequences import allocate_document_numbers
+
+    if not plan['orders']:
+        return []
+    numbers = allocate_document_numbers('PO', PurchaseOrder, 'po_number', len(plan['orders']))
+    note = f"Auto-replenishment {timezone.localdate()}"
+    purchase_orders = PurchaseOrder.objects.bulk_create([
+        PurchaseOrder(
+            po_number=number,
+            supplier_id=order['supplier'],
+            store_id=order['store'],
+            status='DRAFT',
+            total_amount=sum(line['quantity'] * line['unit_price'] for line in order['lines']),
+            created_by=user,
+            notes=note
+        )
+        for number, order in zip(numbers, plan['orders'])
+    ])
+    # bulk_create bypasses PurchaseOrderItem.save(), so price the lines here
+    PurchaseOrderItem.objects.bulk_create([
+        PurchaseOrderItem(
+            purchase_order=po,
+            variant_id=line['variant'],
+            quantity=line['quantity'],
+            unit_price=line['unit_price'],
+            line_total=line['quantity'] * line['unit_price']
+        )
+        for po, order in zip(purchase_orders, plan['orders'])
+        for line in order['lines']
+    ])
+    return purchase_orders
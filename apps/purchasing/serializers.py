@@ -67,7 +67,7 @@ class PurchaseOrderSerializer(QuickAddValidationMixin, serializers.ModelSerializ
             'notes', 'created_at', 'updated_at',
             'quick_variant', 'quick_quantity'
         ]
-        read_only_fields = ['po_number', 'order_date', 'created_at', 'updated_at', 'total_amount', 'created_by']
+        read_only_fields = ['po_number', 'status', 'order_date', 'created_at', 'updated_at', 'total_amount', 'created_by']
     
     def validate(self, attrs):
         """Allow creating PO via HTML form (Quick Add) or JSON"""
@@ -223,7 +223,8 @@ class GRNSerializer(serializers.ModelSerializer):
     
     @transaction.atomic
     def create(self, validated_data):
-        from apps.inventory.models import StockRecord, StockTransaction
+        from apps.inventory.models import StockTransaction
+        from apps.inventory import services, valuation
         
         items_data = validated_data.pop('items')
         # receive_all is not a model field, so we must remove it
@@ -231,11 +232,21 @@ class GRNSerializer(serializers.ModelSerializer):
         
         validated_data['received_by'] = self.context['request'].user
         
+        # Move the PO to RECEIVED first: the conditional UPDATE holds its row,
+        # so a second GRN for the same PO waits here and then conflicts
+        po = validated_data['purchase_order']
+        PurchaseOrder.states.apply(po, 'receive')
+        
         # Create GRN
         grn = GoodsReceiptNote.objects.create(**validated_data)
-        po = grn.purchase_order
         receiving_location = po.store
         
+        # Lock (creating where missing) every received stock row in one query
+        received_variants = [
+            item['po_item'].variant_id for item in items_data if item['quantity_received'] > 0
+        ]
+        services.lock_stock_records(receiving_location, received_variants, create_missing=True)
+        
         # Process each item: create GRN item and increment stock
         for item_data in items_data:
             po_item = item_data['po_item']
@@ -246,14 +257,7 @@ class GRNSerializer(serializers.ModelSerializer):
             
             # Atomic stock increment
             if qty_received > 0:
-                stock, created = StockRecord.objects.select_for_update().get_or_create(
-                    variant=po_item.variant,
-                    location=receiving_location,
-                    defaults={'quantity': 0, 'reserved_quantity': 0}
-                )
-                
-                stock.quantity += qty_received
-                stock.save()
+                services.restock(po_item.variant, receiving_location, qty_received)
                 
                 # Create stock transaction
                 StockTransaction.objects.create(
@@ -266,9 +270,15 @@ class GRNSerializer(serializers.ModelSerializer):
                     performed_by=self.context['request'].user,
                     notes=f"GRN #{grn.grn_number} - PO #{po.po_number}"
                 )
+        services.stock_changed(receiving_location, received_variants)
         
-        # Update PO status to RECEIVED
-        po.status = 'RECEIVED'
-        po.save()
+        # One cost layer per received line, at the PO price
+        valuation.receive(
+            [
+                (item['po_item'].variant_id, receiving_location.id, item['quantity_received'], item['po_item'].unit_price)
+                for item in items_data
+            ],
+            'PO', po.id
+        )
         
         return grn
@@ -1,3 +1,179 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.catalog.models import Category, Product, ProductVariant
+from apps.inventory.models import StockAlert, StockRecord
+from apps.users.models import Store, CustomUser
+from .models import GoodsReceiptNote, GRNItem, PurchaseOrder, PurchaseOrderItem, Supplier
+from .replenishment import create_purchase_orders, plan_replenishment
+
+
+class ReplenishmentTests(TestCase):
+    """
+    Four variants with 5 units available at the main store and alerts at 20.
+    The first two were last bought from Acme, the third from Bolt, the
+    fourth never.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.store = Store.objects.create(name='Main Store', code='MS-001', address='Mumbai')
+        cls.other_store = Store.objects.create(name='Second Store', code='SS-001', address='Pune')
+        cls.manager = CustomUser.objects.create(username='manager', role='STORE_MANAGER', store=cls.store)
+        cls.acme = cls._supplier('acme')
+        cls.bolt = cls._supplier('bolt')
+        category = Category.objects.create(name='Fabric')
+        product = Product.objects.create(name='Cotton Roll', category=category, base_price=100)
+        cls.variants = []
+        for i in range(4):
+            variant = ProductVariant.objects.create(
+                product=product,
+                sku=f'CR-{i:03d}',
+                retail_price=150,
+                wholesale_price=100,
+                min_wholesale_qty=1
+            )
+            StockRecord.objects.create(variant=variant, location=cls.store, quantity=5)
+            StockAlert.objects.create(variant=variant, location=cls.store, threshold=20)
+            cls.variants.append(variant)
+
+        week_ago = timezone.now() - timedelta(days=7)
+        old = cls._order(cls.bolt, 'RECEIVED', [(cls.variants[0], 10, 30)], created_at=week_ago)
+        cls._order(cls.acme, 'RECEIVED', [(cls.variants[0], 10, 40), (cls.variants[1], 10, 25)])
+        cls._order(cls.bolt, 'RECEIVED', [(cls.variants[2], 10, 60)], created_at=old.created_at)
+
+    @classmethod
+    def _supplier(cls, name):
+        user = CustomUser.objects.create(username=name, role='SUPPLIER')
+        return Supplier.objects.create(
+            user=user, company_name=name.title(), contact_person=name, phone='1', email=f'{name}@example.com',
+            address='Mumbai'
+        )
+
+    @classmethod
+    def _order(cls, supplier, status, lines, store=None, created_at=None):
+        po = PurchaseOrder.objects.create(supplier=supplier, store=store or cls.store, status=status)
+        for variant, quantity, price in lines:
+            PurchaseOrderItem.objects.create(purchase_order=po, variant=variant, quantity=quantity, unit_price=price)
+        if created_at:
+            PurchaseOrder.objects.filter(pk=po.pk).update(created_at=created_at)
+            po.refresh_from_db()
+        return po
+
+    def _lines(self, plan):
+        return {
+            line['variant']: (order['supplier'], line['quantity'], line['unit_price'])
+            for order in plan['orders']
+            for line in order['lines']
+        }
+
+    def test_plan_groups_shortfalls_by_latest_supplier(self):
+        plan = plan_replenishment()
+        self.assertEqual(
+            [(order['supplier'], order['store']) for order in plan['orders']],
+            [(self.acme.pk, self.store.pk), (self.bolt.pk, self.store.pk)]
+        )
+        # variants[0] was bought from Bolt first, then from Acme
+        self.assertEqual(self._lines(plan), {
+            self.variants[0].id: (self.acme.pk, 15, Decimal('40.00')),
+            self.variants[1].id: (self.acme.pk, 15, Decimal('25.00')),
+            self.variants[2].id: (self.bolt.pk, 15, Decimal('60.00')),
+        })
+        self.assertEqual([line['variant'] for line in plan['unsourced']], [self.variants[3].id])
+
+    def test_inbound_and_drafted_quantities_reduce_the_shortfall(self):
+        sent = self._order(self.acme, 'SENT', [(self.variants[0], 10, 40)])
+        grn = GoodsReceiptNote.objects.create(purchase_order=sent)
+        GRNItem.objects.create(grn=grn, po_item=sent.items.get(), quantity_received=4)
+        self._order(self.acme, 'DRAFT', [(self.variants[1], 12, 25)])
+        self._order(self.acme, 'CANCELLED', [(self.variants[2], 50, 99)])
+        # Another store's pipeline doesn't count here
+        self._order(self.bolt, 'SENT', [(self.variants[2], 50, 60)], store=self.other_store)
+
+        lines = {line['variant']: line for order in plan_replenishment()['orders'] for line in order['lines']}
+        self.assertEqual(
+            (lines[self.variants[0].id]['inbound'], lines[self.variants[0].id]['quantity']), (6, 9)
+        )
+        self.assertEqual(
+            (lines[self.variants[1].id]['drafted'], lines[self.variants[1].id]['quantity']), (12, 3)
+        )
+        # A cancelled order is neither inbound nor the latest source
+        self.assertEqual(lines[self.variants[2].id]['inbound'], 0)
+        self.assertEqual(self._lines(plan_replenishment())[self.variants[2].id][0], self.bolt.pk)
+
+    def test_cancelled_order_stops_counting_as_inbound(self):
+        sent = self._order(self.acme, 'SENT', [(self.variants[0], 15, 40)])
+        self.assertNotIn(self.variants[0].id, self._lines(plan_replenishment()))
+        client = APIClient()
+        client.force_authenticate(self.acme.user)
+        self.assertEqual(client.post(f'/api/purchasing/purchase-orders/{sent.pk}/cancel/').status_code, 403)
+
+        client.force_authenticate(self.manager)
+        response = client.post(f'/api/purchasing/purchase-orders/{sent.pk}/cancel/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'CANCELLED')
+        self.assertEqual(self._lines(plan_replenishment())[self.variants[0].id][1], 15)
+        # Received (or already cancelled) orders can't be cancelled
+        received = PurchaseOrder.objects.filter(status='RECEIVED').first()
+        for po in (sent, received):
+            response = client.post(f'/api/purchasing/purchase-orders/{po.pk}/cancel/')
+            self.assertEqual(response.status_code, 409)
+
+    def test_suggested_threshold_and_cover_days(self):
+        StockAlert.objects.filter(variant=self.variants[0]).update(suggested_threshold=30, avg_daily_demand=1.5)
+        plan = plan_replenishment(use_suggested=True, cover_days=4)
+        # 30 - 5 + ceil(1.5 * 4); alerts without a suggestion keep threshold
+        self.assertEqual(self._lines(plan)[self.variants[0].id][1], 31)
+        self.assertEqual(self._lines(plan)[self.variants[1].id][1], 15)
+
+    def test_stock_above_reorder_point_is_not_ordered(self):
+        StockRecord.objects.filter(variant=self.variants[0]).update(quantity=21, available_quantity=21)
+        StockAlert.objects.filter(variant=self.variants[1]).update(is_active=False)
+        self.assertEqual(set(self._lines(plan_replenishment())), {self.variants[2].id})
+
+    def test_planning_is_three_queries(self):
+        with self.assertNumQueries(3):
+            plan_replenishment()
+
+    def test_created_drafts_are_priced_and_not_planned_twice(self):
+        purchase_orders = create_purchase_orders(plan_replenishment(), self.manager)
+        self.assertEqual(len(purchase_orders), 2)
+        acme = PurchaseOrder.objects.get(pk=purchase_orders[0].pk)
+        self.assertEqual((acme.status, acme.supplier_id, acme.created_by), ('DRAFT', self.acme.pk, self.manager))
+        self.assertEqual(acme.total_amount, Decimal('975.00'))
+        self.assertEqual(
+            sorted(acme.items.values_list('variant', 'quantity', 'line_total')),
+            [(self.variants[0].id, 15, Decimal('600.00')), (self.variants[1].id, 15, Decimal('375.00'))]
+        )
+        self.assertEqual(plan_replenishment()['orders'], [])
+
+    def test_command_dry_run_creates_nothing(self):
+        out = StringIO()
+        call_command('plan_replenishment', '--dry-run', stdout=out)
+        self.assertIn('Planned 2 purchase orders (3 lines)', out.getvalue())
+        self.assertFalse(PurchaseOrder.objects.filter(status='DRAFT').exists())
+
+        call_command('plan_replenishment', '--user', 'manager', stdout=StringIO())
+        self.assertEqual(PurchaseOrder.objects.filter(status='DRAFT', created_by=self.manager).count(), 2)
+
+    def test_endpoint_plans_for_the_managers_store(self):
+        StockAlert.objects.create(variant=self.variants[0], location=self.other_store, threshold=20)
+        client = APIClient()
+        client.force_authenticate(self.manager)
+
+        response = client.get('/api/purchasing/purchase-orders/replenishment/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({order['store'] for order in response.data['orders']}, {self.store.pk})
 
-# Create your tests here.
+        response = client.post('/api/purchasing/purchase-orders/replenishment/?cover_days=x')
+        self.assertEqual(response.status_code, 400)
+        response = client.post('/api/purchasing/purchase-orders/replenishment/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['purchase_orders']), 2)
+        self.assertEqual(len(response.data['unsourced']), 1)
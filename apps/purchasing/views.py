@@ -1,7 +1,7 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from apps.core.transitions import TransitionConflict
 from .models import Supplier, PurchaseOrder, GoodsReceiptNote
 from .serializers import (
     SupplierSerializer,
@@ -9,6 +9,7 @@ from .serializers import (
     GRNSerializer
 )
 from apps.users.permissions import IsStoreManager, IsSupplier
+from apps.core.mixins import IdempotentCreateMixin
 
 
 class SupplierViewSet(viewsets.ModelViewSet):
@@ -32,7 +33,7 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
     """
     queryset = PurchaseOrder.objects.all().select_related(
         'supplier', 'store', 'created_by'
-    ).prefetch_related('items__variant')
+    ).prefetch_related('items__variant__stock_summary')
     serializer_class = PurchaseOrderSerializer
     filterset_fields = ['supplier', 'store', 'status']
     search_fields = ['po_number']
@@ -43,7 +44,8 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
         """Managers can create/update, suppliers can view their own"""
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
             return [IsStoreManager()]
-        return [IsAuthenticated()]
+        # Custom actions declare their own permission_classes
+        return super().get_permissions()
     
     def get_queryset(self):
         """Filter POs based on user role"""
@@ -68,21 +70,59 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
         # Everyone else (Customers, Sales Staff) sees nothing
         return queryset.none()
     
-    @action(detail=True, methods=['post'], permission_classes=[IsStoreManager])
-    def send_to_supplier(self, request, pk=None):
-        """Mark PO as sent to supplier"""
-        po = self.get_object()
-        if po.status != 'DRAFT':
-            return Response(
-                {'error': 'Only DRAFT POs can be sent'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+    @action(detail=False, methods=['get', 'post'], permission_classes=[IsStoreManager])
+    def replenishment(self, request):
+        """
+        GET: preview draft POs for stock at or below its reorder point
+        POST: create them
+        ?use_suggested=true uses forecast thresholds, ?cover_days=N adds N days of demand
+        """
+        from .replenishment import create_purchase_orders, plan_replenishment
+        
+        try:
+            cover_days = float(request.query_params.get('cover_days', 0))
+        except ValueError:
+            return Response({'error': 'cover_days must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Store managers only plan for their own store
+        locations = [request.user.store_id] if request.user.store_id else None
+        plan = plan_replenishment(
+            locations=locations,
+            use_suggested=request.query_params.get('use_suggested', '').lower() in ('1', 'true', 'yes'),
+            cover_days=cover_days
+        )
+        if request.method == 'GET':
+            return Response(plan)
         
-        po.status = 'SENT'
-        po.save()
+        purchase_orders = create_purchase_orders(plan, request.user)
+        queryset = self.get_queryset().filter(pk__in=[po.pk for po in purchase_orders])
+        return Response(
+            {
+                'purchase_orders': self.get_serializer(queryset, many=True).data,
+                'unsourced': plan['unsourced'],
+            },
+            status=status.HTTP_201_CREATED
+        )
+    
+    def _transition(self, po, name):
+        """Apply a status transition; 409 if the PO isn't in a status it starts from"""
+        try:
+            PurchaseOrder.states.apply(po, name)
+        except TransitionConflict as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
         serializer = self.get_serializer(po)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['post'], permission_classes=[IsStoreManager])
+    def send_to_supplier(self, request, pk=None):
+        """Mark DRAFT PO as sent to supplier"""
+        return self._transition(self.get_object(), 'send')
+    
+    @action(detail=True, methods=['post'], permission_classes=[IsStoreManager])
+    def cancel(self, request, pk=None):
+        """Cancel a PO that hasn't shipped; its lines stop counting as inbound stock"""
+        return self._transition(self.get_object(), 'cancel')
+    
     @action(detail=True, methods=['post'], permission_classes=[IsSupplier])
     def confirm(self, request, pk=None):
         """Supplier confirms the PO"""
@@ -95,16 +135,7 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        if po.status != 'SENT':
-            return Response(
-                {'error': 'Only SENT POs can be confirmed'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        po.status = 'CONFIRMED'
-        po.save()
-        serializer = self.get_serializer(po)
-        return Response(serializer.data)
+        return self._transition(po, 'confirm')
     
     @action(detail=True, methods=['post'], permission_classes=[IsSupplier])
     def mark_shipped(self, request, pk=None):
@@ -117,19 +148,10 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        if po.status != 'CONFIRMED':
-            return Response(
-                {'error': 'Only CONFIRMED POs can be shipped'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        po.status = 'SHIPPED'
-        po.save()
-        serializer = self.get_serializer(po)
-        return Response(serializer.data)
+        return self._transition(po, 'ship')
 
 
-class GRNViewSet(viewsets.ModelViewSet):
+class GRNViewSet(IdempotentCreateMixin, viewsets.ModelViewSet):
     """
     CRUD for Goods Receipt Notes
     Create triggers atomic stock increment
@@ -147,22 +169,9 @@ class GRNViewSet(viewsets.ModelViewSet):
     
     def create(self, request, *args, **kwargs):
         """Create GRN with atomic stock increment"""
-        serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        
-        # Check PO status
-        po = serializer.validated_data['purchase_order']
-        if po.status not in ['CONFIRMED', 'SHIPPED']:
-            return Response(
-                {'error': 'PO must be CONFIRMED or SHIPPED to receive goods'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Create GRN (stock increment happens in serializer)
-        self.perform_create(serializer)
-        headers = self.get_success_headers(serializer.data)
-        return Response(
-            serializer.data,
-            status=status.HTTP_201_CREATED,
-            headers=headers
-        )
+        # Create GRN (PO -> RECEIVED and stock increment happen in serializer);
+        # a PO not CONFIRMED or SHIPPED, or already received by a concurrent GRN, is a conflict
+        try:
+            return super().create(request, *args, **kwargs)
+        except TransitionConflict as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
@@ -0,0 +1,102 @@
+"""
+Multi-location fulfillment allocator
+
+Given a cart ({variant_id: quantity}), loads available stock for every
+candidate location with one query into a SKU x location matrix and picks
+where to ship from:
+
+1. a single location that covers every line, preferring the caller's
+   preferred location, then the one with the most stock left over
+2. otherwise a greedy split: repeatedly take the location that covers the
+   most outstanding units until the cart is covered or no location can add
+   anything. Greedy set cover isn't guaranteed minimal, but stays within a
+   log factor of it and needs one vectorised pass per shipment.
+
+A line may be split across locations. Whatever can't be covered anywhere
+is reported as unfulfilled.
+"""
+import numpy as np
+from django.db.models import F
+
+from apps.inventory.models import StockRecord, shard_free_stock
+from apps.users.models import Store
+
+
+def _stock_matrix(variant_ids, location_ids):
+    """available[i, j] = available quantity of variant_ids[i] at location_ids[j]"""
+    available = np.zeros((len(variant_ids), len(location_ids)), dtype=np.int64)
+    rows = StockRecord.objects.filter(
+        variant_id__in=variant_ids,
+        location_id__in=location_ids
+    ).annotate(
+        available=F('available_quantity') + shard_free_stock()
+    ).filter(available__gt=0).values_list('variant_id', 'location_id', 'available')
+    data = np.array(list(rows), dtype=np.int64).reshape(-1, 3)
+    if len(data):
+        variant_index = np.searchsorted(variant_ids, data[:, 0])
+        location_index = np.searchsorted(location_ids, data[:, 1])
+        available[variant_index, location_index] = data[:, 2]
+    return available
+
+
+def allocate(cart, locations=None, preferred_location=None):
+    """
+    Plan shipments for cart ({variant_id: quantity}) from locations (ids;
+    default every active store).
+    Returns {'shipments': [(location_id, {variant_id: quantity}), ...],
+             'unfulfilled': {variant_id: quantity}}
+    """
+    cart = {int(variant_id): int(qty) for variant_id, qty in cart.items() if qty > 0}
+    if locations is None:
+        locations = Store.objects.filter(is_active=True).values_list('id', flat=True)
+    variant_ids = np.array(sorted(cart), dtype=np.int64)
+    location_ids = np.array(sorted(set(locations)), dtype=np.int64)
+    if not len(variant_ids) or not len(location_ids):
+        return {'shipments': [], 'unfulfilled': cart}
+
+    available = _stock_matrix(variant_ids, location_ids)
+    demand = np.array([cart[variant_id] for variant_id in variant_ids.tolist()], dtype=np.int64)
+    preferred = np.flatnonzero(location_ids == (preferred_location or 0))
+
+    # 1. Single location
+    covers = (available >= demand[:, None]).all(axis=0)
+    if covers.any():
+        if len(preferred) and covers[preferred[0]]:
+            column = preferred[0]
+        else:
+            surplus = np.where(covers, available.sum(axis=0), -1)
+            column = int(surplus.argmax())
+        return {
+            'shipments': [(int(location_ids[column]), dict(cart))],
+            'unfulfilled': {},
+        }
+
+    # 2. Greedy split
+    remaining = demand.copy()
+    shipments = []
+    while remaining.any():
+        take = np.minimum(available, remaining[:, None])
+        covered = take.sum(axis=0)
+        column = int(covered.argmax())
+        if len(preferred) and covered[preferred[0]] == covered[column]:
+            column = int(preferred[0])
+        if covered[column] == 0:
+            break
+        lines = take[:, column]
+        shipments.append((
+            int(location_ids[column]),
+            {
+                int(variant_id): int(qty)
+                for variant_id, qty in zip(variant_ids[lines > 0], lines[lines > 0])
+            }
+        ))
+        remaining -= lines
+        available[:, column] = 0
+
+    return {
+        'shipments': shipments,
+        'unfulfilled': {
+            int(variant_id): int(qty)
+            for variant_id, qty in zip(variant_ids[remaining > 0], remaining[remaining > 0])
+        },
+    }
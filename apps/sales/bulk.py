@@ -0,0 +1,182 @@
+"""
+Bulk order transitions
+
+bulk_confirm(), bulk_cancel() and bulk_ship() move many orders in one
+transaction whose cost grows with the number of lines, not round trips:
+
+- the orders are locked with one SELECT ... FOR UPDATE (primary key order)
+  and checked against the allowed source statuses
+- all their lines are read with one query and summed per (variant, store),
+  so a StockRecord shared by many orders is locked and written once
+- stock rows are locked with one ordered query and written with one bulk
+  UPDATE per kind of movement; ledger rows and valuation entries are bulk
+  inserted; the orders' status is set with one Order.states.apply_many()
+  UPDATE
+
+Each order succeeds or fails on its own: an order that can't move (wrong
+status, not enough stock on hand) is reported and left untouched, the rest
+go through. Results come back in the order the ids were given, as
+{'id', 'success', 'status'} or {'id', 'success', 'error'}.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+
+from .models import Order, OrderItem
+
+
+def _claim(order_ids, allowed):
+    """Lock the orders; returns ({id: order} in an allowed status, {id: error})"""
+    orders = {
+        order.id: order
+        for order in Order.objects.select_for_update().filter(id__in=order_ids).order_by('pk')
+    }
+    failed = {}
+    for order_id in order_ids:
+        order = orders.get(order_id)
+        if order is None:
+            failed[order_id] = 'Order not found'
+        elif order.status not in allowed:
+            failed[order_id] = f"Order is {order.status}; only {' or '.join(allowed)} orders allowed"
+            del orders[order_id]
+    return orders, failed
+
+
+def _lines(orders):
+    """{order_id: [(variant_id, quantity), ...]} for every line of orders, one query"""
+    lines = defaultdict(list)
+    for order_id, variant_id, quantity in OrderItem.objects.filter(
+        order_id__in=orders
+    ).values_list('order_id', 'variant_id', 'quantity').order_by('order_id', 'id'):
+        lines[order_id].append((variant_id, quantity))
+    return lines
+
+
+def _results(order_ids, done, failed, status):
+    return [
+        {'id': order_id, 'success': True, 'status': status}
+        if order_id in done
+        else {'id': order_id, 'success': False, 'error': failed[order_id]}
+        for order_id in order_ids
+    ]
+
+
+def _ledger(orders, lines, transaction_type, sign, note, user):
+    from apps.inventory.models import StockTransaction
+
+    StockTransaction.objects.bulk_create([
+        StockTransaction(
+            variant_id=variant_id,
+            location_id=order.store_id,
+            transaction_type=transaction_type,
+            quantity=sign * quantity,
+            reference_type='SO',
+            reference_id=order.id,
+            performed_by=user,
+            notes=f"Order #{order.order_number} {note}"
+        )
+        for order in orders
+        for variant_id, quantity in lines[order.id]
+    ])
+
+
+def _stock_changed(keys):
+    from apps.inventory import services
+
+    by_store = defaultdict(set)
+    for variant_id, store_id in keys:
+        by_store[store_id].add(variant_id)
+    for store_id, variant_ids in by_store.items():
+        services.stock_changed(store_id, variant_ids)
+
+
+@transaction.atomic
+def bulk_confirm(order_ids, user):
+    """Confirm PENDING orders: reserved units leave stock as sales; invoices are queued"""
+    from apps.catalog.models import ProductVariant
+    from apps.core.jobs import enqueue_many_on_commit
+    from apps.inventory import services, valuation
+
+    orders, failed = _claim(order_ids, Order.states.sources('confirm'))
+    lines = _lines(orders)
+    records = services.lock_stock_pairs(
+        {(variant_id, order.store_id) for order in orders.values() for variant_id, _ in lines[order.id]}
+    )
+
+    # Hand out on-hand units order by order; an order that would run a row short fails whole
+    on_hand = {key: record.quantity for key, record in records.items()}
+    quantities = defaultdict(int)
+    confirmed, short = [], {}
+    for order in orders.values():
+        needed = defaultdict(int)
+        for variant_id, quantity in lines[order.id]:
+            needed[(variant_id, order.store_id)] += quantity
+        missing = next((key for key, qty in needed.items() if on_hand.get(key, 0) < qty), None)
+        if missing:
+            short[order.id] = missing
+            continue
+        for key, qty in needed.items():
+            on_hand[key] -= qty
+            quantities[key] += qty
+        confirmed.append(order)
+
+    if short:
+        skus = dict(ProductVariant.objects.filter(
+            id__in={key[0] for key in short.values()}
+        ).values_list('id', 'sku'))
+        for order_id, (variant_id, _) in short.items():
+            failed[order_id] = f'Insufficient stock for {skus[variant_id]}'
+
+    if confirmed:
+        services.confirm_many(records, quantities)
+        _ledger(confirmed, lines, 'OUT', -1, 'confirmed', user)
+        valuation.issue_many(
+            [
+                (order.id, [(variant_id, order.store_id, quantity) for variant_id, quantity in lines[order.id]])
+                for order in confirmed
+            ],
+            'SALE', 'SO'
+        )
+        Order.states.apply_many(Order.objects.filter(id__in=[order.id for order in confirmed]), 'confirm')
+        enqueue_many_on_commit('sales.create_invoice', [{'order_id': order.id} for order in confirmed])
+        _stock_changed(quantities)
+    return _results(order_ids, {order.id for order in confirmed}, failed, 'CONFIRMED')
+
+
+@transaction.atomic
+def bulk_cancel(order_ids, user):
+    """
+    Cancel PENDING orders (reservations released) and CONFIRMED ones
+    (units put back on hand at the cost they were sold at)
+    """
+    from apps.inventory import services, valuation
+
+    orders, failed = _claim(order_ids, Order.states.sources('cancel'))
+    lines = _lines(orders)
+    releases, restocks = defaultdict(int), defaultdict(int)
+    for order in orders.values():
+        target = releases if order.status == 'PENDING' else restocks
+        for variant_id, quantity in lines[order.id]:
+            target[(variant_id, order.store_id)] += quantity
+
+    records = services.lock_stock_pairs(set(releases) | set(restocks))
+    services.release_many(records, releases)
+    if restocks:
+        services.move_many(records, restocks)
+        returned = [order for order in orders.values() if order.status == 'CONFIRMED']
+        _ledger(returned, lines, 'RETURN', 1, 'cancelled', user)
+        valuation.receive_issued_many('SO', [order.id for order in returned], 'SALE', 'RETURN')
+
+    if orders:
+        Order.states.apply_many(Order.objects.filter(id__in=orders), 'cancel')
+        _stock_changed(set(releases) | set(restocks))
+    return _results(order_ids, orders, failed, 'CANCELLED')
+
+
+@transaction.atomic
+def bulk_ship(order_ids):
+    """Mark CONFIRMED orders as SHIPPED (stock already left on confirm)"""
+    orders, failed = _claim(order_ids, Order.states.sources('ship'))
+    if orders:
+        Order.states.apply_many(Order.objects.filter(id__in=orders), 'ship')
+    return _results(order_ids, orders, failed, 'SHIPPED')
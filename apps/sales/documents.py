@@ -0,0 +1,240 @@
+"""
+Invoice documents
+
+An invoice is rendered to HTML (templates/sales/invoice.html) or PDF
+(apps.core.pdf) from a plain dict of everything printed on it - invoice,
+order, customer, store and lines, money already formatted. The SHA-256 of
+that dict, the format and RENDER_VERSION is the document's content hash:
+
+- the rendered bytes are stored as an InvoiceDocument with their hash and
+  reused until the hash changes (a payment, an edited line, a new
+  template version), so an unchanged invoice is rendered once
+- the hash is the download's strong ETag, so a client revalidating with
+  If-None-Match gets 304 without the document even being read
+
+Building the dict takes two queries for any number of invoices. Rendering
+needs no database, which lets render_many() farm it out to a process pool
+(the render_invoices command).
+
+Bump RENDER_VERSION whenever the template or PDF layout changes so stored
+documents are re-rendered.
+"""
+import hashlib
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.db.models import Prefetch
+from django.template.loader import render_to_string
+
+from .models import InvoiceDocument, OrderItem
+
+RENDER_VERSION = 1
+CONTENT_TYPES = {
+    'html': 'text/html; charset=utf-8',
+    'pdf': 'application/pdf',
+}
+FORMATS = tuple(CONTENT_TYPES)
+
+
+def with_document_data(queryset):
+    """Invoices with everything invoice_context() reads, in two queries"""
+    return queryset.select_related('order__customer', 'order__store').prefetch_related(
+        Prefetch('order__items', queryset=OrderItem.objects.select_related('variant__product'))
+    )
+
+
+def _money(value):
+    return f'{value:.2f}'
+
+
+def invoice_context(invoice):
+    """Everything printed on the invoice, as JSON-safe strings"""
+    order = invoice.order
+    customer = order.customer
+    return {
+        'invoice_number': invoice.invoice_number,
+        'invoice_date': invoice.invoice_date.isoformat(),
+        'due_date': invoice.due_date.isoformat(),
+        'order_number': order.order_number,
+        'order_date': order.order_date.date().isoformat(),
+        'order_type': order.get_order_type_display(),
+        'customer': {
+            'name': customer.get_full_name() or customer.username,
+            'email': customer.email,
+            'phone': customer.phone,
+            'address': customer.address,
+        },
+        'store': {
+            'name': order.store.name,
+            'address': order.store.address,
+            'phone': order.store.phone,
+        },
+        'lines': [
+            {
+                'sku': item.variant.sku,
+                'description': ' '.join(
+                    part for part in (item.variant.product.name, item.variant.size, item.variant.color) if part
+                ),
+                'quantity': item.quantity,
+                'unit_price': _money(item.unit_price),
+                'line_total': _money(item.line_total),
+            }
+            for item in order.items.all()
+        ],
+        'subtotal': _money(order.subtotal),
+        'discount': _money(order.discount),
+        'amount': _money(invoice.amount),
+        'paid_amount': _money(invoice.paid_amount),
+        'balance': _money(invoice.balance),
+    }
+
+
+def content_hash(context, fmt):
+    data = json.dumps([RENDER_VERSION, fmt, context], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def render_html(context):
+    return render_to_string('sales/invoice.html', context).encode()
+
+
+def _row(pdf, cells, size=9, bold=False):
+    """(text, width, align) cells; a width of None takes what the others leave"""
+    fixed = sum(width for _, width, _ in cells if width)
+    parts = []
+    for text, width, align in cells:
+        width = width or pdf.columns(size) - fixed
+        text = str(text)[:width]
+        parts.append(text.rjust(width) if align == 'right' else text.ljust(width))
+    pdf.line(''.join(parts).rstrip(), size=size, bold=bold)
+
+
+def render_pdf(context):
+    from apps.core.pdf import TextPDF
+
+    pdf = TextPDF()
+    store = context['store']
+    pdf.line(store['name'], size=16, bold=True)
+    for text in store['address'].splitlines() + [store['phone']]:
+        if text:
+            pdf.line(text, size=9)
+    pdf.line()
+    pdf.line(f"INVOICE {context['invoice_number']}", size=13, bold=True)
+    pdf.line(f"Invoice date: {context['invoice_date']}    Due date: {context['due_date']}", size=9)
+    pdf.line(
+        f"Order: {context['order_number']} ({context['order_type']}) of {context['order_date']}", size=9
+    )
+    pdf.line()
+
+    customer = context['customer']
+    pdf.line('Bill to', size=9, bold=True)
+    for text in [customer['name']] + customer['address'].splitlines() + [customer['email'], customer['phone']]:
+        if text:
+            pdf.line(text, size=9)
+    pdf.line()
+
+    widths = [(16, 'left'), (None, 'left'), (6, 'right'), (12, 'right'), (13, 'right')]
+    _row(pdf, [(text, *layout) for text, layout in zip(
+        ['SKU', 'Description', 'Qty', 'Unit price', 'Amount'], widths
+    )], bold=True)
+    pdf.rule()
+    for line in context['lines']:
+        _row(pdf, [(text, *layout) for text, layout in zip(
+            [line['sku'], line['description'], line['quantity'], line['unit_price'], line['line_total']], widths
+        )])
+    pdf.rule()
+    for label, key, bold in (
+        ('Subtotal', 'subtotal', False),
+        ('Discount', 'discount', False),
+        ('Total', 'amount', True),
+        ('Paid', 'paid_amount', False),
+        ('Balance due', 'balance', True),
+    ):
+        _row(pdf, [('', None, 'left'), (label, 14, 'left'), (context[key], 13, 'right')], bold=bold)
+    return pdf.render()
+
+
+RENDERERS = {
+    'html': render_html,
+    'pdf': render_pdf,
+}
+
+
+def render(context, fmt):
+    return RENDERERS[fmt](context)
+
+
+def document(invoice, fmt, context=None):
+    """
+    (content_hash, bytes) of invoice as fmt, rendering and storing it only
+    if the stored document's hash no longer matches. invoice should come
+    from with_document_data().
+    """
+    context = context or invoice_context(invoice)
+    digest = content_hash(context, fmt)
+    content = InvoiceDocument.objects.filter(
+        invoice=invoice, format=fmt, content_hash=digest
+    ).values_list('content', flat=True).first()
+    if content is None:
+        content = render(context, fmt)
+        InvoiceDocument.objects.update_or_create(
+            invoice=invoice, format=fmt,
+            defaults={'content_hash': digest, 'content': content}
+        )
+    return digest, bytes(content)
+
+
+def _render_job(args):
+    invoice_id, fmt, digest, context = args
+    return invoice_id, fmt, digest, render(context, fmt)
+
+
+def render_many(invoices, formats=FORMATS, workers=None, force=False, batch_size=500):
+    """
+    Render every invoice in the queryset whose stored documents are missing
+    or out of date (all of them with force), in a pool of worker processes.
+    Returns (rendered, unchanged) document counts.
+    """
+    invoices = with_document_data(invoices.order_by('pk'))
+    rendered = unchanged = 0
+    # Spawned, not forked: a child must not share (and on exit close) this
+    # process's database connection. django.setup() runs before the first
+    # task is unpickled, which imports this module and so the models
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup
+    ) as pool:
+        last = 0
+        while True:
+            # Keyset batches: each one is an indexed range read, however far in
+            batch = list(invoices.filter(pk__gt=last)[:batch_size])
+            if not batch:
+                break
+            last = batch[-1].pk
+            stored = set(
+                InvoiceDocument.objects.filter(
+                    invoice__in=batch, format__in=formats
+                ).values_list('invoice_id', 'format', 'content_hash')
+            )
+            pending = []
+            for invoice in batch:
+                context = invoice_context(invoice)
+                for fmt in formats:
+                    digest = content_hash(context, fmt)
+                    if force or (invoice.pk, fmt, digest) not in stored:
+                        pending.append((invoice.pk, fmt, digest, context))
+                    else:
+                        unchanged += 1
+            documents = [
+                InvoiceDocument(invoice_id=invoice_id, format=fmt, content_hash=digest, content=content)
+                for invoice_id, fmt, digest, content in pool.map(_render_job, pending, chunksize=16)
+            ]
+            InvoiceDocument.objects.bulk_create(
+                documents,
+                update_conflicts=True,
+                unique_fields=['invoice', 'format'],
+                update_fields=['content_hash', 'content', 'rendered_at']
+            )
+            rendered += len(documents)
+    return rendered, unchanged
@@ -0,0 +1,33 @@
+"""
+Background jobs for sales (run by run_workers, see apps.core.jobs)
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from apps.core.jobs import register
+
+INVOICED_STATUSES = ('CONFIRMED', 'SHIPPED', 'DELIVERED')
+
+
+@register('sales.create_invoice')
+def create_invoice(order_id):
+    """
+    Invoice a confirmed order for its total, due INVOICE_DUE_DAYS later.
+    Does nothing if the order already has an invoice or was cancelled
+    before the job ran, so running it twice is harmless.
+    """
+    from .models import Invoice, Order
+
+    # Lock the order so a concurrent cancel or second run waits for us
+    order = Order.objects.select_for_update().filter(pk=order_id).first()
+    if order is None or order.status not in INVOICED_STATUSES:
+        return None
+    if Invoice.objects.filter(order=order).exists():
+        return None
+    return Invoice.objects.create(
+        order=order,
+        due_date=timezone.localdate() + timedelta(days=getattr(settings, 'INVOICE_DUE_DAYS', 30)),
+        amount=order.total_amount
+    )
@@ -0,0 +1,55 @@
+"""
+Management command to cancel PENDING orders whose reservation has expired
+Usage: python manage.py expire_reservations [--batch-size 500] [--loop --interval 30]
+
+Without --loop, drains every expired order and exits (suitable for cron).
+With --loop it keeps running as a daemon, sleeping --interval seconds
+whenever there is nothing left to expire.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.sales.reservations import expire_batch
+
+
+class Command(BaseCommand):
+    help = 'Releases reservations held by expired PENDING orders and cancels them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--loop', action='store_true', help='Keep running as a daemon')
+        parser.add_argument(
+            '--interval', type=float, default=30.0,
+            help='Seconds to sleep between sweeps with --loop'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        try:
+            while True:
+                total = self._sweep(options['batch_size'])
+                if not options['loop']:
+                    self.stdout.write(self.style.SUCCESS(f'{total} expired orders cancelled'))
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped')
+
+    def _sweep(self, batch_size):
+        started = time.monotonic()
+        total = 0
+        while True:
+            cancelled = expire_batch(batch_size)
+            total += cancelled
+            if cancelled < batch_size:
+                break
+        if total:
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f'Expired {total} orders in {elapsed:.1f}s '
+                f'({total / elapsed if elapsed else 0:.0f} orders/s)'
+            )
+        return total
@@ -0,0 +1,55 @@
+"""
+Management command to pre-render invoice documents
+Usage: python manage.py render_invoices --month 2026-10 [--format pdf] [--workers 4] [--force]
+
+Renders the HTML and PDF (or just --format) of every invoice dated in
+--month, or in --from/--to (YYYY-MM-DD, inclusive), in a pool of --workers
+processes (default: one per CPU). Invoices whose stored documents still
+match their content hash are skipped unless --force is given.
+"""
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from apps.sales.documents import FORMATS, render_many
+from apps.sales.models import Invoice
+
+
+class Command(BaseCommand):
+    help = 'Renders (and stores) invoice documents for a period in a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='YYYY-MM')
+        parser.add_argument('--from', dest='start', help='First invoice date, YYYY-MM-DD')
+        parser.add_argument('--to', dest='end', help='Last invoice date, YYYY-MM-DD')
+        parser.add_argument('--format', action='append', dest='formats', choices=FORMATS)
+        parser.add_argument('--workers', type=int, help='Worker processes (default: CPU count)')
+        parser.add_argument('--force', action='store_true', help='Re-render documents that are up to date')
+
+    def handle(self, *args, **options):
+        invoices = Invoice.objects.all()
+        if options['month']:
+            try:
+                year, month = (int(part) for part in options['month'].split('-'))
+                first = date(year, month, 1)
+            except ValueError:
+                raise CommandError('--month must be YYYY-MM')
+            following = date(year + month // 12, month % 12 + 1, 1)
+            invoices = invoices.filter(invoice_date__gte=first, invoice_date__lt=following)
+        for option, lookup in (('start', 'gte'), ('end', 'lte')):
+            if options[option]:
+                day = parse_date(options[option])
+                if day is None:
+                    raise CommandError(f"--{'from' if option == 'start' else 'to'} must be YYYY-MM-DD")
+                invoices = invoices.filter(**{f'invoice_date__{lookup}': day})
+        if options['workers'] is not None and options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+
+        rendered, unchanged = render_many(
+            invoices,
+            formats=options['formats'] or FORMATS,
+            workers=options['workers'],
+            force=options['force']
+        )
+        self.stdout.write(self.style.SUCCESS(f'Rendered {rendered} documents, {unchanged} already up to date'))
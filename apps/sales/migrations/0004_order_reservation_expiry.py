@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sales", "0003_keyset_pagination_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="reservation_expires_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="PENDING orders past this time are cancelled by expire_reservations",
+                null=True,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                condition=models.Q(("status", "PENDING")),
+                fields=["reservation_expires_at"],
+                name="order_pending_expiry_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sales", "0004_order_reservation_expiry"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="InvoiceDocument",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "format",
+                    models.CharField(
+                        choices=[("html", "HTML"), ("pdf", "PDF")], max_length=10
+                    ),
+                ),
+                (
+                    "content_hash",
+                    models.CharField(
+                        help_text="SHA-256 of the rendering inputs; also the download's ETag",
+                        max_length=64,
+                    ),
+                ),
+                ("content", models.BinaryField()),
+                ("rendered_at", models.DateTimeField(auto_now=True)),
+                (
+                    "invoice",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="documents",
+                        to="sales.invoice",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["invoice_id", "format"],
+                "unique_together": {("invoice", "format")},
+            },
+        ),
+    ]
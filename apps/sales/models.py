@@ -1,6 +1,7 @@
 from django.db import models
 from apps.catalog.models import ProductVariant
 from apps.users.models import Store, CustomUser
+from apps.core.transitions import StateMachine
 
 
 class Order(models.Model):
@@ -56,25 +57,42 @@ class Order(models.Model):
         help_text="Sales staff who created the order"
     )
     notes = models.TextField(blank=True)
+    reservation_expires_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="PENDING orders past this time are cancelled by expire_reservations"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Status changes go through Order.states.apply() (see apps.core.transitions)
+    states = StateMachine(
+        confirm=(['PENDING'], 'CONFIRMED'),
+        cancel=(['PENDING', 'CONFIRMED'], 'CANCELLED'),
+        ship=(['CONFIRMED'], 'SHIPPED'),
+        deliver=(['SHIPPED'], 'DELIVERED'),
+    )
+    
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # Keyset pagination of order history (see apps.core.pagination.KeysetPagination)
+            models.Index(fields=['created_at', 'id'], name='order_created_id_idx'),
+            # Only pending orders hold reservations, so the sweeper's index stays small
+            models.Index(
+                fields=['reservation_expires_at'],
+                name='order_pending_expiry_idx',
+                condition=models.Q(status='PENDING')
+            ),
+        ]
     
     def __str__(self):
         return f"Order #{self.order_number} - {self.customer.username}"
     
     def save(self, *args, **kwargs):
         if not self.order_number:
-            from datetime import datetime
-            date_str = datetime.now().strftime('%Y%m%d')
-            last_order = Order.objects.filter(order_number__startswith=f'SO-{date_str}').order_by('-order_number').first()
-            if last_order:
-                last_num = int(last_order.order_number.split('-')[-1])
-                self.order_number = f'SO-{date_str}-{str(last_num + 1).zfill(4)}'
-            else:
-                self.order_number = f'SO-{date_str}-0001'
+            from apps.core.sequences import next_document_number
+            self.order_number = next_document_number('SO', Order, 'order_number')
         super().save(*args, **kwargs)
 
 
@@ -130,19 +148,45 @@ class Invoice(models.Model):
     
     def save(self, *args, **kwargs):
         if not self.invoice_number:
-            from datetime import datetime
-            date_str = datetime.now().strftime('%Y%m%d')
-            last_inv = Invoice.objects.filter(invoice_number__startswith=f'INV-{date_str}').order_by('-invoice_number').first()
-            if last_inv:
-                last_num = int(last_inv.invoice_number.split('-')[-1])
-                self.invoice_number = f'INV-{date_str}-{str(last_num + 1).zfill(4)}'
-            else:
-                self.invoice_number = f'INV-{date_str}-0001'
+            from apps.core.sequences import next_document_number
+            self.invoice_number = next_document_number('INV', Invoice, 'invoice_number')
         
         self.balance = self.amount - self.paid_amount
         super().save(*args, **kwargs)
 
 
+class InvoiceDocument(models.Model):
+    """
+    Rendered invoice (HTML or PDF), reused for as long as the hash of the
+    data it was rendered from still matches (see apps.sales.documents)
+    """
+    
+    FORMAT_CHOICES = [
+        ('html', 'HTML'),
+        ('pdf', 'PDF'),
+    ]
+    
+    invoice = models.ForeignKey(
+        Invoice,
+        on_delete=models.CASCADE,
+        related_name='documents'
+    )
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    content_hash = models.CharField(
+        max_length=64,
+        help_text="SHA-256 of the rendering inputs; also the download's ETag"
+    )
+    content = models.BinaryField()
+    rendered_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ('invoice', 'format')
+        ordering = ['invoice_id', 'format']
+    
+    def __str__(self):
+        return f"Invoice #{self.invoice_id} {self.format} ({self.content_hash[:12]})"
+
+
 class Payment(models.Model):
     """Payment records for invoices"""
     
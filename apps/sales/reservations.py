@@ -0,0 +1,56 @@
+"""
+Reservation expiry
+
+Customer orders hold their stock reservation until reservation_expires_at.
+expire_batch() cancels a batch of expired PENDING orders in one short
+transaction:
+
+- the orders are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so orders
+  being confirmed or cancelled right now are skipped, never waited on
+- their lines are summed per (variant, store) in the database, so a
+  StockRecord shared by many expired orders is released with one write
+- the stock rows are locked in primary key order (same order as checkout)
+  and released with one bulk UPDATE
+"""
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Order, OrderItem
+
+
+def expire_batch(batch_size=500, now=None):
+    """
+    Cancel up to batch_size expired PENDING orders and release their
+    reservations. Returns the number of orders cancelled.
+    """
+    from apps.inventory import services
+
+    now = now or timezone.now()
+    with transaction.atomic():
+        order_ids = list(
+            Order.objects.select_for_update(skip_locked=True).filter(
+                status='PENDING',
+                reservation_expires_at__lte=now
+            ).order_by('reservation_expires_at').values_list('id', flat=True)[:batch_size]
+        )
+        if not order_ids:
+            return 0
+
+        releases = {
+            (row['variant'], row['order__store']): row['quantity']
+            for row in OrderItem.objects.filter(order_id__in=order_ids).values(
+                'variant', 'order__store'
+            ).annotate(quantity=Sum('quantity')).order_by()
+        }
+        records = services.lock_stock_pairs(releases)
+        services.release_many(records, releases)
+
+        Order.states.apply_many(Order.objects.filter(id__in=order_ids), 'cancel', updated_at=now)
+
+        by_store = {}
+        for variant_id, store_id in releases:
+            by_store.setdefault(store_id, []).append(variant_id)
+        for store_id, variant_ids in by_store.items():
+            services.stock_changed(store_id, variant_ids)
+    return len(order_ids)
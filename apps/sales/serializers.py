@@ -1,7 +1,12 @@
+from datetime import timedelta
+
 from rest_framework import serializers
+from django.conf import settings
 from django.db import transaction
+from django.utils import timezone
 from .models import Order, OrderItem, Invoice, Payment
-from apps.catalog.serializers import ProductVariantSerializer
+from apps.catalog.models import ProductVariant
+from apps.catalog.serializers import ProductVariantSerializer, PrefetchedVariantField, prefetch_variants
 from django.contrib.auth import get_user_model
 from apps.users.serializers import StoreSerializer
 
@@ -11,6 +16,7 @@ User = get_user_model()
 class OrderItemSerializer(serializers.ModelSerializer):
     """Serializer for order line items"""
     
+    variant = PrefetchedVariantField(queryset=ProductVariant.objects.all())
     variant_details = ProductVariantSerializer(source='variant', read_only=True)
     
     class Meta:
@@ -38,8 +44,6 @@ class OrderItemSerializer(serializers.ModelSerializer):
 class OrderSerializer(serializers.ModelSerializer):
     """Serializer for sales orders with stock reservation"""
     
-from apps.catalog.models import ProductVariant
-
 from apps.core.mixins import QuickAddValidationMixin
 
 class OrderSerializer(QuickAddValidationMixin, serializers.ModelSerializer):
@@ -77,6 +81,11 @@ class OrderSerializer(QuickAddValidationMixin, serializers.ModelSerializer):
     order_type_display = serializers.CharField(source='get_order_type_display', read_only=True)
     payment_status_display = serializers.CharField(source='get_payment_status_display', read_only=True)
 
+    def to_internal_value(self, data):
+        """Load all line-item variants with one query before field validation"""
+        prefetch_variants(self, data)
+        return super().to_internal_value(data)
+
     def validate(self, attrs):
         """Allow creating order via HTML form (Quick Add) or JSON (Items list)"""
         # Use Mixin to handle logic
@@ -122,11 +131,12 @@ class OrderSerializer(QuickAddValidationMixin, serializers.ModelSerializer):
             'payment_status', 'payment_status_display', 'items', 
             'quick_variant', 'quick_quantity',
             'confirm_url', 'cancel_url', 'details_url',
-            'created_by', 'created_by_name', 'notes', 'created_at', 'updated_at'
+            'created_by', 'created_by_name', 'notes', 'reservation_expires_at',
+            'created_at', 'updated_at'
         ]
         read_only_fields = [
-            'order_number', 'order_date', 'subtotal', 'total_amount',
-            'created_at', 'updated_at', 'created_by'
+            'order_number', 'status', 'order_date', 'subtotal', 'total_amount',
+            'reservation_expires_at', 'created_at', 'updated_at', 'created_by'
         ]
         
     def get_details_url(self, obj):
@@ -149,7 +159,8 @@ class OrderSerializer(QuickAddValidationMixin, serializers.ModelSerializer):
 
     @transaction.atomic
     def create(self, validated_data):
-        from apps.inventory.models import StockRecord, StockTransaction
+        from apps.inventory.models import StockTransaction
+        from apps.inventory import services
         
         items_data = validated_data.pop('items')
         user = self.context['request'].user
@@ -167,30 +178,37 @@ class OrderSerializer(QuickAddValidationMixin, serializers.ModelSerializer):
             
         store = validated_data['store']
         
+        requested = {}
+        for item_data in items_data:
+            variant = item_data['variant']
+            requested[variant.id] = requested.get(variant.id, 0) + item_data['quantity']
         
-        # Check stock availability first
+        # Hot (sharded) SKUs first take each line from one of their shards,
+        # which never waits on a lock. Every other stock row - including hot
+        # SKUs no single shard covers - is then locked in one query (primary
+        # key order) and checked
+        sharded = services.sharded_records(store, requested)
+        from_shards = services.reserve_from_shards(
+            sharded, {v: q for v, q in requested.items() if v in sharded}
+        )
+        stocks = services.lock_stock_records(store, [v for v in requested if v not in from_shards])
         for item_data in items_data:
             variant = item_data['variant']
-            quantity = item_data['quantity']
+            if variant.id in sharded:
+                continue
             
-            try:
-                stock = StockRecord.objects.select_for_update().get(
-                    variant=variant,
-                    location=store
-                )
-                if stock.available_quantity < quantity:
-                    raise serializers.ValidationError({
-                        'items': f'Insufficient stock for {variant.sku}. Available: {stock.available_quantity}'
-                    })
-            except StockRecord.DoesNotExist:
+            stock = stocks.get(variant.id)
+            if stock is None:
                 raise serializers.ValidationError({
                     'items': f'No stock available for {variant.sku} at {store.name}'
                 })
+            if stock.available_quantity < requested[variant.id]:
+                raise serializers.ValidationError({
+                    'items': f'Insufficient stock for {variant.sku}. Available: {stock.available_quantity}'
+                })
         
-        # Create order
-        order = Order.objects.create(**validated_data)
-        
-        # Create items, reserve stock, and calculate totals
+        # Price the lines in Python - bulk_create bypasses OrderItem.save()
+        items = []
         subtotal = 0
         for item_data in items_data:
             variant = item_data['variant']
@@ -202,34 +220,48 @@ class OrderSerializer(QuickAddValidationMixin, serializers.ModelSerializer):
             else:
                 price = variant.retail_price
             
-            item_data['unit_price'] = price
-            item = OrderItem.objects.create(order=order, **item_data)
-            subtotal += item.line_total
-            
-            # Reserve stock
-            stock = StockRecord.objects.select_for_update().get(
-                variant=variant,
-                location=store
-            )
-            stock.reserved_quantity += quantity
-            stock.save()
-            
-            # Create transaction for reservation
-            StockTransaction.objects.create(
-                variant=variant,
+            line_total = quantity * price
+            items.append(OrderItem(variant=variant, quantity=quantity, unit_price=price, line_total=line_total))
+            subtotal += line_total
+        
+        # Customer checkouts only hold their reservation for a limited time
+        ttl = settings.ORDER_RESERVATION_TTL_MINUTES
+        if user.role == 'CUSTOMER' and ttl > 0:
+            validated_data['reservation_expires_at'] = timezone.now() + timedelta(minutes=ttl)
+        
+        # Create order with totals already calculated
+        validated_data['subtotal'] = subtotal
+        validated_data['total_amount'] = subtotal - validated_data.get('discount', 0)
+        order = Order.objects.create(**validated_data)
+        
+        # Items, reservations and ledger rows in a constant number of queries
+        for item in items:
+            item.order = order
+        OrderItem.objects.bulk_create(items)
+        
+        # Hot SKU lines on their records may top up from the free shards
+        lines = {v: q for v, q in requested.items() if v not in from_shards}
+        lines.update(services.draw_from_shards(stocks, {v: q for v, q in lines.items() if v in sharded}))
+        try:
+            services.reserve_many(stocks, lines)
+        except services.InsufficientStock as exc:
+            raise serializers.ValidationError({'items': str(exc)})
+        
+        StockTransaction.objects.bulk_create([
+            StockTransaction(
+                variant=item.variant,
                 location=store,
-                transaction_type='OUT',
-                quantity=-quantity,  # Negative for reservation
+                transaction_type='RESERVE',
+                quantity=-item.quantity,  # Negative for reservation
                 reference_type='SO',
                 reference_id=order.id,
-                performed_by=self.context['request'].user,
+                performed_by=user,
                 notes=f"Reserved for Order #{order.order_number}"
             )
-        
-        # Update order totals
-        order.subtotal = subtotal
-        order.total_amount = subtotal - order.discount
-        order.save()
+            for item in items
+        ])
+        services.stock_changed(store, [v for v in requested if v not in from_shards])
+        services.shards_changed(store, from_shards)
         
         return order
     
@@ -294,6 +326,53 @@ class PaymentSerializer(serializers.ModelSerializer):
             order.payment_status = 'PAID'
         else:
             order.payment_status = 'PARTIAL'
-        order.save()
+        # Only the payment columns - a full save would write back a stale status
+        order.save(update_fields=['payment_status', 'updated_at'])
         
         return payment
+
+
+class AllocationLineSerializer(serializers.Serializer):
+    variant = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class AllocationRequestSerializer(serializers.Serializer):
+    """Cart to plan fulfillment for (see apps.sales.allocation)"""
+    
+    items = AllocationLineSerializer(many=True)
+    locations = serializers.ListField(
+        child=serializers.IntegerField(),
+        required=False,
+        help_text="Candidate store ids (default: all active stores)"
+    )
+    store = serializers.IntegerField(required=False, help_text="Preferred store")
+    create = serializers.BooleanField(default=False, help_text="Create one order per shipment")
+    customer = serializers.IntegerField(required=False)
+    order_type = serializers.ChoiceField(choices=Order.ORDER_TYPE_CHOICES, default='RETAIL')
+    
+    def validate_items(self, items):
+        if not items:
+            raise serializers.ValidationError('At least one item is required')
+        cart = {}
+        for item in items:
+            cart[item['variant']] = cart.get(item['variant'], 0) + item['quantity']
+        found = set(ProductVariant.objects.filter(id__in=cart, is_active=True).values_list('id', flat=True))
+        unknown = sorted(set(cart) - found)
+        if unknown:
+            raise serializers.ValidationError(f'Unknown variants: {unknown}')
+        return cart
+
+
+class BulkOrderActionSerializer(serializers.Serializer):
+    """Order ids for bulk_confirm / bulk_cancel / bulk_ship"""
+    
+    orders = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=1000
+    )
+    
+    def validate_orders(self, orders):
+        # Keep the caller's order, drop repeats
+        return list(dict.fromkeys(orders))
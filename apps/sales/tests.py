@@ -1,3 +1,558 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from django.db import connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory
+
+from apps.catalog.models import Category, Product, ProductVariant
+from apps.inventory import services
+from apps.inventory.models import StockRecord, StockShard, StockTransaction
+from apps.users.models import Store, CustomUser
+from apps.core.transitions import TransitionConflict
+from .models import Order, OrderItem
+from .serializers import OrderSerializer
+
+
+class OrderTestCase(TestCase):
+    """A store with 20 stocked variants, plus a helper that creates orders through the serializer"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.store = Store.objects.create(name='Main Store', code='MS-001', address='Mumbai')
+        cls.staff = CustomUser.objects.create(username='staff', role='SALES_STAFF', store=cls.store)
+        cls.customer = CustomUser.objects.create(username='buyer', role='CUSTOMER', is_approved=True)
+        category = Category.objects.create(name='Fabric')
+        product = Product.objects.create(name='Cotton Roll', category=category, base_price=100)
+        cls.variants = []
+        for i in range(20):
+            variant = ProductVariant.objects.create(
+                product=product,
+                sku=f'CR-{i:03d}',
+                retail_price=150,
+                wholesale_price=100,
+                min_wholesale_qty=1
+            )
+            StockRecord.objects.create(variant=variant, location=cls.store, quantity=1000)
+            cls.variants.append(variant)
+
+    def _create_order(self, line_count):
+        request = APIRequestFactory().post('/api/sales/orders/')
+        request.user = self.staff
+        serializer = OrderSerializer(
+            data={
+                'customer': self.customer.id,
+                'order_type': 'WHOLESALE',
+                'items': [
+                    {'variant': variant.id, 'quantity': 5}
+                    for variant in self.variants[:line_count]
+                ],
+            },
+            context={'request': request}
+        )
+        with CaptureQueriesContext(connection) as queries:
+            serializer.is_valid(raise_exception=True)
+            order = serializer.save()
+        return order, len(queries)
+
+
+class OrderCreateQueryCountTests(OrderTestCase):
+    """Order creation must run in a constant number of queries regardless of line count"""
+
+    def test_query_count_independent_of_line_count(self):
+        # The first order of the day also creates the document number counter
+        self._create_order(1)
+        _, small = self._create_order(2)
+        _, large = self._create_order(20)
+        self.assertEqual(small, large)
+
+    def test_bulk_created_lines_are_priced_and_reserved(self):
+        order, _ = self._create_order(3)
+
+        items = OrderItem.objects.filter(order=order)
+        self.assertEqual(items.count(), 3)
+        for item in items:
+            self.assertEqual(item.unit_price, item.variant.wholesale_price)
+            self.assertEqual(item.line_total, item.quantity * item.unit_price)
+        self.assertEqual(order.subtotal, sum(item.line_total for item in items))
+        self.assertEqual(order.total_amount, order.subtotal)
+
+        for variant in self.variants[:3]:
+            stock = StockRecord.objects.get(variant=variant, location=self.store)
+            self.assertEqual(stock.reserved_quantity, 5)
+        self.assertEqual(
+            StockTransaction.objects.filter(reference_type='SO', reference_id=order.id).count(),
+            3
+        )
+
+
+class OrderListQueryCountTests(OrderTestCase):
+    """The order listing runs the same queries whatever the page size"""
+
+    def test_query_count_independent_of_page_size(self):
+        for _ in range(20):
+            self._create_order(3)
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        # Request savepoint, COUNT(*), the page, its items, their variants and
+        # stock summaries, release
+        for page_size in (2, 20):
+            with self.assertNumQueries(7):
+                response = client.get(f'/api/sales/orders/?page_size={page_size}')
+            self.assertEqual(len(response.data['results']), page_size)
+        self.assertEqual(len(response.data['results'][0]['items']), 3)
+
+
+class BulkOrderTransitionTests(OrderTestCase):
+    """Bulk transitions run in a constant number of queries and report each order"""
+
+    def _orders(self, count):
+        return [self._create_order(2)[0].id for _ in range(count)]
+
+    def test_bulk_confirm_query_count_independent_of_order_count(self):
+        from .bulk import bulk_confirm
+
+        self._create_order(1)
+        small, large = self._orders(2), self._orders(10)
+        with CaptureQueriesContext(connection) as few:
+            bulk_confirm(small, self.staff)
+        with CaptureQueriesContext(connection) as many:
+            bulk_confirm(large, self.staff)
+        self.assertEqual(len(few), len(many))
+
+    def test_bulk_confirm_then_cancel_moves_stock(self):
+        from .bulk import bulk_cancel, bulk_confirm
+
+        order_ids = self._orders(3)
+        results = bulk_confirm(order_ids + [0], self.staff)
+        self.assertEqual([result['success'] for result in results], [True, True, True, False])
+
+        stock = StockRecord.objects.get(variant=self.variants[0], location=self.store)
+        self.assertEqual((stock.quantity, stock.reserved_quantity), (985, 0))
+
+        results = bulk_cancel(order_ids, self.staff)
+        self.assertTrue(all(result['success'] for result in results))
+        stock.refresh_from_db()
+        self.assertEqual((stock.quantity, stock.reserved_quantity), (1000, 0))
+
+
+class ReservationExpiryTests(OrderTestCase):
+    """Expired PENDING orders are cancelled in batches and their stock released"""
+
+    def _expired_order(self, minutes_ago=1):
+        order, _ = self._create_order(2)
+        Order.objects.filter(pk=order.pk).update(
+            reservation_expires_at=timezone.now() - timedelta(minutes=minutes_ago)
+        )
+        return order
+
+    def _reserved(self, variant):
+        return StockRecord.objects.get(variant=variant, location=self.store).reserved_quantity
+
+    def test_customer_checkout_sets_expiry(self):
+        request = APIRequestFactory().post('/api/sales/orders/')
+        request.user = self.customer
+        serializer = OrderSerializer(
+            data={'store': self.store.id, 'items': [{'variant': self.variants[0].id, 'quantity': 1}]},
+            context={'request': request}
+        )
+        serializer.is_valid(raise_exception=True)
+        with override_settings(ORDER_RESERVATION_TTL_MINUTES=15):
+            order = serializer.save()
+        self.assertAlmostEqual(
+            order.reservation_expires_at, timezone.now() + timedelta(minutes=15), delta=timedelta(minutes=1)
+        )
+        # Staff orders are held until someone acts on them
+        self.assertIsNone(self._create_order(1)[0].reservation_expires_at)
+
+    def test_expired_orders_are_cancelled_and_released(self):
+        from .reservations import expire_batch
+
+        expired = [self._expired_order(minutes_ago) for minutes_ago in (1, 2, 3)]
+        live = self._expired_order(minutes_ago=-10)
+        confirmed = self._expired_order()
+        Order.states.apply(confirmed, 'confirm')
+        self.assertEqual(self._reserved(self.variants[0]), 25)
+
+        # Oldest expiry first, batch_size at a time
+        self.assertEqual(expire_batch(batch_size=2), 2)
+        self.assertEqual(
+            dict(Order.objects.filter(pk__in=[order.pk for order in expired]).values_list('pk', 'status')),
+            {expired[0].pk: 'PENDING', expired[1].pk: 'CANCELLED', expired[2].pk: 'CANCELLED'}
+        )
+        self.assertEqual(expire_batch(batch_size=2), 1)
+        self.assertEqual(expire_batch(batch_size=2), 0)
+
+        self.assertEqual(Order.objects.get(pk=live.pk).status, 'PENDING')
+        self.assertEqual(Order.objects.get(pk=confirmed.pk).status, 'CONFIRMED')
+        self.assertEqual(self._reserved(self.variants[0]), 10)
+        self.assertEqual(self._reserved(self.variants[1]), 10)
+
+    def test_query_count_independent_of_batch_size(self):
+        from .reservations import expire_batch
+
+        self._expired_order()
+        with CaptureQueriesContext(connection) as few:
+            expire_batch()
+        for _ in range(8):
+            self._expired_order()
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(expire_batch(), 8)
+        self.assertEqual(len(few), len(many))
+
+
+class AllocationTests(OrderTestCase):
+    """Carts ship from one store when any store covers them, otherwise from as few as possible"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.north = Store.objects.create(name='North', code='N-001', address='Delhi')
+        cls.south = Store.objects.create(name='South', code='S-001', address='Chennai')
+        for variant in cls.variants[:3]:
+            StockRecord.objects.create(variant=variant, location=cls.north, quantity=40)
+        StockRecord.objects.create(variant=cls.variants[3], location=cls.south, quantity=2500)
+        cls.dispatcher = CustomUser.objects.create(username='dispatcher', role='SALES_STAFF')
+
+    def _cart(self, *quantities):
+        return {variant.id: quantity for variant, quantity in zip(self.variants, quantities) if quantity}
+
+    def test_single_store_prefers_preferred_then_most_stock(self):
+        from .allocation import allocate
+
+        cart = self._cart(10, 10)
+        plan = allocate(cart, preferred_location=self.north.id)
+        self.assertEqual(plan, {'shipments': [(self.north.id, cart)], 'unfulfilled': {}})
+        plan = allocate(cart)
+        self.assertEqual(plan['shipments'], [(self.store.id, cart)])
+
+    def test_split_covers_most_units_first_and_reports_shortfall(self):
+        from .allocation import allocate
+
+        # The south covers 2500 units, the main store 2000, the north 10
+        plan = allocate(self._cart(1010, 0, 0, 2500))
+        self.assertEqual(plan['shipments'], [
+            (self.south.id, {self.variants[3].id: 2500}),
+            (self.store.id, {self.variants[0].id: 1000}),
+            (self.north.id, {self.variants[0].id: 10}),
+        ])
+        self.assertEqual(plan['unfulfilled'], {})
+
+        plan = allocate(self._cart(1100), locations=[self.store.id, self.north.id])
+        self.assertEqual(plan['unfulfilled'], {self.variants[0].id: 60})
+
+    def test_allocate_endpoint_creates_one_order_per_shipment(self):
+        client = APIClient()
+        client.force_authenticate(self.dispatcher)
+        response = client.post('/api/sales/orders/allocate/', {
+            'customer': self.customer.id,
+            'create': True,
+            'items': [
+                {'variant': self.variants[0].id, 'quantity': 1010},
+                {'variant': self.variants[1].id, 'quantity': 5},
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.data['split'])
+        orders = Order.objects.filter(customer=self.customer).order_by('store_id')
+        self.assertEqual([order.store_id for order in orders], [self.store.id, self.north.id])
+        reserved = dict(
+            StockRecord.objects.filter(variant=self.variants[0]).values_list('location_id', 'reserved_quantity')
+        )
+        self.assertEqual(reserved, {self.store.id: 1000, self.north.id: 10})
+
+    def test_unfulfillable_cart_creates_nothing(self):
+        client = APIClient()
+        client.force_authenticate(self.dispatcher)
+        response = client.post('/api/sales/orders/allocate/', {
+            'customer': self.customer.id,
+            'create': True,
+            'items': [{'variant': self.variants[4].id, 'quantity': 5000}],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['unfulfilled'][0]['quantity'], 4000)
+        self.assertFalse(Order.objects.exists())
+
+
+class ShardedCheckoutTests(OrderTestCase):
+    """Hot SKU lines come from shards; every stock row a checkout waits for is locked in one ordered query"""
+
+    def setUp(self):
+        self.hot = self.variants[0]
+        StockRecord.objects.filter(variant=self.hot, location=self.store).update(shard_count=4)
+        services.rebalance_shards(StockRecord.objects.get(variant=self.hot, location=self.store))
+
+    def _checkout(self, lines):
+        request = APIRequestFactory().post('/api/sales/orders/')
+        request.user = self.staff
+        serializer = OrderSerializer(
+            data={
+                'customer': self.customer.id,
+                'order_type': 'WHOLESALE',
+                'items': [{'variant': variant.id, 'quantity': quantity} for variant, quantity in lines],
+            },
+            context={'request': request}
+        )
+        serializer.is_valid(raise_exception=True)
+        with CaptureQueriesContext(connection) as queries:
+            serializer.save()
+        return [
+            query['sql'] for query in queries
+            if 'FROM "inventory_stockrecord"' in query['sql']
+            and 'ORDER BY "inventory_stockrecord"."id" ASC' in query['sql']
+        ]
+
+    def _true_available(self, variant):
+        return StockRecord.objects.with_shard_stock().get(variant=variant, location=self.store).true_available
+
+    def test_line_a_shard_covers_leaves_the_record_unlocked(self):
+        locks = self._checkout([(self.hot, 5), (self.variants[1], 5)])
+        self.assertEqual(len(locks), 1)
+        self.assertEqual(sum(StockShard.objects.values_list('reserved', flat=True)), 5)
+        self.assertEqual(self._true_available(self.hot), 995)
+
+    def test_fallback_line_is_locked_with_the_other_rows(self):
+        hot_record = StockRecord.objects.get(variant=self.hot, location=self.store)
+        # No shard holds 600 units: the record is locked with variants[1]'s, and the free shards top it up
+        locks = self._checkout([(self.variants[1], 5), (self.hot, 600)])
+        self.assertEqual(len(locks), 1)
+        self.assertIn(str(hot_record.pk), locks[0])
+        self.assertEqual(self._true_available(self.hot), 400)
+        self.assertEqual(self._true_available(self.variants[1]), 995)
+
+
+@skipUnless(connection.features.has_select_for_update_skip_locked, 'needs row locks')
+class ShardedCheckoutConcurrencyTests(TransactionTestCase):
+    """A checkout holding a shard lock and a transfer holding the records both finish"""
+
+    def setUp(self):
+        self.store = Store.objects.create(name='Main Store', code='MS-001', address='Mumbai')
+        self.other_store = Store.objects.create(name='Second Store', code='SS-001', address='Pune')
+        self.staff = CustomUser.objects.create(username='staff', role='SALES_STAFF', store=self.store)
+        self.customer = CustomUser.objects.create(username='buyer', role='CUSTOMER', is_approved=True)
+        category = Category.objects.create(name='Fabric')
+        product = Product.objects.create(name='Cotton Roll', category=category, base_price=100)
+        self.hot, self.cold = [
+            ProductVariant.objects.create(
+                product=product, sku=sku, retail_price=150, wholesale_price=100, min_wholesale_qty=1
+            )
+            for sku in ('HOT-1', 'COLD-1')
+        ]
+        StockRecord.objects.create(variant=self.hot, location=self.store, quantity=100, shard_count=4)
+        StockRecord.objects.create(variant=self.cold, location=self.store, quantity=100)
+        services.rebalance_shards(StockRecord.objects.get(variant=self.hot))
+
+    def test_checkout_and_transfer_do_not_deadlock(self):
+        shard_held, records_locked = threading.Event(), threading.Event()
+        errors = []
+        reserve_from_shards = services.reserve_from_shards
+
+        def hold_shard(*args):
+            served = reserve_from_shards(*args)
+            shard_held.set()
+            records_locked.wait(5)
+            return served
+
+        def checkout():
+            try:
+                request = APIRequestFactory().post('/api/sales/orders/')
+                request.user = self.staff
+                serializer = OrderSerializer(
+                    data={
+                        'customer': self.customer.id,
+                        'order_type': 'WHOLESALE',
+                        'items': [{'variant': self.hot.id, 'quantity': 1}, {'variant': self.cold.id, 'quantity': 1}],
+                    },
+                    context={'request': request}
+                )
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        def transfer():
+            try:
+                shard_held.wait(5)
+                with transaction.atomic():
+                    records = services.lock_stock_pairs([(self.hot, self.store), (self.cold, self.store)])
+                    records_locked.set()
+                    services.move_many(records, {(self.hot.id, self.store.pk): -10, (self.cold.id, self.store.pk): -10})
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                records_locked.set()
+                connections.close_all()
+
+        with patch.object(services, 'reserve_from_shards', hold_shard):
+            threads = [threading.Thread(target=checkout), threading.Thread(target=transfer)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(30)
+        self.assertEqual(errors, [])
+        self.assertEqual(Order.objects.count(), 1)
+        hot = StockRecord.objects.with_shard_stock().get(variant=self.hot)
+        cold = StockRecord.objects.get(variant=self.cold)
+        self.assertEqual((hot.quantity, hot.true_available), (90, 89))
+        self.assertEqual((cold.quantity, cold.available_quantity), (90, 89))
+
+
+class OrderStateMachineTests(OrderTestCase):
+    """Transitions are conditional UPDATEs: a stale copy of the order can't move it"""
+
+    def test_transition_from_stale_status_conflicts(self):
+        order, _ = self._create_order(1)
+        stale = Order.objects.get(pk=order.pk)
+        Order.states.apply(order, 'cancel')
+
+        with self.assertRaises(TransitionConflict) as raised:
+            Order.states.apply(stale, 'confirm')
+        self.assertEqual(raised.exception.current, 'CANCELLED')
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'CANCELLED')
+
+    def test_apply_many_skips_rows_outside_source_statuses(self):
+        first, second = self._create_order(1)[0], self._create_order(1)[0]
+        Order.states.apply(first, 'cancel')
+
+        updated = Order.states.apply_many(Order.objects.filter(pk__in=[first.pk, second.pk]), 'confirm')
+        self.assertEqual(updated, 1)
+        self.assertEqual(Order.objects.get(pk=second.pk).status, 'CONFIRMED')
+
+
+    def test_apply_from_reports_the_source_status(self):
+        pending, confirmed = self._create_order(1)[0], self._create_order(1)[0]
+        Order.states.apply(confirmed, 'confirm')
+        stale = Order.objects.get(pk=pending.pk)
+
+        self.assertEqual(Order.states.apply_from(pending, 'cancel'), 'PENDING')
+        self.assertEqual(Order.states.apply_from(confirmed, 'cancel'), 'CONFIRMED')
+        self.assertEqual(pending.status, 'CANCELLED')
+        with self.assertRaises(TransitionConflict) as raised:
+            Order.states.apply_from(stale, 'cancel')
+        self.assertEqual(raised.exception.current, 'CANCELLED')
+
+    def test_cancel_undoes_what_the_source_status_held(self):
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        pending, confirmed = self._create_order(1)[0], self._create_order(1)[0]
+        client.post(f'/api/sales/orders/{confirmed.pk}/confirm/')
+        self.assertEqual(
+            StockRecord.objects.filter(variant=self.variants[0], location=self.store).values_list(
+                'quantity', 'reserved_quantity'
+            ).get(),
+            (995, 5)
+        )
+
+        for order in (pending, confirmed):
+            with CaptureQueriesContext(connection) as queries:
+                response = client.post(f'/api/sales/orders/{order.pk}/cancel/')
+            self.assertEqual(response.data['status'], 'CANCELLED')
+            # Read without a row lock; the status CAS is the only write to the order
+            order_queries = [query['sql'] for query in queries if 'FROM "sales_order"' in query['sql']]
+            self.assertFalse([sql for sql in order_queries if 'FOR UPDATE' in sql])
+        self.assertEqual(
+            StockRecord.objects.filter(variant=self.variants[0], location=self.store).values_list(
+                'quantity', 'reserved_quantity'
+            ).get(),
+            (1000, 0)
+        )
+        self.assertEqual(
+            StockTransaction.objects.filter(reference_id=confirmed.pk, transaction_type='RETURN').count(), 1
+        )
+        self.assertEqual(client.post(f'/api/sales/orders/{pending.pk}/cancel/').status_code, 409)
+
+class IdempotentOrderCreateTests(OrderTestCase):
+    """A retried create with the same Idempotency-Key replays the first response"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        self.body = {'customer': self.customer.id, 'items': [{'variant': self.variants[0].id, 'quantity': 5}]}
+
+    def _post(self, body, key):
+        return self.client.post('/api/sales/orders/', body, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_without_creating_again(self):
+        first = self._post(self.body, 'pos-1')
+        with CaptureQueriesContext(connection) as queries:
+            retry = self._post(self.body, 'pos-1')
+
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.data['id'], first.data['id'])
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        statements = [query['sql'] for query in queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(Order.objects.count(), 1)
+        stock = StockRecord.objects.get(variant=self.variants[0], location=self.store)
+        self.assertEqual(stock.reserved_quantity, 5)
+
+    def test_key_reused_for_different_body_is_rejected(self):
+        self._post(self.body, 'pos-1')
+        response = self._post({**self.body, 'notes': 'changed'}, 'pos-1')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class InvoiceJobTests(OrderTestCase):
+    """Confirming orders queues their invoices; a worker creates them"""
+
+    def test_confirm_queues_invoice_created_by_worker(self):
+        from apps.core import jobs
+        from .bulk import bulk_cancel, bulk_confirm
+        from .models import Invoice
+
+        order_ids = [self._create_order(2)[0].id for _ in range(2)]
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_confirm(order_ids, self.staff)
+        bulk_cancel(order_ids[1:], self.staff)
+
+        while jobs.run_next():
+            pass
+        invoice = Invoice.objects.get()
+        self.assertEqual(invoice.order_id, order_ids[0])
+        self.assertEqual(invoice.amount, Order.objects.get(pk=order_ids[0]).total_amount)
+
+
+class InvoiceDocumentTests(OrderTestCase):
+    """Invoice downloads are rendered once per content hash and revalidated by ETag"""
+
+    def setUp(self):
+        from datetime import date
+        from .models import Invoice
+
+        order, _ = self._create_order(3)
+        self.invoice = Invoice.objects.create(order=order, due_date=date(2030, 1, 31), amount=order.total_amount)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        self.url = f'/api/sales/invoices/{self.invoice.id}/document/'
+
+    def test_unchanged_invoice_is_not_rendered_again(self):
+        from .models import InvoiceDocument
+
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first['Content-Type'], 'application/pdf')
+        self.assertTrue(first.content.startswith(b'%PDF-'))
+
+        with patch('apps.sales.documents.render_pdf') as render_pdf:
+            again = self.client.get(self.url)
+            revalidated = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        render_pdf.assert_not_called()
+        self.assertEqual(again.content, first.content)
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(InvoiceDocument.objects.count(), 1)
+
+    def test_payment_changes_etag(self):
+        first = self.client.get(self.url, {'type': 'html'})
+        self.invoice.paid_amount = 10
+        self.invoice.save()
+
+        after = self.client.get(self.url, {'type': 'html'}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(after.status_code, 200)
+        self.assertNotEqual(after['ETag'], first['ETag'])
@@ -3,11 +3,18 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.db import transaction
+from apps.core.transitions import TransitionConflict
 from .models import Order, Invoice, Payment
-from .serializers import OrderSerializer, InvoiceSerializer, PaymentSerializer
+from .serializers import (
+    OrderSerializer, InvoiceSerializer, PaymentSerializer, AllocationRequestSerializer,
+    BulkOrderActionSerializer
+)
 from apps.users.permissions import IsSalesStaff, IsCustomer
+from apps.core.exports import EXPORT_RENDERERS, export_response, parse_date_range
+from apps.core.pagination import KeysetPagination
+from apps.core.mixins import IdempotentCreateMixin
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(IdempotentCreateMixin, viewsets.ModelViewSet):
     """
     CRUD operations for sales orders
     Create: Sales staff, managers, admins, AND approved customers
@@ -16,12 +23,14 @@ class OrderViewSet(viewsets.ModelViewSet):
     """
     queryset = Order.objects.all().select_related(
         'customer', 'store', 'created_by'
-    ).prefetch_related('items__variant')
+    ).prefetch_related('items__variant__stock_summary')
     serializer_class = OrderSerializer
+    pagination_class = KeysetPagination
+    keyset_field = 'created_at'
     filterset_fields = ['customer', 'store', 'order_type', 'status', 'payment_status']
     search_fields = ['order_number', 'customer__username']
     ordering_fields = ['order_date', 'total_amount', 'created_at']
-    ordering = ['-created_at']
+    ordering = ['-created_at', '-id']
     
     def get_permissions(self):
         """
@@ -44,8 +53,9 @@ class OrderViewSet(viewsets.ModelViewSet):
     @transaction.atomic
     def perform_destroy(self, instance):
         """Release stock reservation when order is deleted"""
-        from apps.inventory.models import StockRecord
+        from apps.inventory import services
         
+        instance = Order.objects.select_for_update().get(pk=instance.pk)
         if instance.status not in ['PENDING', 'CANCELLED']:
             # Prevent deleting confirmed orders to maintain audit trail
             # (In a real app, this should return 400, but perform_destroy returns None. 
@@ -54,16 +64,11 @@ class OrderViewSet(viewsets.ModelViewSet):
 
         # Release reservations if PENDING
         if instance.status == 'PENDING':
-            for item in instance.items.all():
-                try:
-                    stock = StockRecord.objects.select_for_update().get(
-                        variant=item.variant,
-                        location=instance.store
-                    )
-                    stock.reserved_quantity = max(0, stock.reserved_quantity - item.quantity)
-                    stock.save()
-                except StockRecord.DoesNotExist:
-                    pass
+            items = list(instance.items.all())
+            services.lock_stock_records(instance.store, [item.variant_id for item in items])
+            for item in items:
+                services.release(item.variant, instance.store, item.quantity)
+            services.stock_changed(instance.store, [item.variant_id for item in items])
         
         instance.delete()
     
@@ -81,34 +86,129 @@ class OrderViewSet(viewsets.ModelViewSet):
         # Suppliers and others see nothing
         return queryset.none()
     
-    @action(detail=True, methods=['post'], permission_classes=[IsSalesStaff])
+    @action(detail=False, methods=['get'], renderer_classes=EXPORT_RENDERERS)
+    def export(self, request, format=None):
+        """
+        Stream orders as CSV or NDJSON
+        ?format=csv|ndjson&from=YYYY-MM-DD&to=YYYY-MM-DD plus the list filters
+        """
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            **parse_date_range(request, 'created_at')
+        ).order_by('created_at', 'id')
+        return export_response(queryset, [
+            ('id', 'id'),
+            ('order_number', 'order_number'),
+            ('created_at', 'created_at'),
+            ('order_type', 'order_type'),
+            ('status', 'status'),
+            ('customer', 'customer__username'),
+            ('store', 'store__code'),
+            ('subtotal', 'subtotal'),
+            ('discount', 'discount'),
+            ('total_amount', 'total_amount'),
+            ('payment_status', 'payment_status'),
+            ('delivery_date', 'delivery_date'),
+            ('created_by', 'created_by__username'),
+        ], request.accepted_renderer.format, 'orders')
+    
+    @action(detail=False, methods=['post'], permission_classes=[IsSalesStaff | IsCustomer])
     @transaction.atomic
-    def confirm(self, request, pk=None):
+    def allocate(self, request):
         """
-        Confirm order - decrement stock, release reservation
+        Plan which stores fulfil a cart - one store if possible, otherwise a
+        split across as few as possible. With "create": true, one order is
+        created per shipment in a single transaction.
         """
-        from apps.inventory.models import StockRecord, StockTransaction
+        from apps.catalog.models import ProductVariant
+        from apps.users.models import Store
+        from .allocation import allocate
         
-        order = self.get_object()
+        params = AllocationRequestSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        data = params.validated_data
+        
+        plan = allocate(data['items'], data.get('locations'), data.get('store') or request.user.store_id)
+        
+        skus = dict(ProductVariant.objects.filter(id__in=data['items']).values_list('id', 'sku'))
+        stores = Store.objects.in_bulk([location for location, _ in plan['shipments']])
+        response = {
+            'fulfillable': not plan['unfulfilled'],
+            'split': len(plan['shipments']) > 1,
+            'shipments': [
+                {
+                    'store': location,
+                    'store_name': stores[location].name,
+                    'items': [
+                        {'variant': variant_id, 'sku': skus[variant_id], 'quantity': qty}
+                        for variant_id, qty in lines.items()
+                    ],
+                }
+                for location, lines in plan['shipments']
+            ],
+            'unfulfilled': [
+                {'variant': variant_id, 'sku': skus[variant_id], 'quantity': qty}
+                for variant_id, qty in plan['unfulfilled'].items()
+            ],
+        }
+        if not data['create']:
+            return Response(response)
         
-        if order.status != 'PENDING':
+        if plan['unfulfilled']:
             return Response(
-                {'error': 'Only PENDING orders can be confirmed'},
+                {'error': 'Cart cannot be fully allocated', **response},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        # Process each item: decrement quantity, release reservation
-        for item in order.items.all():
-            stock = StockRecord.objects.select_for_update().get(
-                variant=item.variant,
-                location=order.store
+        if request.user.store and any(location != request.user.store_id for location, _ in plan['shipments']):
+            return Response(
+                {'error': 'Staff assigned to a store can only create orders for that store', **response},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            
-            # Decrement actual quantity
-            stock.quantity -= item.quantity
-            # Release reservation
-            stock.reserved_quantity -= item.quantity
-            stock.save()
+        
+        orders = []
+        for location, lines in plan['shipments']:
+            order_data = {
+                'store': location,
+                'order_type': data['order_type'],
+                'items': [{'variant': variant_id, 'quantity': qty} for variant_id, qty in lines.items()],
+            }
+            if 'customer' in data:
+                order_data['customer'] = data['customer']
+            serializer = self.get_serializer(data=order_data)
+            # Stock may have moved since planning - any failure rolls back every order
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            orders.append(serializer.data)
+        response['orders'] = orders
+        return Response(response, status=status.HTTP_201_CREATED)
+    
+    @action(detail=True, methods=['post'], permission_classes=[IsSalesStaff])
+    @transaction.atomic
+    def confirm(self, request, pk=None):
+        """
+        Confirm order - decrement stock, release reservation.
+        The invoice is created by a background job once this commits.
+        """
+        from apps.core.jobs import enqueue_on_commit
+        from apps.inventory.models import StockTransaction
+        from apps.inventory import services, valuation
+        
+        # The transition's UPDATE holds the order row until commit, so
+        # expire_reservations skips it and a racing cancel gets a conflict
+        order = self.get_object()
+        try:
+            Order.states.apply(order, 'confirm')
+        except TransitionConflict as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
+        
+        # Lock all stock rows up front, then decrement quantity and release reservation
+        items = list(order.items.all())
+        services.lock_stock_records(order.store, [item.variant_id for item in items])
+        for item in items:
+            try:
+                services.confirm_sale(item.variant, order.store, item.quantity)
+            except services.InsufficientStock as exc:
+                transaction.set_rollback(True)
+                return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
             
             #Create stock transaction for sale
             StockTransaction.objects.create(
@@ -121,10 +221,12 @@ class OrderViewSet(viewsets.ModelViewSet):
                 performed_by=request.user,
                 notes=f"Order #{order.order_number} confirmed"
             )
-        
-        # Update order status
-        order.status = 'CONFIRMED'
-        order.save()
+        services.stock_changed(order.store, [item.variant_id for item in items])
+        valuation.issue(
+            [(item.variant_id, order.store_id, item.quantity) for item in items],
+            'SALE', 'SO', order.id
+        )
+        enqueue_on_commit('sales.create_invoice', order_id=order.id)
         
         serializer = self.get_serializer(order)
         return Response(serializer.data)
@@ -135,79 +237,102 @@ class OrderViewSet(viewsets.ModelViewSet):
         """
         Cancel order - release stock reservations
         """
-        from apps.inventory.models import StockRecord
+        from apps.inventory.models import StockTransaction
+        from apps.inventory import services, valuation
         
         order = self.get_object()
+        try:
+            previous = Order.states.apply_from(order, 'cancel')
+        except TransitionConflict as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
         
-        if order.status not in ['PENDING', 'CONFIRMED']:
-            return Response(
-                {'error': 'Only PENDING or CONFIRMED orders can be cancelled'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Release stock reservations
-        for item in order.items.all():
-            stock = StockRecord.objects.select_for_update().get(
-                variant=item.variant,
-                location=order.store
-            )
-            
-            if order.status == 'PENDING':
+        # Lock all stock rows up front, then release reservations
+        items = list(order.items.all())
+        services.lock_stock_records(order.store, [item.variant_id for item in items])
+        for item in items:
+            if previous == 'PENDING':
                 # Just release reservation
-                stock.reserved_quantity -= item.quantity
+                services.release(item.variant, order.store, item.quantity)
             else:  # CONFIRMED
-                # Add back to quantity and release reservation
-                stock.quantity += item.quantity
-                stock.reserved_quantity -= item.quantity
-            
-            stock.save()
+                # Reservation was already released on confirm - put units back on hand
+                services.restock(item.variant, order.store, item.quantity)
         
-        # Update order status
-        order.status = 'CANCELLED'
-        order.save()
+        if previous == 'CONFIRMED':
+            StockTransaction.objects.bulk_create([
+                StockTransaction(
+                    variant=item.variant,
+                    location=order.store,
+                    transaction_type='RETURN',
+                    quantity=item.quantity,
+                    reference_type='SO',
+                    reference_id=order.id,
+                    performed_by=request.user,
+                    notes=f"Order #{order.order_number} cancelled"
+                )
+                for item in items
+            ])
+            # Returned units go back at the cost they were sold at
+            valuation.receive_issued('SO', order.id, 'SALE', 'RETURN')
+        services.stock_changed(order.store, [item.variant_id for item in items])
         
         serializer = self.get_serializer(order)
         return Response(serializer.data)
     
-    @action(detail=True, methods=['post'], permission_classes=[IsSalesStaff])
-    def mark_shipped(self, request, pk=None):
-        """Mark order as shipped"""
+    def _bulk(self, request, run, *args):
+        """Run a bulk transition over {"orders": [ids]} and report each order"""
+        serializer = BulkOrderActionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = run(serializer.validated_data['orders'], *args)
+        succeeded = sum(1 for result in results if result['success'])
+        return Response({
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'results': results,
+        })
+    
+    @action(detail=False, methods=['post'], permission_classes=[IsSalesStaff])
+    def bulk_confirm(self, request):
+        """Confirm many PENDING orders with aggregated stock movements"""
+        from .bulk import bulk_confirm
+        return self._bulk(request, bulk_confirm, request.user)
+    
+    @action(detail=False, methods=['post'], permission_classes=[IsSalesStaff])
+    def bulk_cancel(self, request):
+        """Cancel many PENDING or CONFIRMED orders with aggregated stock movements"""
+        from .bulk import bulk_cancel
+        return self._bulk(request, bulk_cancel, request.user)
+    
+    @action(detail=False, methods=['post'], permission_classes=[IsSalesStaff])
+    def bulk_ship(self, request):
+        """Mark many CONFIRMED orders as shipped"""
+        from .bulk import bulk_ship
+        return self._bulk(request, bulk_ship)
+    
+    def _transition(self, name):
+        """Apply a status-only transition; 409 if the order isn't in a status it starts from"""
         order = self.get_object()
-        
-        if order.status != 'CONFIRMED':
-            return Response(
-                {'error': 'Only CONFIRMED orders can be shipped'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        order.status = 'SHIPPED'
-        order.save()
-        
+        try:
+            Order.states.apply(order, name)
+        except TransitionConflict as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
         serializer = self.get_serializer(order)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['post'], permission_classes=[IsSalesStaff])
+    def mark_shipped(self, request, pk=None):
+        """Mark CONFIRMED order as shipped"""
+        return self._transition('ship')
+    
     @action(detail=True, methods=['post'], permission_classes=[IsSalesStaff])
     def mark_delivered(self, request, pk=None):
-        """Mark order as delivered"""
-        order = self.get_object()
-        
-        if order.status != 'SHIPPED':
-            return Response(
-                {'error': 'Only SHIPPED orders can be delivered'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        order.status = 'DELIVERED'
-        order.save()
-        
-        serializer = self.get_serializer(order)
-        return Response(serializer.data)
+        """Mark SHIPPED order as delivered"""
+        return self._transition('deliver')
 
 
 class InvoiceViewSet(viewsets.ModelViewSet):
     """
 Fixed operations for invoices
-    Automatically created for confirmed orders
+    Automatically created for confirmed orders (sales.create_invoice job)
     """
     queryset = Invoice.objects.all().select_related('order__customer')
     serializer_class = InvoiceSerializer
@@ -216,9 +341,55 @@ Fixed operations for invoices
     search_fields = ['invoice_number', 'order__order_number']
     ordering_fields = ['invoice_date', 'due_date', 'amount']
     ordering = ['-invoice_date']
+    
+    def get_queryset(self):
+        """Staff see all invoices, customers (document downloads) their own"""
+        user = self.request.user
+        queryset = super().get_queryset()
+        if self.action == 'document':
+            from .documents import with_document_data
+            queryset = with_document_data(queryset)
+        
+        if user.role in ['ADMIN', 'STORE_MANAGER', 'SALES_STAFF']:
+            return queryset
+        elif user.role == 'CUSTOMER':
+            return queryset.filter(order__customer=user)
+        return queryset.none()
+    
+    @action(detail=True, methods=['get'], permission_classes=[IsSalesStaff | IsCustomer])
+    def document(self, request, pk=None):
+        """
+        Download the invoice, ?type=pdf (default) or html.
+        Rendered once per content hash and served with it as a strong ETag;
+        a matching If-None-Match gets 304 Not Modified.
+        """
+        from django.http import HttpResponse, HttpResponseNotModified
+        from django.utils.http import parse_etags
+        from .documents import CONTENT_TYPES, content_hash, document, invoice_context
+        
+        fmt = request.query_params.get('type', 'pdf')
+        if fmt not in CONTENT_TYPES:
+            return Response(
+                {'error': f"type must be one of {', '.join(CONTENT_TYPES)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        invoice = self.get_object()
+        context = invoice_context(invoice)
+        etag = f'"{content_hash(context, fmt)}"'
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        else:
+            _, content = document(invoice, fmt, context)
+            response = HttpResponse(content, content_type=CONTENT_TYPES[fmt])
+            response['Content-Disposition'] = f'inline; filename="{invoice.invoice_number}.{fmt}"'
+        response['ETag'] = etag
+        # Cacheable by the client only, revalidated on every use
+        response['Cache-Control'] = 'private, no-cache'
+        return response
 
 
-class PaymentViewSet(viewsets.ModelViewSet):
+class PaymentViewSet(IdempotentCreateMixin, viewsets.ModelViewSet):
     """
     CRUD operations for payments
     Recording payment updates invoice and order payment status
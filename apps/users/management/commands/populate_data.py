@@ -7,6 +7,7 @@ from django.utils import timezone
 from apps.users.models import CustomUser, Store
 from apps.catalog.models import Category, Product, ProductVariant
 from apps.inventory.models import StockRecord, StockTransaction
+from apps.inventory import services
 from apps.purchasing.models import Supplier, PurchaseOrder, PurchaseOrderItem
 from apps.sales.models import Order, OrderItem
 import random
@@ -177,6 +178,7 @@ class Command(BaseCommand):
                 location=warehouse,
                 defaults={'quantity': 500, 'reserved_quantity': 0}
             )
+        services.refresh_variant_summaries(variants_created)
 
         # 6. Supplier
         self.stdout.write('Creating supplier profile...')
@@ -249,10 +251,8 @@ class Command(BaseCommand):
                     line_total=line_total
                 )
                 
-                # Reserve stock (mimicking the serializer logic)
-                stock = StockRecord.objects.get(variant=variant, location=main_store)
-                stock.reserved_quantity += qty
-                stock.save()
+                # Reserve stock (same path as the serializer)
+                services.reserve(variant, main_store, qty)
             
             order.subtotal = subtotal
             order.total_amount = subtotal
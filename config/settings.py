@@ -47,6 +47,7 @@ INSTALLED_APPS = [
     "django_filters",
     
     # Local apps
+    "apps.core",
     "apps.users",
     "apps.catalog",
     "apps.inventory",
@@ -173,6 +174,40 @@ CORS_ALLOWED_ORIGINS = config(
 
 CORS_ALLOW_CREDENTIALS = True
 
+# Document numbers (SO/INV/PO/GRN/TRF), committed on their own connection in
+# blocks of this size per worker process (rolled-back inserts leave gaps).
+# 0 = gap-free, but the counter row stays locked until the request commits
+DOCUMENT_SEQUENCE_BLOCK_SIZE = config('DOCUMENT_SEQUENCE_BLOCK_SIZE', default=1, cast=int)
+
+# Minutes a customer's PENDING order holds its reservation before
+# expire_reservations cancels it (0 = never expire)
+ORDER_RESERVATION_TTL_MINUTES = config('ORDER_RESERVATION_TTL_MINUTES', default=30, cast=int)
+
+# Availability cache (apps.inventory.cache). Entries per process, seconds an
+# entry may be served without a shared invalidation, and an optional CACHES
+# alias that shares versions/values across processes ('' = process-local)
+AVAILABILITY_CACHE_SIZE = config('AVAILABILITY_CACHE_SIZE', default=10000, cast=int)
+AVAILABILITY_CACHE_TIMEOUT = config('AVAILABILITY_CACHE_TIMEOUT', default=60, cast=int)
+AVAILABILITY_CACHE_ALIAS = config('AVAILABILITY_CACHE_ALIAS', default='')
+
+# Default method for valuation and COGS reports (apps.inventory.valuation):
+# 'fifo' or 'average'. Both are maintained; reports can ask for either
+INVENTORY_VALUATION_METHOD = config('INVENTORY_VALUATION_METHOD', default='fifo')
+
+# Hours a stored Idempotency-Key response is replayed to retries of its
+# create request (apps.core.idempotency)
+IDEMPOTENCY_KEY_TTL_HOURS = config('IDEMPOTENCY_KEY_TTL_HOURS', default=24, cast=int)
+
+# Background jobs (apps.core.jobs, run by `manage.py run_workers`): first
+# retry delay (doubling per attempt, capped), and seconds after which a
+# RUNNING job whose worker stopped reporting is claimed again
+JOB_RETRY_BACKOFF_SECONDS = config('JOB_RETRY_BACKOFF_SECONDS', default=10, cast=int)
+JOB_RETRY_BACKOFF_MAX_SECONDS = config('JOB_RETRY_BACKOFF_MAX_SECONDS', default=3600, cast=int)
+JOB_TIMEOUT_SECONDS = config('JOB_TIMEOUT_SECONDS', default=600, cast=int)
+
+# Days from invoice date to due date for invoices created on order confirmation
+INVOICE_DUE_DAYS = config('INVOICE_DUE_DAYS', default=30, cast=int)
+
 # Login/Logout Redirects
 LOGIN_REDIRECT_URL = '/api/catalog/products/'
 LOGOUT_REDIRECT_URL = '/api-auth/login/'